@@ -207,8 +207,12 @@ class DoD:
                 continue  # to go to the next group
 
             # Pre-check
-            # TODO: with a connected components index we can pre-filter many of those groups without checking
+            # Tables in different components of the join graph cannot be joined, skip the group without searching
             #group_with_all_relations, join_path_groups = self.joinable(candidate_group, cache_unjoinable_pairs)
+            reachability_index = self.aurum_api._network.get_reachability_index()
+            if reachability_index is not None and not reachability_index.same_component(candidate_group):
+                print("Group: " + str(candidate_group) + " is Non-Joinable (disconnected)")
+                continue
             max_hops = max_hops
             # We find the different join graphs that would join the candidate_group
             join_graphs = self.joinable(candidate_group, cache_unjoinable_pairs, max_hops=max_hops)
@@ -281,11 +285,16 @@ class DoD:
 
         # for each pair of tables in group keep list of (path, tables_covered)
         paths_per_pair = defaultdict(list)
+        reachability_index = self.aurum_api._network.get_reachability_index()
 
         for table1, table2 in itertools.combinations(group_tables, 2):
             # Check if tables are already known to be unjoinable
             if (table1, table2) in cache_unjoinable_pairs.keys() or (table2, table1) in cache_unjoinable_pairs.keys():
                 continue
+            if reachability_index is not None and not reachability_index.reachable(table1, table2, max_hops):
+                cache_unjoinable_pairs[(table1, table2)] += 1
+                cache_unjoinable_pairs[(table2, table1)] += 1
+                continue
             t1 = self.aurum_api.make_drs(table1)
             t2 = self.aurum_api.make_drs(table2)
             t1.set_table_mode()
@@ -94,9 +94,7 @@ class Algebra:
 
         # Check neighbors
         if not relation.from_metadata():
-            for h in i_drs:
-                hits_drs = self._network.neighbors_id(h, relation)
-                o_drs = o_drs.absorb(hits_drs)
+            o_drs = self._neighbors_to_drs(o_drs, [h for h in i_drs], relation)
         else:
             md_relation = self._relation_to_mdrelation(relation)
             for h in i_drs:
@@ -105,6 +103,38 @@ class Algebra:
                 o_drs = o_drs.absorb(hits_drs)
         return o_drs
 
+    def _neighbors_to_drs(self, o_drs, hits, relation: Relation) -> DRS:
+        """
+        Finds the neighbors of all hits with one batched query, and adds them to o_drs with the provenance
+        of one neighbors_id per hit, building the data and the provenance graph once
+        :param o_drs: the output DRS, its provenance is extended in place
+        :param hits: the input Hits
+        :param relation: Relation
+        :return: o_drs
+        """
+        src, dst, score = self._network.neighbors_batch([h.nid for h in hits], relation)
+        input_hits = {str(h.nid): h for h in hits}
+        info = {nid: (db, source, field) for nid, db, source, field in
+                self._network.get_info_for(set(dst.tolist()))}
+
+        op = self._network.get_op_from_relation(relation)
+        data = dict()
+        edges = []
+        for s, d, sc in zip(src.tolist(), dst.tolist(), score.tolist()):
+            db, source, field = info[d]
+            hit = Hit(d, db, source, field, sc)
+            data.pop(d, None)  # the last score found is kept, as absorb does
+            data[d] = hit
+            edges.append((input_hits[s], hit, op, {}))
+
+        # hits are added as the parameter of each neighbor lookup
+        o_drs.get_provenance().add_edges(hits, edges)
+
+        merged = {str(h.nid): h for h in o_drs.data}
+        merged.update(data)
+        o_drs.set_data(list(merged.values()))
+        return o_drs
+
     def content_similar_to(self, general_input):
         return self.__neighbor_search(input_data=general_input, relation=Relation.CONTENT_SIM)
 
@@ -143,10 +173,17 @@ class Algebra:
         if drs_b != drs_a:
             o_drs.absorb_provenance(drs_b)
 
+        reachability_index = None
+        if relation == Relation.PKFK:
+            reachability_index = self._network.get_reachability_index()
+
         for h1, h2 in itertools.product(drs_a, drs_b):
 
             # there are different network operations for table and field mode
             res_drs = None
+            if drs_a.mode == DRSMode.TABLE and reachability_index is not None and \
+                    not reachability_index.reachable(h1, h2, max_hops):
+                continue  # no path between these tables, skip the search
             if drs_a.mode == DRSMode.FIELDS:
                 res_drs = self._network.find_path_hit(
                     h1, h2, relation, max_hops=max_hops)
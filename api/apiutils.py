@@ -134,50 +134,214 @@ class DRSMode(Enum):
     TABLE = 1
 
 
+# Nodes of the operator DAG of a lazy Provenance. They keep the operation, the inputs and references to the data,
+# and are never modified once created, so a provenance absorbed by another one is not affected by later changes
+# ProvOperation: the operation that created the DRS, with its data, and the origin Hit of lookups
+ProvOperation = namedtuple('ProvOperation', 'data, op, params, origin')
+# ProvGraph: a Hit-level provenance graph that is already built
+ProvGraph = namedtuple('ProvGraph', 'graph')
+# ProvAbsorb: input absorbs right, and edges into Hits in both left_data and right_data are annotated with labels
+ProvAbsorb = namedtuple('ProvAbsorb', 'input, right, labels, left_data, right_data')
+# ProvEdges: (source, target, key, data) edges added to input
+ProvEdges = namedtuple('ProvEdges', 'input, nodes, edges')
+
+# Whether DRS record their provenance lazily when not told otherwise, see set_lazy_provenance
+global_lazy_provenance = False
+
+
+def set_lazy_provenance(lazy: bool):
+    """
+    Makes the DRS created from now on record their provenance lazily (or eagerly) when not told otherwise. Lazy
+    provenance records the operator DAG only, and builds the Hit-level graph when it is first asked for
+    :param lazy: True for lazy provenance
+    """
+    global global_lazy_provenance
+    global_lazy_provenance = lazy
+
+
+def new_origin_hit(params):
+    global global_origin_id
+    hit = Hit(global_origin_id, params[0], params[0], params[0], -1)
+    global_origin_id += 1
+    return hit
+
+
+def copy_prov_graph(graph):
+    copy = nx.MultiDiGraph()
+    copy.add_nodes_from(graph.nodes_iter(data=True))
+    copy.add_edges_from(graph.edges_iter(keys=True, data=True))
+    return copy
+
+
+def compose_prov_graphs(graph, others):
+    """
+    Same graph as nx.compose(... nx.compose(nx.compose(graph, others[0]), others[1]) ..., others[-1]), in one pass
+    """
+    composed = nx.MultiDiGraph()
+    # nx.compose adds the nodes of its second graph first
+    for other in reversed(others):
+        composed.add_nodes_from(other.nodes_iter())
+    composed.add_nodes_from(graph.nodes_iter())
+    for g in [graph] + others:
+        composed.add_edges_from(g.edges_iter(keys=True, data=True))
+    return composed
+
+
+def annotate_prov_graph(graph, node: ProvAbsorb):
+    """
+    Labels the edges into the Hits that are in both left_data and right_data, as DRS.absorb_provenance does
+    """
+    if len(node.labels) == 0:
+        return
+    for el in set(node.left_data).intersection(set(node.right_data)):
+        if el not in graph:
+            continue
+        for src in graph.predecessors_iter(el):
+            edge_data = graph[src][el]
+            for e in edge_data:
+                for label in node.labels:
+                    edge_data[e][label] = 1
+
+
+def build_prov_graph(node, built=None):
+    """
+    Builds the Hit-level provenance graph of a node of the operator DAG, as the eager Provenance would have
+    :param node: ProvOperation, ProvGraph, ProvAbsorb or ProvEdges
+    :param built: node id -> graph, for the inputs shared in the DAG
+    :return: a new MultiDiGraph
+    """
+    if built is None:
+        built = dict()
+    # Walk the chain of inputs down to its first node, and apply the chain on top of it
+    chain = []
+    while id(node) not in built and type(node) in (ProvAbsorb, ProvEdges):
+        chain.append(node)
+        node = node.input
+    if id(node) in built:
+        graph = copy_prov_graph(built[id(node)])
+    elif type(node) == ProvGraph:
+        graph = copy_prov_graph(node.graph)
+    else:
+        graph = nx.MultiDiGraph()
+        Provenance.add_operation(graph, node.data, node.op, node.params, origin=node.origin)
+    root = chain[0] if len(chain) > 0 else node
+    chain.reverse()
+    i = 0
+    while i < len(chain):
+        node = chain[i]
+        if type(node) == ProvEdges:
+            graph.add_nodes_from(node.nodes)
+            graph.add_edges_from(node.edges)
+            i += 1
+            continue
+        # compose runs of absorbs at once, absorbs that annotate edges end a run
+        others = []
+        while i < len(chain) and type(chain[i]) == ProvAbsorb:
+            others.append(build_prov_graph(chain[i].right, built))
+            i += 1
+            if len(chain[i - 1].labels) > 0:
+                break
+        graph = compose_prov_graphs(graph, others)
+        annotate_prov_graph(graph, chain[i - 1])
+    built[id(root)] = graph
+    return graph
+
+
 class Provenance:
     """
     Nodes are Hit (only). Origin nodes are given a special Hit object too.
+    A lazy Provenance records the operator DAG instead (see ProvOperation) and builds the graph on demand.
     """
 
-    def __init__(self, data, operation):
-        self._p_graph = nx.MultiDiGraph()
+    def __init__(self, data, operation, lazy=False):
+        self._lazy = lazy
+        self._p_graph = None
+        self._node = None
         op = operation.op
         params = operation.params
-        self.populate_provenance(data, op, params)
+        if lazy:
+            origin = None
+            if op == OP.SCHNAME_LOOKUP or op == OP.ENTITY_LOOKUP or op == OP.KW_LOOKUP:
+                origin = new_origin_hit(params)  # take the origin id now, as the eager provenance does
+            self._node = ProvOperation(data, op, params, origin)
+        else:
+            self._p_graph = nx.MultiDiGraph()
+            self.populate_provenance(data, op, params)
         # cache for leafs and heads
         self._cached_leafs_and_heads = (None, None)
 
+    @property
+    def lazy(self):
+        return self._lazy
+
     def prov_graph(self):
         self.invalidate_leafs_heads_cache()  # for safety invalidate cache
+        if self._p_graph is None:
+            self._p_graph = build_prov_graph(self._node)
+            self._node = ProvGraph(self._p_graph)
         return self._p_graph
 
     def swap_p_graph(self, new):
         self.invalidate_leafs_heads_cache()  # for safety invalidate cache
         self._p_graph = new
+        if self._lazy:
+            self._node = ProvGraph(new)
 
-    def populate_provenance(self, data, op, params):
+    def operator_node(self):
+        """
+        :return: the node of the operator DAG with the current provenance
+        """
+        if self._lazy:
+            return self._node
+        return ProvGraph(self._p_graph)
+
+    def absorb(self, provenance, labels=(), my_data=(), merging_data=()):
+        """
+        Lazy only: records that provenance is merged into this one, see DRS.absorb_provenance
+        """
+        self.invalidate_leafs_heads_cache()
+        self._node = ProvAbsorb(self._node, provenance.operator_node(), labels, my_data, merging_data)
+        self._p_graph = None
+
+    def add_edges(self, nodes, edges):
+        """
+        Adds nodes and (source, target, key, data) edges to the provenance graph
+        :param nodes: Hits
+        :param edges: 4-tuples
+        """
+        self.invalidate_leafs_heads_cache()
+        if self._lazy:
+            self._node = ProvEdges(self._node, nodes, edges)
+            self._p_graph = None
+        else:
+            self._p_graph.add_nodes_from(nodes)
+            self._p_graph.add_edges_from(edges)
+
+    @staticmethod
+    def add_operation(graph, data, op, params, origin=None):
         if op == OP.NONE:
             # This is a carrier DRS, skip
             return
         elif op == OP.ORIGIN:
             for element in data:
-                self._p_graph.add_node(element)
+                graph.add_node(element)
         # We check operations that come with parameters
         elif op == OP.SCHNAME_LOOKUP or op == OP.ENTITY_LOOKUP or op == OP.KW_LOOKUP:
-            global global_origin_id
-            hit = Hit(global_origin_id, params[0], params[0], params[0], -1)
-            global_origin_id += 1
-            self._p_graph.add_node(hit)
+            hit = origin if origin is not None else new_origin_hit(params)
+            graph.add_node(hit)
             for element in data:  # now we connect the new node to data with the op
-                self._p_graph.add_node(element)
-                self._p_graph.add_edge(hit, element, op)
+                graph.add_node(element)
+                graph.add_edge(hit, element, op)
         else:  # This all come with a Hit parameter
             hit = params[0]  # get the hit that comes with the op otherwise
-            self._p_graph.add_node(hit)  # we add the param
+            graph.add_node(hit)  # we add the param
             for element in data:  # now we connect the new node to data with the op
-                self._p_graph.add_node(element)
-                self._p_graph.add_edge(hit, element, op)
-                self.invalidate_leafs_heads_cache()
+                graph.add_node(element)
+                graph.add_edge(hit, element, op)
+
+    def populate_provenance(self, data, op, params):
+        self.add_operation(self._p_graph, data, op, params)
+        self.invalidate_leafs_heads_cache()
 
     def get_leafs_and_heads(self):
         # Compute leafs and heads
@@ -185,9 +349,10 @@ class Provenance:
             return self._cached_leafs_and_heads[0], self._cached_leafs_and_heads[1]
         leafs = []
         heads = []
-        for node in self._p_graph.nodes():
-            pre = self._p_graph.predecessors(node)
-            suc = self._p_graph.successors(node)
+        p_graph = self.prov_graph()
+        for node in p_graph.nodes():
+            pre = p_graph.predecessors(node)
+            suc = p_graph.successors(node)
             no_cycles = set(pre) - set(suc)
             pre = list(no_cycles)
             if len(pre) == 0 and len(suc) == 0:
@@ -208,7 +373,7 @@ class Provenance:
             leafs, heads = self.get_leafs_and_heads()
         all_paths = []
         for l in leafs:
-            paths = nx.all_simple_paths(self._p_graph, l, a)
+            paths = nx.all_simple_paths(self.prov_graph(), l, a)
             all_paths.extend(paths)
         return all_paths
 
@@ -233,20 +398,20 @@ class Provenance:
         all_paths = []
         if a in leafs:
             for h in heads:
-                paths = nx.all_simple_paths(self._p_graph, a, h)
+                paths = nx.all_simple_paths(self.prov_graph(), a, h)
                 all_paths.extend(paths)
         elif a in heads:
             for l in leafs:
-                paths = nx.all_simple_paths(self._p_graph, l, a)
+                paths = nx.all_simple_paths(self.prov_graph(), l, a)
                 all_paths.extend(paths)
         else:
             upstreams = []
             for l in leafs:
-                paths = nx.all_simple_paths(self._p_graph, l, a)
+                paths = nx.all_simple_paths(self.prov_graph(), l, a)
                 upstreams.extend(paths)
             downstreams = []
             for h in heads:
-                paths = nx.all_simple_paths(self._p_graph, a, h)
+                paths = nx.all_simple_paths(self.prov_graph(), a, h)
                 downstreams.extend(paths)
 
             if len(downstreams) > len(upstreams):
@@ -284,7 +449,7 @@ class Provenance:
                 pair = p[idx::slice_range(idx)]
                 src, trg = pair
                 explanation = explanation + get_name_from_hit(src) + " -> "
-                edge_info = self._p_graph[src][trg]
+                edge_info = self.prov_graph()[src][trg]
                 explanation = explanation + get_string_from_edge_info(edge_info) + " -> " \
                     + get_name_from_hit(trg) + '\n'
         return explanation
@@ -296,10 +461,19 @@ class DRS:
         CERTAINTY = 0
         COVERAGE = 1
 
-    def __init__(self, data, operation, lean_drs=False):
+    def __init__(self, data, operation, lean_drs=False, lazy_provenance=None):
+        """
+        :param data: Hits
+        :param operation: Operation that produced data
+        :param lean_drs: if True, no provenance is kept
+        :param lazy_provenance: if True, the provenance graph is built only when asked for. None means
+        global_lazy_provenance, see set_lazy_provenance
+        """
         self._data = data
+        if lazy_provenance is None:
+            lazy_provenance = global_lazy_provenance
         if not lean_drs:
-            self._provenance = Provenance(data, operation)
+            self._provenance = Provenance(data, operation, lazy=lazy_provenance)
         self._table_view = []
         self._idx = 0
         self._idx_table = 0
@@ -445,6 +619,19 @@ class DRS:
 
         # Reset ranking
         self._ranked = False
+        if self._provenance.lazy:
+            # Record the merge only, the annotations are applied when the graph is built
+            labels = []
+            if annotate_and_edges:
+                labels.append('AND')
+            if annotate_or_edges:
+                labels.append('OR')
+            if len(labels) > 0:
+                self._provenance.absorb(drs.get_provenance(), labels, self.data, drs.data)
+            else:
+                # the data is only needed to annotate, so long chains of absorbs do not keep every step of it
+                self._provenance.absorb(drs.get_provenance())
+            return self
         # Get prov graph of merging
         prov_graph_of_merging = drs.get_provenance().prov_graph()
         # Compose into my prov graph
@@ -485,7 +672,7 @@ class DRS:
     def intersection(self, drs):
         # Reset ranking
         self._ranked = False
-        result = DRS([], Operation(OP.NONE))
+        result = DRS([], Operation(OP.NONE), lazy_provenance=self._provenance.lazy)
         new_data = []
         # FIXME: There are more efficient ways of doing this
         if drs.mode == DRSMode.TABLE:
@@ -514,7 +701,7 @@ class DRS:
     def union(self, drs):
         # Reset ranking
         self._ranked = False
-        result = DRS([], Operation(OP.NONE))
+        result = DRS([], Operation(OP.NONE), lazy_provenance=self._provenance.lazy)
         merging_data = set(drs.data)
         my_data = set(self.data)
         new_data = merging_data.union(my_data)
@@ -531,7 +718,7 @@ class DRS:
     def set_difference(self, drs):
         # Reset ranking
         self._ranked = False
-        result = DRS([], Operation(OP.NONE))
+        result = DRS([], Operation(OP.NONE), lazy_provenance=self._provenance.lazy)
         merging_data = set(drs.data)
         my_data = set(self.data)
         new_data = my_data - merging_data
@@ -45,23 +45,10 @@ class Report:
     def compute_all_statistics(self):
         self.__num_columns = self.__network.graph_order()
         self.__num_tables = self.__network.get_number_tables()
-        # FIXME: Failing due to cardinality being attached as float to graph nodes ??
-        # relations = graph.edges(keys=True)
-        content_sim_relations_gen = self.__network.enumerate_relation(
-            Relation.CONTENT_SIM)
-        # FIXME: counting twice (both directions), so /2. Once edges works, we
-        # can modify it
-        total_content_sim_relations = len([x for x in content_sim_relations_gen])
-        self.__num_content_sim_relations = total_content_sim_relations
-
-        schema_sim_relations_gen = self.__network.enumerate_relation(
-            Relation.SCHEMA_SIM)
-        total_schema_sim_relations = len([x for x in schema_sim_relations_gen])
-        self.__num_schema_sim_relations = total_schema_sim_relations
-
-        pkfk_relations_gen = self.__network.enumerate_relation(Relation.PKFK)
-        total_pkfk_relations = len([x for x in pkfk_relations_gen])
-        self.__num_pkfk_relations = total_pkfk_relations
+        # edge counts are kept by the network, stored with binary models
+        self.__num_content_sim_relations = self.__network.relation_count(Relation.CONTENT_SIM)
+        self.__num_schema_sim_relations = self.__network.relation_count(Relation.SCHEMA_SIM)
+        self.__num_pkfk_relations = self.__network.relation_count(Relation.PKFK)
 
         return self
 
@@ -3,6 +3,10 @@ from api.apiutils import DRS
 from api.apiutils import Operation
 from api.apiutils import OP
 from api.apiutils import Hit
+from api.apiutils import ProvAbsorb
+from api.apiutils import ProvEdges
+from api.apiutils import ProvGraph
+from api.apiutils import ProvOperation
 from ddapi import API
 
 
@@ -271,5 +275,81 @@ class TestApiutils(unittest.TestCase):
         self.assertTrue(ld == 4)
 
 
+class TestLazyProvenance(unittest.TestCase):
+
+    @staticmethod
+    def query(lazy):
+        # nids do not clash with the origin ids of lookups
+        h = [Hit(100 + i, "dba", "table_" + str(i % 3), "f" + str(i), i / 10) for i in range(12)]
+        drs1 = DRS(h[0:5], Operation(OP.ORIGIN), lazy_provenance=lazy)
+        drs2 = DRS(h[3:8], Operation(OP.CONTENT_SIM, params=[h[0]]), lazy_provenance=lazy)
+        drs3 = DRS(h[6:12], Operation(OP.KW_LOOKUP, params=["kw"]), lazy_provenance=lazy)
+        drs4 = DRS(h[8:10], Operation(OP.PKFK, params=[h[4]]), lazy_provenance=lazy)
+        union = drs1.union(drs2)
+        inter = union.intersection(drs3)
+        diff = drs3.set_difference(drs2)
+        inter.absorb(drs4)
+        inter.absorb_provenance(diff, annotate_or_edges=True)
+        inter.get_provenance().add_edges([h[1]], [(h[1], h[11], OP.SCHEMA_SIM, {})])
+        return inter
+
+    @staticmethod
+    def name(n):
+        # the origin Hits of lookups get new ids each time, so nodes are compared by name
+        return n.db_name, n.source_name, n.field_name
+
+    def graph_of(self, drs):
+        name = self.name
+        prov_graph = drs.get_provenance().prov_graph()
+        nodes = [name(n) for n in prov_graph.nodes()]
+        edges = [(name(a), name(b), k, d) for a, b, k, d in prov_graph.edges(keys=True, data=True)]
+        return nodes, edges
+
+    def test_same_provenance(self):
+        eager = self.query(False)
+        lazy = self.query(True)
+        self.assertFalse(type(lazy.get_provenance().operator_node()) == ProvGraph)
+        self.assertEqual(eager.data, lazy.data)
+        self.assertEqual(self.graph_of(eager), self.graph_of(lazy))
+        self.assertTrue(type(lazy.get_provenance().operator_node()) == ProvGraph)
+        self.assertEqual(len(eager.paths()), len(lazy.paths()))
+        for h in eager.data:
+            self.assertEqual(set(map(self.name, eager.why(h))), set(map(self.name, lazy.why(h))))
+            self.assertEqual([list(map(self.name, p)) for p in eager.get_provenance().compute_paths_from_origin_to(h)],
+                             [list(map(self.name, p)) for p in lazy.get_provenance().compute_paths_from_origin_to(h)])
+        self.assertEqual(eager.rank_coverage()._chosen_rank, lazy.rank_coverage()._chosen_rank)
+
+    def test_absorbed_provenance_is_not_changed(self):
+        h = [Hit(i, "dba", "table_a", "f" + str(i), -1) for i in range(4)]
+        for lazy in [False, True]:
+            drs1 = DRS(h[0:2], Operation(OP.ORIGIN), lazy_provenance=lazy)
+            drs2 = DRS(h[2:3], Operation(OP.CONTENT_SIM, params=[h[1]]), lazy_provenance=lazy)
+            drs1.absorb(drs2)
+            drs2.absorb(DRS(h[3:4], Operation(OP.CONTENT_SIM, params=[h[2]]), lazy_provenance=lazy))
+            self.assertEqual(set(drs1.get_provenance().prov_graph().nodes()), set(h[0:3]))
+            self.assertEqual(set(drs2.get_provenance().prov_graph().nodes()), set(h[1:4]))
+
+    def test_absorb_chain_does_not_keep_data(self):
+        drs = DRS([], Operation(OP.NONE), lazy_provenance=True)
+        for i in range(200):
+            hits = [Hit(1000 + i * 3 + j, "dba", "table_a", "f", -1) for j in range(3)]
+            drs.absorb(DRS(hits, Operation(OP.CONTENT_SIM, params=[Hit(i, "dba", "table_b", "g", -1)]),
+                           lazy_provenance=True))
+        self.assertEqual(drs.size(), 600)
+        # the DAG keeps the data of each operation, but none of the intermediate data of the absorbs
+        retained = 0
+        nodes = [drs.get_provenance().operator_node()]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            if type(node) == ProvAbsorb:
+                self.assertEqual(len(node.left_data) + len(node.right_data), 0)
+                nodes.extend([node.input, node.right])
+            elif type(node) == ProvEdges:
+                nodes.append(node.input)
+            elif type(node) == ProvOperation:
+                retained += len(node.data)
+        self.assertEqual(retained, 600)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,9 @@
 from api.apiutils import DRS
+from api.apiutils import Operation
 from api.apiutils import Relation
 from api.apiutils import OP
 from api.apiutils import Hit
 from api.annotation import MRS
-from knowledgerepr.inmemoryekg import InMemoryEKG
-from knowledgerepr.gindexekg import GIndexEKG
 
 from enum import Enum
 
@@ -22,9 +21,12 @@ class EKGapi:
 
     def __init__(self, backend_type: BackEndType, config=None):
         self.backend_type = backend_type
+        # backends import this module, so they are imported here
         if self.backend_type == BackEndType.IN_MEMORY:
+            from knowledgerepr.inmemoryekg import InMemoryEKG
             self.backend = InMemoryEKG(config)
         elif self.backend_type == BackEndType.G_INDEX:
+            from knowledgerepr.gindexekg import GIndexEKG
             self.backend = GIndexEKG(config)
 
     @staticmethod
@@ -52,6 +54,25 @@ class EKGapi:
         if relation == Relation.CONTAINER:
             return OP.CONTAINER
 
+    @staticmethod
+    def paths_to_drs(paths, relation):
+        """
+        Assembles the result of a path query as FieldNetwork.find_path_hit does
+        :param paths: list of paths, each a list of Hits from source to target
+        :param relation: the relation the paths follow
+        :return: DRS with the target as data and the paths as provenance, empty if there are no paths
+        """
+        o_drs = DRS([], Operation(OP.NONE))  # Carrier of provenance
+        op = EKGapi.get_op_from_relation(relation)
+        for hits in paths:
+            if len(hits) == 1:
+                hits = hits + hits  # source is the target
+            o_drs.absorb_provenance(DRS([hits[0]], Operation(OP.ORIGIN)))
+            for prev_c, c in zip(hits[:-2], hits[1:-1]):
+                o_drs.absorb_provenance(DRS([c], Operation(op, params=[prev_c])))
+            o_drs = o_drs.absorb(DRS([hits[-1]], Operation(op, params=[hits[-2]])))
+        return o_drs
+
     """
     WRITE OPS
     """
@@ -60,7 +81,7 @@ class EKGapi:
         self.backend.init_meta_schema(fields)
 
     def add_node(self, nid, cardinality=None):
-        self.backend.add_field(nid)
+        self.backend.add_field(nid, cardinality)
 
     def add_nodes(self, list_of_fields):
         self.backend.add_fields(list_of_fields)
@@ -78,15 +99,18 @@ class EKGapi:
     def md_neighbors_id(self, hit: Hit, md_neighbors: MRS, relation: Relation) -> DRS:
         return self.backend.md_neighbors_id(hit, md_neighbors, relation)
 
+    def find_path_hit(self, source, target, relation, max_hops=5) -> DRS:
+        return self.backend.find_path_hit(source, target, relation, max_hops=max_hops)
+
     """
     ANALYTICAL OPS
     """
 
     def topk_nodes_by_degree(self, topk):
-        self.backend.topk_nodes_by_degree(topk)
+        return self.backend.topk_nodes_by_degree(topk)
 
     def enumerate_edges_of_type(self, relation):
-        self.backend.enumerate_edges_of_type(relation)
+        return self.backend.enumerate_edges_of_type(relation)
 
     """
     UTILS
@@ -5,6 +5,7 @@
 // Copyright   : Whatever Aurum's license is
 // Description : Graph Index Skeleton
 // g++ -dynamiclib -o graph_index.so GraphIndex.cpp
+// on linux: g++ -std=c++11 -O2 -shared -fPIC -o graph_index.so GraphIndex.cpp
 //============================================================================
 
 #include <iostream>
@@ -76,7 +77,7 @@ extern "C" {
             g[source_id][target_id] = type;
             number_edges++;
         }
-        else if ((g[source_id][target_id] | type) == 0) {
+        else if ((g[source_id][target_id] & type) == 0) {
             g[source_id][target_id] |= type;
             number_edges++;
         }
@@ -89,34 +90,52 @@ extern "C" {
         return true;
     }
 
+    // Bulk load: adds the n undirected edges source_ids[i] - target_ids[i] of one type, read from the caller buffers
+    int add_undirected_edges(int32_t* source_ids, int32_t* target_ids, int n, char type) {
+        int added = 0;
+        for (int i = 0; i < n; i++) {
+            if (add_edge(source_ids[i], target_ids[i], type)) {
+                add_edge(target_ids[i], source_ids[i], type);
+                added++;
+            }
+        }
+        return added;
+    }
+
+    void clear_graph() {
+        g.clear();
+        number_edges = 0;
+    }
+
     int neighbors(int32_t** output, int id, char type) {
         vector<int> n;
-        unordered_map<int, char> nodes_map = g[id];
-        for ( auto it = nodes_map.begin(); it != nodes_map.end(); ++it) {
-            if ((it->second & type) == 1) {
-                n.push_back(it->first);
+        auto found = g.find(id);
+        if (found != g.end()) {
+            for ( auto it = found->second.begin(); it != found->second.end(); ++it) {
+                if ((it->second & type) != 0) {
+                    n.push_back(it->first);
+                }
             }
         }
 
         // copy to array
-        int32_t* array = (int32_t*) malloc(n.size() * sizeof(int32_t));
-        //int array[n.size()];
+        int32_t* array = (int32_t*) malloc((n.size() + 1) * sizeof(int32_t));
         for (int i = 0; i < n.size(); i++) {
-            int id = n[i];
-            cout << id << endl;
-            array[i] = id;
+            array[i] = n[i];
         }
 
         *output = array;
-        cout << n.size() << endl;
         return n.size();
     }
 
     vector<int> neighbors_local(int id, char type) {
         vector<int> n;
-        unordered_map<int, char> nodes_map = g[id];
-        for ( auto it = nodes_map.begin(); it != nodes_map.end(); ++it) {
-            if ((it->second & type) == 1) {
+        auto found = g.find(id);
+        if (found == g.end()) {
+            return n;
+        }
+        for ( auto it = found->second.begin(); it != found->second.end(); ++it) {
+            if ((it->second & type) != 0) {
                 n.push_back(it->first);
             }
         }
@@ -129,7 +148,6 @@ extern "C" {
 
     int all_paths(int32_t** output, int source_id, int target_id, char type, int max_hops) {
         //cout << "find path from " + to_string(source_id) + " to: " + to_string(target_id) << endl;
-        clock_t begin = clock();
         int level = 0;
         vector<int> next_level;
         next_level.push_back(source_id);
@@ -166,7 +184,7 @@ extern "C" {
                     }
                 }
             }
-            if (max_hops <= level){
+            if (max_hops <= level || seen.count(target_id) == 1){
                 break;
             }
         }
@@ -203,7 +221,9 @@ extern "C" {
                 }
             }
             else {
-                stack[(top - 1)][1] += 1;
+                if (top > 0) {
+                    stack[(top - 1)][1] += 1;
+                }
                 top -= 1;
             }
         }
@@ -234,10 +254,6 @@ extern "C" {
             }
         }
 
-        clock_t end = clock();
-        double secs = double(end - begin) / CLOCKS_PER_SEC;
-        cout << secs << endl;
-
         *output = array;
         return total_paths_plus_nodes;
     }
@@ -280,7 +296,7 @@ extern "C" {
                     }
                 }
             }
-            if (max_hops <= level){
+            if (max_hops <= level || seen.count(target_id) == 1){
                 break;
             }
         }
@@ -317,7 +333,9 @@ extern "C" {
                 }
             }
             else {
-                stack[(top - 1)][1] += 1;
+                if (top > 0) {
+                    stack[(top - 1)][1] += 1;
+                }
                 top -= 1;
             }
         }
@@ -341,14 +359,14 @@ extern "C" {
         cout << "Serializing graph to: " + path << endl;
         ofstream f;
         f.open(path);
+        f << "source,target,type\n";
         for ( auto it = g.begin(); it != g.end(); ++it) {
             int src = it->first;
             unordered_map<int, char> sub = it->second;
             for ( auto it2 = sub.begin(); it2 != sub.end(); ++it2) {
                 int tgt = it2->first;
                 char type = it2->second;
-                string ser = std::to_string(src) + "-" + std::to_string(tgt) + "-" + std::to_string(type) + "\n";
-                cout << ser << endl;
+                string ser = std::to_string(src) + "," + std::to_string(tgt) + "," + std::to_string(type) + "\n";
                 f << ser;
             }
         }
@@ -372,14 +390,12 @@ extern "C" {
                 string tgt = tokens[1];
                 string type = tokens[2];
 //                cout << src + " . " + tgt + " . " + type << '\n';
-                // TODO: transform to int and char first
                 int src_id = stoi(src);
                 int tgt_id = stoi(tgt);
-                //char type_ch = (char)(stoi(type));
-                char type_ch = (char)(stoi("1"));
+                char type_ch = (char)(stoi(type));
                 add_node(src_id);
                 add_node(tgt_id);
-                add_edge(src_id, tgt_id, type_ch); // FIXME: pass right type
+                add_edge(src_id, tgt_id, type_ch);
             }
         }
         f.close();
@@ -425,7 +441,7 @@ public:
             g[source_id][target_id] = type;
             number_edges++;
         }
-        else if ((g[source_id][target_id] | type) == 0) {
+        else if ((g[source_id][target_id] & type) == 0) {
             g[source_id][target_id] |= type;
             number_edges++;
         }
@@ -442,7 +458,7 @@ public:
         vector<int> n;
         unordered_map<int, char> nodes_map = g[id];
         for ( auto it = nodes_map.begin(); it != nodes_map.end(); ++it) {
-            if ((it->second & type) == 1) {
+            if ((it->second & type) != 0) {
                 n.push_back(it->first);
             }
         }
@@ -1,61 +1,55 @@
 import sys
-from knowledgerepr import api_gindex
 import time
-import numpy as np
+
+from api.apiutils import Relation
+from knowledgerepr import fieldnetwork
+from knowledgerepr.benchmarkutils import get_stats
+from knowledgerepr.benchmarkutils import neighbor_benchmark
+from knowledgerepr.benchmarkutils import path_benchmark
+from knowledgerepr.benchmarkutils import sample_queries
+from knowledgerepr.gindexekg import GIndexEKG
 
 """
+Compares the GIndexEKG backend with the networkx FieldNetwork on the neighbour and path queries of a model.
 Compile g-index library with:
 g++ -dynamiclib -o graph_index.so GraphIndex.cpp
-"""
-
-pairs_src = []
-pairs_tgt = []
-
+or, on linux:
+g++ -std=c++11 -O2 -shared -fPIC -o graph_index.so GraphIndex.cpp
 
-def path_benchmark(max_hops=0):
-    measurements = []
-    for src, tgt in zip(pairs_src, pairs_tgt):
-        s = time.time()
-        api_gindex.path_query(src, tgt, 1, max_hops)
-        e = time.time()
-        measurements.append((e-s))
-    return measurements
-
-
-def get_stats(list_measurements):
-    m = np.asarray(list_measurements)
-    avg = np.average(m)
-    median = np.percentile(m, 50)
-    p95 = np.percentile(m, 95)
-    p99 = np.percentile(m, 99)
-    return avg, median, p95, p99
+Usage: python benchmark_gindex.py <model_path> [num_queries]
+"""
 
 
-def main(path):
+def main(path, num_queries=100):
     print("Deserialising graph...")
-    api_gindex.deserialize_graph(path)
+    network = fieldnetwork.deserialize_network(path)
     print("Deserialising graph...OK")
-    nnodes = api_gindex.get_num_nodes()
-    print("Num nodes: " + str(nnodes))
-    nedges = api_gindex.get_num_edges()
-    print("Num edges: " + str(nnodes))
 
-    measurements_mh2 = path_benchmark(max_hops=2)
-    measurements_mh5 = path_benchmark(max_hops=5)
+    s = time.time()
+    gindex = GIndexEKG.from_field_network(network)
+    e = time.time()
+    print("Bulk load into g-index: " + str(e - s) + "s")
 
-    stats_mh2 = get_stats(measurements_mh2)
-    stats_mh5 = get_stats(measurements_mh5)
+    sample, pairs_src, pairs_tgt = sample_queries(list(network.iterate_ids()), num_queries)
 
     print("graph: " + str(path))
-    print("max_hops 2")
-    print(str(stats_mh2))
-    print("max_hops 5")
-    print(str(stats_mh5))
+    for name, backend in [("networkx", network), ("g-index", gindex)]:
+        for relation in [Relation.CONTENT_SIM, Relation.PKFK]:
+            stats = get_stats(neighbor_benchmark(backend, sample, relation))
+            print(name + " neighbors " + str(relation) + " (avg, median, p95, p99)")
+            print(str(stats))
+        for max_hops in [2, 5]:
+            stats = get_stats(path_benchmark(backend, pairs_src, pairs_tgt, Relation.PKFK, max_hops=max_hops))
+            print(name + " paths max_hops " + str(max_hops) + " (avg, median, p95, p99)")
+            print(str(stats))
 
 
 if __name__ == "__main__":
     print("Benchmark G-Index")
 
-    path = sys.argv[0]
+    path = sys.argv[1]
+    num_queries = 100
+    if len(sys.argv) > 2:
+        num_queries = int(sys.argv[2])
 
-    main(path)
+    main(path, num_queries)
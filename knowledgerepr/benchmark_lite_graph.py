@@ -0,0 +1,76 @@
+import sys
+import time
+import tracemalloc
+
+from api.apiutils import Relation
+from knowledgerepr.benchmarkutils import get_stats
+from knowledgerepr.benchmarkutils import neighbor_benchmark
+from knowledgerepr.benchmarkutils import path_benchmark
+from knowledgerepr.benchmarkutils import sample_queries
+from knowledgerepr.inmemoryekg import InMemoryEKG
+from knowledgerepr.syn_network_generator import generate_network_with
+
+"""
+Compares memory and query latency of the LiteGraph based InMemoryEKG with the networkx FieldNetwork, on synthetic
+networks of growing size.
+
+Usage: python benchmark_lite_graph.py [num_queries]
+"""
+
+# (num_nodes, num_nodes_per_table, num_schema_sim, num_content_sim, num_pkfk)
+network_sizes = [(1000, 10, 2000, 1500, 500),
+                 (10000, 10, 20000, 15000, 5000),
+                 (100000, 10, 200000, 150000, 50000)]
+
+
+def measure_memory(build):
+    """
+    :return: (result of build, bytes allocated by build that are still in use)
+    """
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def main(num_queries=100):
+    for num_nodes, num_nodes_per_table, num_schema_sim, num_content_sim, num_pkfk in network_sizes:
+        network, network_bytes = measure_memory(
+            lambda: generate_network_with(num_nodes=num_nodes, num_nodes_per_table=num_nodes_per_table,
+                                          num_schema_sim=num_schema_sim, num_content_sim=num_content_sim,
+                                          num_pkfk=num_pkfk))
+        ekg, ekg_bytes = measure_memory(lambda: InMemoryEKG.from_field_network(network))
+
+        print("nodes: " + str(num_nodes) + " schema_sim: " + str(num_schema_sim) + " content_sim: " +
+              str(num_content_sim) + " pkfk: " + str(num_pkfk))
+        print("networkx memory (MB): " + str(network_bytes / 1024 / 1024))
+        print("lite graph memory (MB): " + str(ekg_bytes / 1024 / 1024))
+
+        sample, pairs_src, pairs_tgt = sample_queries(list(network.iterate_ids()), num_queries)
+        for name, backend in [("networkx", network), ("lite graph", ekg)]:
+            for relation in [Relation.SCHEMA_SIM, Relation.PKFK]:
+                stats = get_stats(neighbor_benchmark(backend, sample, relation))
+                print(name + " neighbors " + str(relation) + " (avg, median, p95, p99)")
+                print(str(stats))
+            stats = get_stats(path_benchmark(backend, pairs_src, pairs_tgt, Relation.SCHEMA_SIM, max_hops=3))
+            print(name + " paths max_hops 3 (avg, median, p95, p99)")
+            print(str(stats))
+        s = time.time()
+        network.fields_degree(10)
+        e = time.time()
+        print("networkx top 10 by degree: " + str(e - s) + "s")
+        s = time.time()
+        ekg.topk_nodes_by_degree(10)
+        e = time.time()
+        print("lite graph top 10 by degree: " + str(e - s) + "s")
+
+
+if __name__ == "__main__":
+    print("Benchmark LiteGraph")
+
+    num_queries = 100
+    if len(sys.argv) > 1:
+        num_queries = int(sys.argv[1])
+
+    main(num_queries)
@@ -0,0 +1,48 @@
+import random
+import time
+
+import numpy as np
+
+"""
+Query latency measurements shared by the benchmarks of the EKG backends
+"""
+
+
+def sample_queries(nids, num_queries, seed=0):
+    """
+    :return: (nids for neighbour queries, source nids and target nids for path queries), drawn at random from nids
+    """
+    rnd = random.Random(seed)
+    sample = [rnd.choice(nids) for _ in range(num_queries)]
+    pairs_src = [rnd.choice(nids) for _ in range(num_queries)]
+    pairs_tgt = [rnd.choice(nids) for _ in range(num_queries)]
+    return sample, pairs_src, pairs_tgt
+
+
+def neighbor_benchmark(backend, nids, relation):
+    measurements = []
+    for nid in nids:
+        s = time.time()
+        backend.neighbors_id(nid, relation)
+        e = time.time()
+        measurements.append((e-s))
+    return measurements
+
+
+def path_benchmark(backend, pairs_src, pairs_tgt, relation, max_hops):
+    measurements = []
+    for src, tgt in zip(pairs_src, pairs_tgt):
+        s = time.time()
+        backend.find_path_hit(src, tgt, relation, max_hops=max_hops)
+        e = time.time()
+        measurements.append((e-s))
+    return measurements
+
+
+def get_stats(list_measurements):
+    m = np.asarray(list_measurements)
+    avg = np.average(m)
+    median = np.percentile(m, 50)
+    p95 = np.percentile(m, 95)
+    p99 = np.percentile(m, 99)
+    return avg, median, p95, p99
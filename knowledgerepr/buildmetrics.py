@@ -0,0 +1,189 @@
+import csv
+import json
+import resource
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Record of the stage running in this process, if any, so builder helpers can report their steps without
+# receiving it as a parameter
+_current_stage = None
+
+
+def _status_kb(field):
+    """
+    :return: the value of field (e.g., VmHWM) in /proc/self/status, in KB, or None where there is no /proc
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size of this process to its current size, so the next peak_rss_kb is the peak
+    from now on. Needs Linux >= 4.0
+    :return: True if the peak was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+    except OSError:
+        return False
+    return _status_kb("VmHWM") is not None
+
+
+def peak_rss_kb():
+    """
+    :return: the peak resident set size of this process since the last reset_peak_rss, or over its whole
+    lifetime where it cannot be reset, in KB
+    """
+    peak = _status_kb("VmHWM")
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak
+
+
+class StageRecord:
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_rss_kb = 0
+        self.peak_rss_lifetime = False  # True if peak_rss_kb is the peak of the whole process, not of the stage
+        self.rows_pulled = 0
+        self.edges = OrderedDict()  # relation name -> edges added
+        self.steps = []  # (step name, wall time, cpu time)
+        self.from_checkpoint = False
+
+    def as_dict(self):
+        return OrderedDict([("stage", self.name),
+                            ("wall_time", self.wall_time),
+                            ("cpu_time", self.cpu_time),
+                            ("peak_rss_kb", self.peak_rss_kb),
+                            ("peak_rss_lifetime", self.peak_rss_lifetime),
+                            ("rows_pulled", self.rows_pulled),
+                            ("edges", self.edges),
+                            ("steps", [OrderedDict([("step", name), ("wall_time", wall), ("cpu_time", cpu)])
+                                       for name, wall, cpu in self.steps]),
+                            ("from_checkpoint", self.from_checkpoint)])
+
+
+@contextmanager
+def record_stage(name):
+    """
+    Measures wall time, CPU time and peak RSS of the block, and collects the steps and rows reported in it. The
+    peak RSS is reset when the block starts, where the platform does not allow it the record is marked as
+    peak_rss_lifetime
+    :param name: name of the stage
+    :return: the StageRecord
+    """
+    global _current_stage
+    previous = _current_stage
+    if previous is not None:
+        # the reset below would hide the peak of the enclosing stage so far
+        previous.peak_rss_kb = max(previous.peak_rss_kb, peak_rss_kb())
+    record = StageRecord(name)
+    record.peak_rss_lifetime = not reset_peak_rss()
+    _current_stage = record
+    st = time.time()
+    st_cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record.wall_time = time.time() - st
+        record.cpu_time = time.process_time() - st_cpu
+        record.peak_rss_kb = max(record.peak_rss_kb, peak_rss_kb())
+        if previous is not None:
+            previous.peak_rss_kb = max(previous.peak_rss_kb, record.peak_rss_kb)
+        _current_stage = previous
+
+
+@contextmanager
+def step(name):
+    """
+    Measures wall and CPU time of an inner step of the current stage, e.g., TF-IDF or LSH indexing. Does nothing
+    if no stage is being recorded
+    :param name: name of the step
+    """
+    st = time.time()
+    st_cpu = time.process_time()
+    try:
+        yield
+    finally:
+        if _current_stage is not None:
+            _current_stage.steps.append((name, time.time() - st, time.process_time() - st_cpu))
+
+
+def add_rows_pulled(rows):
+    """
+    Adds to the number of rows the current stage pulled from the store
+    """
+    if _current_stage is not None:
+        _current_stage.rows_pulled += rows
+
+
+class BuildMetrics:
+    """
+    Metrics of all the stages of a build
+    """
+
+    def __init__(self, progress=None):
+        """
+        :param progress: optional function called as progress(event, stage name, StageRecord or None), with
+        event 'start' when a stage starts and 'done' when its relations are in the network
+        """
+        self.stages = OrderedDict()
+        self.progress = progress
+
+    def stage_started(self, name):
+        if self.progress is not None:
+            self.progress('start', name, None)
+
+    def add(self, record):
+        self.stages[record.name] = record
+        if self.progress is not None:
+            self.progress('done', record.name, record)
+
+    def as_dict(self):
+        return OrderedDict([("stages", [record.as_dict() for record in self.stages.values()]),
+                            ("total_wall_time", sum(r.wall_time for r in self.stages.values())),
+                            ("peak_rss_kb", max([r.peak_rss_kb for r in self.stages.values()] + [0]))])
+
+    def write_report(self, path):
+        """
+        Writes build_metrics.json, with all metrics, and build_metrics.csv, with one row per stage and step
+        :param path: directory of the serialized model
+        """
+        path = path + '/'
+        with open(path + "build_metrics.json", 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+        relations = []
+        for record in self.stages.values():
+            relations.extend(r for r in record.edges.keys() if r not in relations)
+        with open(path + "build_metrics.csv", 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["stage", "step", "wall_time", "cpu_time", "peak_rss_kb", "rows_pulled"] + relations)
+            for record in self.stages.values():
+                writer.writerow([record.name, "", record.wall_time, record.cpu_time, record.peak_rss_kb,
+                                 record.rows_pulled] + [record.edges.get(r, 0) for r in relations])
+                for name, wall, cpu in record.steps:
+                    writer.writerow([record.name, name, wall, cpu, "", ""] + [""] * len(relations))
+
+    def print_report(self):
+        print("Build metrics:")
+        for record in self.stages.values():
+            print("{0:20} wall {1:>10.2f}s cpu {2:>10.2f}s rss {3:>10}KB{4} rows {5:>10} edges {6:>12}".format(
+                record.name, record.wall_time, record.cpu_time, record.peak_rss_kb,
+                " (process lifetime)" if record.peak_rss_lifetime else "", record.rows_pulled,
+                sum(record.edges.values())))
+            for name, wall, cpu in record.steps:
+                print("  {0:18} wall {1:>10.2f}s cpu {2:>10.2f}s".format(name, wall, cpu))
@@ -0,0 +1,344 @@
+import multiprocessing
+import os
+import queue as queue_module
+import shutil
+import time
+import traceback
+
+import numpy as np
+
+from collections import defaultdict
+from collections import OrderedDict
+
+from api.apiutils import Relation
+from inputoutput import inputoutput as io
+from knowledgerepr import buildmetrics
+
+# seconds the scheduler waits for a stage result before it checks whether a worker died without posting one
+POLL_SECONDS = 5
+
+
+class EdgeCollector:
+    """
+    Stands in for the network while a stage runs: relations are buffered as edge lists instead of being added to
+    the graph, everything else (get_info_for, iterate_ids, neighbors_id, ...) is answered by the wrapped network.
+    """
+
+    def __init__(self, network):
+        self._network = network
+        self._edges = defaultdict(lambda: ([], [], []))
+
+    def __getattr__(self, name):
+        return getattr(self._network, name)
+
+    def add_relation(self, node_src, node_target, relation, score):
+        src, tgt, scores = self._edges[relation]
+        src.append(node_src)
+        tgt.append(node_target)
+        scores.append(score)
+
+    def add_relations(self, nodes_src, nodes_target, relation, scores):
+        src, tgt, all_scores = self._edges[relation]
+        src.extend(nodes_src)
+        tgt.extend(nodes_target)
+        all_scores.extend(scores)
+
+    def edge_lists(self):
+        """
+        :return: dict of relation -> (source nids, target nids, scores)
+        """
+        return dict(self._edges)
+
+
+def merge_edge_lists(network, edge_lists):
+    total = 0
+    for relation, (src, tgt, scores) in edge_lists.items():
+        for node_src, node_target, score in zip(src, tgt, scores):
+            network.add_relation(node_src, node_target, relation, score)
+        total += len(src)
+    return total
+
+
+def num_signatures_to_arrays(id_sig):
+    """
+    :param id_sig: list of (nid, (median, iqr, min, max)). Whether each value is an int or a float is kept,
+    as the numerical builders treat float domains differently
+    :return: dict of name -> array, to be saved with np.savez
+    """
+    nids = np.asarray([nid for nid, _ in id_sig], dtype=str)
+    values = [sig for _, sig in id_sig]
+    is_float = np.asarray([[isinstance(v, float) for v in sig] for sig in values], dtype=bool).reshape(-1, 4)
+    as_float = np.asarray([[float(v) for v in sig] for sig in values], dtype=np.float64).reshape(-1, 4)
+    as_int = np.asarray([[0 if f else v for v, f in zip(sig, fs)] for sig, fs in zip(values, is_float)],
+                        dtype=np.int64).reshape(-1, 4)
+    return {"nid": nids, "is_float": is_float, "as_float": as_float, "as_int": as_int}
+
+
+def num_signatures_from_arrays(a):
+    id_sig = []
+    for nid, is_float, as_float, as_int in zip(a["nid"].tolist(), a["is_float"].tolist(),
+                                                a["as_float"].tolist(), a["as_int"].tolist()):
+        sig = tuple(f if is_f else i for is_f, f, i in zip(is_float, as_float, as_int))
+        id_sig.append((nid, sig))
+    return id_sig
+
+
+class Checkpoint:
+    """
+    Directory with the output of the build stages that are already done, so a failed build can be resumed. Data
+    is stored as columnar numpy files; every file is written to a temporary name and renamed once complete, so
+    a stage either is in the checkpoint or it is not.
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        :param path: the checkpoint directory
+        :param resume: if False, anything checkpointed by a previous build is discarded
+        """
+        self.path = path + '/'
+        if not resume and os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _write_arrays(self, name, arrays):
+        tmp_path = self.path + name + ".npz.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, self.path + name + ".npz")
+
+    def _read_arrays(self, name):
+        with np.load(self.path + name + ".npz") as data:
+            return {k: data[k] for k in data.files}
+
+    def has(self, name):
+        return os.path.exists(self.path + name + ".npz")
+
+    def clear(self):
+        shutil.rmtree(self.path)
+
+    def save_fields(self, name, fields):
+        """
+        :param fields: list of (nid, db_name, source_name, field_name, total_values, unique_values, data_type)
+        """
+        columns = list(zip(*fields)) if len(fields) > 0 else [[]] * 7
+        arrays = dict()
+        for column, values in zip(["nid", "db_name", "source_name", "field_name", "data_type"],
+                                  [columns[0], columns[1], columns[2], columns[3], columns[6]]):
+            arrays[column] = np.asarray(values, dtype=str)
+        arrays["total_values"] = np.asarray(columns[4], dtype=np.int64)
+        arrays["unique_values"] = np.asarray(columns[5], dtype=np.int64)
+        self._write_arrays(name, arrays)
+
+    def load_fields(self, name):
+        a = self._read_arrays(name)
+        return list(zip(a["nid"].tolist(), a["db_name"].tolist(), a["source_name"].tolist(),
+                        a["field_name"].tolist(), a["total_values"].tolist(), a["unique_values"].tolist(),
+                        a["data_type"].tolist()))
+
+    def save_mh_signatures(self, name, mh_signatures):
+        """
+        :param mh_signatures: list of (nid, minhash hash values)
+        """
+        nids = np.asarray([nid for nid, _ in mh_signatures], dtype=str)
+        signatures = np.asarray([mh_sig for _, mh_sig in mh_signatures], dtype=np.uint64)
+        self._write_arrays(name, {"nid": nids, "signatures": signatures})
+
+    def load_mh_signatures(self, name):
+        a = self._read_arrays(name)
+        return list(zip(a["nid"].tolist(), a["signatures"].tolist()))
+
+    def save_num_signatures(self, name, id_sig):
+        """
+        :param id_sig: list of (nid, (median, iqr, min, max)), see num_signatures_to_arrays
+        """
+        self._write_arrays(name, num_signatures_to_arrays(id_sig))
+
+    def load_num_signatures(self, name):
+        return num_signatures_from_arrays(self._read_arrays(name))
+
+    def file_of(self, name):
+        return self.path + name + ".npz"
+
+    def save_stage(self, name, edge_lists, result):
+        """
+        Stores the edge lists of a stage, one src, tgt and score column per relation, and the object the stage
+        returned, if any
+        """
+        if result is not None:
+            io.serialize_object(result, self.path + name + ".result.pkl.tmp")
+            os.replace(self.path + name + ".result.pkl.tmp", self.path + name + ".result.pkl")
+        arrays = dict()
+        for relation, (src, tgt, scores) in edge_lists.items():
+            arrays[relation.name + "_src"] = np.asarray(src, dtype=str)
+            arrays[relation.name + "_tgt"] = np.asarray(tgt, dtype=str)
+            arrays[relation.name + "_score"] = np.asarray(scores, dtype=np.float64)
+        self._write_arrays("stage_" + name, arrays)
+
+    def has_stage(self, name):
+        return self.has("stage_" + name)
+
+    def load_stage(self, name):
+        """
+        :return: (edge lists, result) as given to save_stage
+        """
+        a = self._read_arrays("stage_" + name)
+        edge_lists = dict()
+        for key in a.keys():
+            if key.endswith("_src"):
+                relation_name = key[:-len("_src")]
+                edge_lists[Relation[relation_name]] = (a[relation_name + "_src"].tolist(),
+                                                       a[relation_name + "_tgt"].tolist(),
+                                                       a[relation_name + "_score"].tolist())
+        result = None
+        if os.path.exists(self.path + name + ".result.pkl"):
+            result = io.deserialize_object(self.path + name + ".result.pkl")
+        return edge_lists, result
+
+
+class Stage:
+
+    def __init__(self, name, func, deps=None):
+        """
+        :param name: unique name of the stage
+        :param func: function that receives the network, adds relations to it and optionally returns a result,
+        e.g., an index to serialize with the model
+        :param deps: names of the stages whose relations must be in the network before this one runs
+        """
+        self.name = name
+        self.func = func
+        self.deps = deps if deps is not None else []
+
+
+def _run_stage(stage, network):
+    collector = EdgeCollector(network)
+    with buildmetrics.record_stage(stage.name) as record:
+        result = stage.func(collector)
+    return collector.edge_lists(), result, record
+
+
+def _run_stage_in_child(stage, network, queue):
+    try:
+        edge_lists, result, record = _run_stage(stage, network)
+        queue.put((stage.name, edge_lists, result, record, None))
+    except BaseException:
+        queue.put((stage.name, None, None, None, traceback.format_exc()))
+
+
+class StageScheduler:
+    """
+    Runs a DAG of build stages. A stage starts as soon as all its dependencies are done; with more than one worker
+    each stage runs in a forked process, so it sees the network as it is when the stage starts, i.e., with the
+    relations of all its dependencies already merged. Stages return edge lists that are merged into the network
+    by this process once the stage finishes.
+    """
+
+    def __init__(self, workers=1, checkpoint=None, metrics=None, poll_seconds=POLL_SECONDS):
+        """
+        :param workers: max number of stages running at the same time
+        :param checkpoint: if given, the Checkpoint where the output of each stage is saved, stages already in
+        it are not run again
+        :param metrics: the BuildMetrics where the record of each stage is added
+        :param poll_seconds: how often the workers are checked while waiting for stage results
+        """
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.checkpoint = checkpoint
+        self.metrics = metrics if metrics is not None else buildmetrics.BuildMetrics()
+        self.stages = OrderedDict()
+        self.results = dict()
+        self.wall_times = OrderedDict()
+        self.edges_added = dict()
+
+    def add_stage(self, name, func, deps=None):
+        if name in self.stages:
+            raise ValueError("Stage " + name + " already exists")
+        stage = Stage(name, func, deps=deps)
+        for dep in stage.deps:
+            if dep not in self.stages:
+                raise ValueError("Stage " + name + " depends on unknown stage " + dep)
+        self.stages[name] = stage
+        return stage
+
+    def _finish(self, network, name, edge_lists, result, record):
+        st = time.time()
+        if self.checkpoint is not None and not record.from_checkpoint:
+            self.checkpoint.save_stage(name, edge_lists, result)
+        self.edges_added[name] = merge_edge_lists(network, edge_lists)
+        et = time.time()
+        record.wall_time += et - st
+        record.edges = OrderedDict((relation.name, len(src)) for relation, (src, _, _) in edge_lists.items())
+        self.results[name] = result
+        self.wall_times[name] = record.wall_time
+        self.metrics.add(record)
+        print("Stage {0} done: {1} edges, {2}s".format(name, self.edges_added[name], str(self.wall_times[name])))
+
+    def run(self, network):
+        """
+        Runs all stages over network
+        :return: dict of stage name -> result returned by the stage
+        """
+        pending = OrderedDict(self.stages)
+        done = set()
+        if self.checkpoint is not None:
+            for name in self.stages.keys():
+                if self.checkpoint.has_stage(name):
+                    print("Stage {0} loaded from checkpoint".format(name))
+                    with buildmetrics.record_stage(name) as record:
+                        edge_lists, result = self.checkpoint.load_stage(name)
+                    record.from_checkpoint = True
+                    self._finish(network, name, edge_lists, result, record)
+                    del pending[name]
+                    done.add(name)
+
+        if self.workers <= 1:
+            for name, stage in pending.items():
+                self.metrics.stage_started(name)
+                edge_lists, result, record = _run_stage(stage, network)
+                self._finish(network, name, edge_lists, result, record)
+            return self.results
+
+        ctx = multiprocessing.get_context('fork')
+        queue = ctx.Queue()
+        running = dict()
+        try:
+            while pending or running:
+                # Start every stage whose dependencies are done, as long as there are free workers
+                for name, stage in list(pending.items()):
+                    if len(running) >= self.workers:
+                        break
+                    if all(dep in done for dep in stage.deps):
+                        p = ctx.Process(target=_run_stage_in_child, args=(stage, network, queue), name=name)
+                        p.start()
+                        self.metrics.stage_started(name)
+                        running[name] = p
+                        del pending[name]
+                if len(running) == 0:
+                    raise ValueError("Stages " + str(list(pending.keys())) + " can never run, check their deps")
+                # Results must be read before joining the process, or a large edge list may block the child
+                try:
+                    name, edge_lists, result, record, error = queue.get(timeout=self.poll_seconds)
+                except queue_module.Empty:
+                    # A stage killed from outside (OOM killer, segfault in native code) never posts its result
+                    dead = [name for name, p in running.items() if p.exitcode is not None and p.exitcode != 0]
+                    if len(dead) > 0:
+                        raise RuntimeError("Stage " + dead[0] + " died with exit code " +
+                                           str(running[dead[0]].exitcode) + " without a result")
+                    continue
+                running.pop(name).join()
+                if error is not None:
+                    raise RuntimeError("Stage " + name + " failed:\n" + error)
+                self._finish(network, name, edge_lists, result, record)
+                done.add(name)
+        finally:
+            # only left running if a stage failed or died, the others are stopped and reaped before raising
+            for p in running.values():
+                if p.exitcode is None:
+                    p.terminate()
+            for p in running.values():
+                p.join()
+            queue.close()
+            queue.join_thread()
+        return self.results
+
+    def print_report(self):
+        self.metrics.print_report()
@@ -0,0 +1,339 @@
+import networkx as nx
+import numpy as np
+
+from api.apiutils import DRS
+from api.apiutils import Operation
+from api.apiutils import Hit
+from api.apiutils import Relation
+from knowledgerepr.fieldinfo import nid_key
+from knowledgerepr.fieldnetwork import FieldNetwork
+
+
+class CSRAdjacency:
+    """
+    Adjacency of one relation in compressed sparse row form. Edges are undirected, so both directions are stored;
+    a self loop is stored once. The neighbours of dense id i are indices[indptr[i]:indptr[i + 1]], sorted.
+    """
+
+    def __init__(self, indptr, indices, scores):
+        self.indptr = indptr  # int64, one more entry than nodes
+        self.indices = indices  # int32
+        self.scores = scores  # float32
+
+    @staticmethod
+    def from_edges(num_nodes, src, tgt, scores):
+        """
+        :param num_nodes: number of dense ids
+        :param src: dense id of the source of each edge, each undirected edge once
+        :param tgt: dense id of the target of each edge
+        :param scores: score of each edge
+        :return: the CSRAdjacency
+        """
+        src = np.asarray(src, dtype=np.int64)
+        tgt = np.asarray(tgt, dtype=np.int64)
+        scores = np.asarray(scores, dtype=np.float32)
+        reverse = src != tgt
+        rows = np.concatenate([src, tgt[reverse]])
+        cols = np.concatenate([tgt, src[reverse]])
+        values = np.concatenate([scores, scores[reverse]])
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_nodes), out=indptr[1:])
+        return CSRAdjacency(indptr, cols[order].astype(np.int32), values[order])
+
+    def degree(self):
+        """
+        :return: number of edges of each dense id, self loops counted twice as networkx does
+        """
+        degree = np.diff(self.indptr)
+        rows = np.repeat(np.arange(len(degree)), degree)
+        self_loops = rows[self.indices == rows]
+        return degree + np.bincount(self_loops, minlength=len(degree))
+
+    def num_edges(self):
+        """
+        :return: number of undirected edges, self loops included
+        """
+        rows = np.repeat(np.arange(len(self.indptr) - 1), np.diff(self.indptr))
+        return int((len(self.indices) + np.count_nonzero(self.indices == rows)) // 2)
+
+    def edges(self):
+        """
+        :return: (src, tgt, scores) arrays with each undirected edge once, src <= tgt
+        """
+        rows = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+        once = rows <= self.indices
+        return rows[once], self.indices[once].astype(np.int64), self.scores[once]
+
+
+class NidList:
+    """
+    Dense id <-> nid, for any nids, with a list of the nids and a dict of nid -> dense id
+    """
+
+    def __init__(self, nids):
+        self.nids = list(nids)
+        self.nid_array = np.array(self.nids, dtype=object)
+        self.ids = {nid: i for i, nid in enumerate(self.nids)}
+
+    def __len__(self):
+        return len(self.nids)
+
+    def __iter__(self):
+        return iter(self.nids)
+
+    def dense_id(self, nid):
+        return self.ids[nid]
+
+    def dense_ids(self, nids):
+        return np.array([self.ids[nid] for nid in nids], dtype=np.int64)
+
+    def nid_of(self, i):
+        return self.nids[i]
+
+    def nids_of(self, ids):
+        """
+        :return: object array with the nid of each dense id in ids
+        """
+        return self.nid_array[ids]
+
+
+class NidKeys:
+    """
+    Dense id <-> nid, for numerical nids (see fieldinfo.nid_key), with three arrays: the int64 key of each dense
+    id, the keys sorted, and the dense id of each sorted key. Nids are found with a binary search in the sorted
+    keys and rebuilt from the key, so the arrays can stay memory-mapped, with no per-node Python objects
+    """
+
+    def __init__(self, keys, sorted_keys, sorted_ids):
+        self.keys = keys
+        self.sorted_keys = sorted_keys
+        self.sorted_ids = sorted_ids
+
+    @staticmethod
+    def from_nids(nids):
+        """
+        :return: the NidKeys of nids, or None if some nid has no int64 key
+        """
+        keys = [nid_key(nid) for nid in nids]
+        if None in keys:
+            return None
+        keys = np.array(keys, dtype=np.int64)
+        order = np.argsort(keys, kind='mergesort')
+        return NidKeys(keys, keys[order], order.astype(np.int32))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self, block_rows=4096):
+        for start in range(0, len(self.keys), block_rows):
+            yield from self.nids_of(np.arange(start, min(start + block_rows, len(self.keys)))).tolist()
+
+    def dense_id(self, nid):
+        return int(self.dense_ids([nid])[0])
+
+    def dense_ids(self, nids):
+        nids = list(nids)
+        keys = np.array([nid_key(nid) for nid in nids], dtype=object)
+        missing = np.array([key is None for key in keys], dtype=bool)
+        keys[missing] = -1
+        keys = keys.astype(np.int64)
+        positions = np.searchsorted(self.sorted_keys, keys)
+        missing |= positions == len(self.sorted_keys)
+        positions[missing] = 0
+        if len(self.sorted_keys) > 0:
+            missing |= self.sorted_keys[positions] != keys
+        if missing.any():
+            raise KeyError(nids[int(np.argmax(missing))])
+        return self.sorted_ids[positions].astype(np.int64)
+
+    def nid_of(self, i):
+        return str(int(self.keys[i]))
+
+    def nids_of(self, ids):
+        """
+        :return: object array with the nid of each dense id in ids
+        """
+        return self.keys[ids].astype(str).astype(object)
+
+
+class CSRFieldNetwork(FieldNetwork):
+    """
+    Read-only FieldNetwork that keeps each relation as a CSRAdjacency over dense int32 ids, instead of a networkx
+    MultiGraph. It has the same query API, so Algebra and DoD work on it unchanged, and it takes a fraction of the
+    memory of the MultiGraph for large models.
+    """
+
+    def __init__(self, nids, cardinality, adjacency, id_names, source_ids=None, edge_counts=None, degree=None):
+        """
+        :param nids: the nid of each dense id, or a NidList or NidKeys
+        :param cardinality: float64 array with the cardinality ratio of each dense id, NaN if unknown
+        :param adjacency: dict of Relation -> CSRAdjacency
+        :param id_names: FieldInfoTable, a read-only mapping with the same methods (see modelformat.MappedFieldInfo),
+        or dict of nid -> (db_name, source_name, field_name, data_type)
+        :param source_ids: dict of source_name -> [nid], when id_names is a dict
+        :param edge_counts: dict of Relation -> number of edges, computed from adjacency if not given
+        :param degree: array with the number of edges of each dense id, of any relation, computed if not given
+        """
+        super().__init__(nx.MultiGraph(), id_names, source_ids)
+        if not isinstance(nids, (NidList, NidKeys)):
+            nids = NidList(nids)
+        self._nids = nids
+        self._cardinality = cardinality
+        self._adjacency = adjacency
+        if edge_counts is None:
+            edge_counts = {relation: adjacency.num_edges() for relation, adjacency in adjacency.items()}
+        self._edge_counts = edge_counts
+        if degree is None:
+            degree = np.zeros(len(self._nids), dtype=np.int64)
+            for relation_adjacency in adjacency.values():
+                degree += relation_adjacency.degree()
+        self._degree = degree
+
+    @staticmethod
+    def from_field_network(network):
+        """
+        Builds the compact representation of a FieldNetwork. Nodes get dense ids in the order of the meta schema
+        :param network: the FieldNetwork
+        :return: the CSRFieldNetwork
+        """
+        G = network._get_underlying_repr_graph()
+        id_names = network._get_underlying_repr_id_to_field_info()
+        nids = list(id_names.keys())
+        nids.extend(n for n in G.nodes() if n not in id_names)
+        dense_id = {nid: i for i, nid in enumerate(nids)}
+
+        cardinality = np.full(len(nids), np.nan, dtype=np.float64)
+        for nid, data in G.nodes(data=True):
+            card = data.get('cardinality')
+            if card is not None:
+                cardinality[dense_id[nid]] = card
+
+        edges = dict()
+        for src, tgt, relation, data in G.edges(keys=True, data=True):
+            if relation not in edges:
+                edges[relation] = ([], [], [])
+            s, t, scores = edges[relation]
+            s.append(dense_id[src])
+            t.append(dense_id[tgt])
+            scores.append(data['score'])
+        adjacency = {relation: CSRAdjacency.from_edges(len(nids), s, t, scores)
+                     for relation, (s, t, scores) in edges.items()}
+        return CSRFieldNetwork(nids, cardinality, adjacency, id_names)
+
+    def get_cardinality_of(self, node_id):
+        card = self._cardinality[self._nids.dense_id(node_id)]
+        if np.isnan(card):
+            return 0  # no cardinality is like card 0
+        return float(card)
+
+    def _get_underlying_repr_graph(self):
+        """
+        Builds the equivalent networkx MultiGraph, e.g., to serialize the network in the pickle format
+        """
+        G = nx.MultiGraph()
+        for nid, card in zip(self._nids, self._cardinality.tolist()):
+            G.add_node(nid, cardinality=None if np.isnan(card) else card)
+        for relation, adjacency in self._adjacency.items():
+            src, tgt, scores = adjacency.edges()
+            G.add_edges_from((s, t, relation, {'score': score}) for s, t, score in
+                             zip(self._nids.nids_of(src).tolist(), self._nids.nids_of(tgt).tolist(), scores.tolist()))
+        return G
+
+    def add_field(self, nid, cardinality=None):
+        raise Exception("CSRFieldNetwork is read-only, build the model with FieldNetwork")
+
+    def add_fields(self, list_of_fields):
+        raise Exception("CSRFieldNetwork is read-only, build the model with FieldNetwork")
+
+    def remove_field(self, nid):
+        raise Exception("CSRFieldNetwork is read-only, build the model with FieldNetwork")
+
+    def add_relation(self, node_src, node_target, relation, score):
+        raise Exception("CSRFieldNetwork is read-only, build the model with FieldNetwork")
+
+    def add_relations(self, nodes_src, nodes_target, relation, scores):
+        raise Exception("CSRFieldNetwork is read-only, build the model with FieldNetwork")
+
+    def fields_degree(self, topk):
+        degree = self._degree
+        if topk <= 0:
+            return []
+        if topk < len(degree):
+            top = np.argpartition(-degree, topk - 1)[:topk]
+        else:
+            top = np.arange(len(degree))
+        top = top[np.lexsort((top, -degree[top]))]
+        return [(self._nids.nid_of(i), int(degree[i])) for i in top]
+
+    def relation_count(self, relation):
+        return self._edge_counts.get(relation, 0)
+
+    def iterate_edges(self, relation, block_rows=4096):
+        """
+        Streams the edges of relation, each undirected edge once. Rows are read in blocks of block_rows dense ids,
+        so memory does not grow with the number of edges
+        """
+        adjacency = self._adjacency.get(relation)
+        if adjacency is None:
+            return
+        num_nodes = len(adjacency.indptr) - 1
+        for start in range(0, num_nodes, block_rows):
+            end = min(start + block_rows, num_nodes)
+            lo, hi = adjacency.indptr[start], adjacency.indptr[end]
+            rows = np.repeat(np.arange(start, end), np.diff(adjacency.indptr[start:end + 1]))
+            cols = adjacency.indices[lo:hi]
+            once = rows <= cols
+            yield from zip(self._nids.nids_of(rows[once]).tolist(), self._nids.nids_of(cols[once]).tolist(),
+                           adjacency.scores[lo:hi][once].tolist())
+
+    def _neighbors_of(self, nid, relation):
+        """
+        :return: (dense ids, scores) of the neighbours of nid through relation
+        """
+        i = self._nids.dense_id(nid)
+        adjacency = self._adjacency.get(relation)
+        if adjacency is None:
+            return [], []
+        lo, hi = adjacency.indptr[i], adjacency.indptr[i + 1]
+        return adjacency.indices[lo:hi].tolist(), adjacency.scores[lo:hi].tolist()
+
+    def neighbors_batch(self, nids, relation: Relation):
+        """
+        Neighbours of many nodes through relation, gathered from the CSR arrays in one pass
+        :param nids: the nids of the nodes
+        :param relation: the type of relation (edge)
+        :return: (src, dst, score) arrays with one entry per edge, src and dst are nids
+        """
+        rows = self._nids.dense_ids(str(nid) for nid in nids)
+        adjacency = self._adjacency.get(relation)
+        if adjacency is None or len(rows) == 0:
+            return np.array([], dtype=object), np.array([], dtype=object), np.array([], dtype=np.float32)
+        starts = adjacency.indptr[rows]
+        counts = adjacency.indptr[rows + 1] - starts
+        # position of each edge in indices: the start of its row plus its rank within the row
+        offsets = np.cumsum(counts) - counts
+        positions = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+        src = self._nids.nids_of(np.repeat(rows, counts))
+        dst = self._nids.nids_of(adjacency.indices[positions])
+        return src, dst, adjacency.scores[positions]
+
+    def _hit(self, i, score):
+        nid = self._nids.nid_of(i)
+        (db_name, source_name, field_name, data_type) = self._get_underlying_repr_id_to_field_info()[nid]
+        return Hit(nid, db_name, source_name, field_name, score)
+
+    def neighbors_id(self, hit: Hit, relation: Relation) -> DRS:
+        if isinstance(hit, Hit):
+            nid = str(hit.nid)
+        if isinstance(hit, str):
+            nid = hit
+        nid = str(nid)
+        neighbours, scores = self._neighbors_of(nid, relation)
+        nids = self._nids.nids_of(np.asarray(neighbours, dtype=np.int64)).tolist()
+        infos = self._get_underlying_repr_id_to_field_info().infos(nids)
+        data = [Hit(k, db_name, source_name, field_name, score)
+                for k, score, (db_name, source_name, field_name, data_type) in zip(nids, scores, infos)]
+        op = self.get_op_from_relation(relation)
+        o_drs = DRS(data, Operation(op, params=[hit]))
+        return o_drs
@@ -1,3 +1,6 @@
+import sys
+import time
+
 from knowledgerepr.ekgstore.pg_store import PGStore
 
 
@@ -5,6 +8,14 @@ if __name__ == "__main__":
 
     store = PGStore(db_ip="localhost", db_port="5432", db_name="test_py", db_user="postgres", db_passwd="admin")
     store.init_schema()
-    store.close_con()
     print("Schema initialized")
 
+    # optionally, bulk load a model: python create_schema.py <model_path>
+    if len(sys.argv) > 1:
+        from knowledgerepr.fieldnetwork import deserialize_network
+        network = deserialize_network(sys.argv[1])
+        st = time.time()
+        nodes, edges = store.load_network(network)
+        et = time.time()
+        print("Loaded " + str(nodes) + " nodes and " + str(edges) + " edge rows in " + str(et - st))
+    store.close_con()
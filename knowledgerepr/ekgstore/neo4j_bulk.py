@@ -0,0 +1,75 @@
+"""
+Export of a FieldNetwork as the CSV files of neo4j-admin import. It only writes files, so it needs neither the
+neo4j driver nor a running Neo4j. The files are:
+ - nodes.csv: one row per field, with its nid as :ID and its meta schema and cardinality as properties
+ - <RELATION>.csv: one row per edge of the relation, with its score, for each relation with edges
+Load them into an empty database with the command returned by import_command.
+"""
+
+import csv
+import os
+
+from api.apiutils import Relation
+
+NODE_LABEL = "Node"
+NODES_FILE = "nodes.csv"
+NODE_HEADER = ["nid:ID", "db_name", "source", "field", "data_type", "cardinality:float", ":LABEL"]
+RELATIONSHIP_HEADER = [":START_ID", ":END_ID", "score:float", ":TYPE"]
+
+
+def node_rows(network):
+    """
+    :return: generator of (nid, db_name, source_name, field_name, data_type, cardinality), once per field
+    """
+    for nid, (db_name, source_name, field_name, data_type) in \
+            network._get_underlying_repr_id_to_field_info().items():
+        yield nid, db_name, source_name, field_name, data_type, network.get_cardinality_of(nid)
+
+
+def relationship_rows(network, relation):
+    """
+    :return: generator of (nid, nid, score), once per undirected edge of relation
+    """
+    for src, tgt, score in network.iterate_edges(relation):
+        yield src, tgt, float(score)
+
+
+def write_bulk_import_csv(network, path):
+    """
+    :param network: a FieldNetwork or CSRFieldNetwork
+    :param path: directory where the files are written
+    :return: (path of the nodes file, dict of Relation -> path of its relationships file)
+    """
+    os.makedirs(path, exist_ok=True)
+    nodes_file = os.path.join(path, NODES_FILE)
+    with open(nodes_file, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(NODE_HEADER)
+        for row in node_rows(network):
+            writer.writerow(row + (NODE_LABEL,))
+
+    relationship_files = dict()
+    for relation in Relation:
+        rows = relationship_rows(network, relation)
+        first = next(rows, None)
+        if first is None:
+            continue  # no edges of this relation
+        relationship_file = os.path.join(path, relation.name + ".csv")
+        with open(relationship_file, 'w', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(RELATIONSHIP_HEADER)
+            writer.writerow(first + (relation.name,))
+            for row in rows:
+                writer.writerow(row + (relation.name,))
+        relationship_files[relation] = relationship_file
+    return nodes_file, relationship_files
+
+
+def import_command(nodes_file, relationship_files):
+    """
+    :return: the neo4j-admin command that imports the files written by write_bulk_import_csv
+    """
+    command = "neo4j-admin import --nodes=" + nodes_file
+    for relation, relationship_file in relationship_files.items():
+        command += " --relationships=" + relationship_file
+    return command
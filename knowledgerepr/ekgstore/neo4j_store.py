@@ -1,8 +1,25 @@
+import argparse
+
 from neo4j.v1 import GraphDatabase
 from tqdm import tqdm
 
 from api.apiutils import Relation
 from knowledgerepr import fieldnetwork
+from knowledgerepr.ekgstore import neo4j_bulk
+
+# rows sent in each UNWIND transaction
+BATCH_SIZE = 5000
+
+
+def batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
 
 
 class Neo4jExporter(object):
@@ -14,33 +31,70 @@ class Neo4jExporter(object):
         self._server = f"bolt://{host}:{port}"
         self._user = user
         self._pwd = pwd
+        self._driver = None
 
-        self._driver = GraphDatabase.driver(self._server, auth=(user, pwd))
+    @property
+    def driver(self):
+        # connects on first use, so the CSV export works without a running Neo4j
+        if self._driver is None:
+            self._driver = GraphDatabase.driver(self._server, auth=(self._user, self._pwd))
+        return self._driver
 
-    def export(self, path_to_model):
+    def export(self, path_to_model, batch_size=BATCH_SIZE):
+        """
+        Transactional export over one session. Each field is created once, and nodes and relationships are sent
+        in UNWIND batches of batch_size rows, one transaction per batch
+        :param path_to_model: directory of the model
+        :param batch_size: rows per transaction
+        """
         field_network = fieldnetwork.deserialize_network(path_to_model)
 
-        # Create index to speed up MATCHes
-        with self._driver.session() as session:
+        with self.driver.session() as session:
+            # Create index to speed up MATCHes
             session.run("CREATE INDEX ON :Node(nid)")
 
-        for relation_label in Relation:
-
-            # relation_hits is a generator. We could consume it to a list and then iterate over it,
-            # but this would probably consume too much memory in most scenarios
-            relation_hits = field_network.enumerate_relation(relation_label, as_str=False)
-            for a, b in tqdm(relation_hits, desc=f'Storing {relation_label} relations to Neo4j', unit='relation'):
-                with self._driver.session() as session:
-                    # Step 1: add nodes
-                    session.run(
-                        "CREATE (n:Node {nid:$nid,db_name:$db_name,source:$source,field:$field,score:$score}) RETURN id(n)",
-                        nid=a.nid, db_name=a.db_name, source=a.source_name, field=a.field_name, score=a.score)
-                    session.run("CREATE (n:Node {nid:$nid,source:$source,field:$field,score:$score}) RETURN id(n)",
-                                nid=b.nid, db_name=b.db_name, source=b.source_name, field=b.field_name, score=b.score)
-
-                    session.run(
-                        f"MATCH (a:Node),(b:Node)"
-                        " WHERE a.nid=$nid_a AND b.nid=$nid_b "
-                        "CREATE (a)-[r: {relation_label}]->(b) RETURN type(r)".format(
-                            relation_label=str(relation_label).replace('Relation.', '')),
-                        nid_a=a.nid, nid_b=b.nid)  # .single().value()
+            nodes = ({'nid': nid, 'db_name': db_name, 'source': source_name, 'field': field_name,
+                      'data_type': data_type, 'cardinality': cardinality}
+                     for nid, db_name, source_name, field_name, data_type, cardinality
+                     in neo4j_bulk.node_rows(field_network))
+            for batch in tqdm(batches(nodes, batch_size), desc='Storing nodes to Neo4j', unit='batch'):
+                session.write_transaction(lambda tx: tx.run(
+                    "UNWIND $rows AS row "
+                    "CREATE (:Node {nid: row.nid, db_name: row.db_name, source: row.source, field: row.field, "
+                    "data_type: row.data_type, cardinality: row.cardinality})", rows=batch))
+
+            for relation_label in Relation:
+                relationships = ({'a': a, 'b': b, 'score': score}
+                                 for a, b, score in neo4j_bulk.relationship_rows(field_network, relation_label))
+                query = ("UNWIND $rows AS row "
+                         "MATCH (a:Node {{nid: row.a}}), (b:Node {{nid: row.b}}) "
+                         "CREATE (a)-[:{relation_label} {{score: row.score}}]->(b)").format(
+                    relation_label=relation_label.name)
+                for batch in tqdm(batches(relationships, batch_size), desc=f'Storing {relation_label} relations '
+                                  f'to Neo4j', unit='batch'):
+                    session.write_transaction(lambda tx: tx.run(query, rows=batch))
+
+    def export_csv(self, path_to_model, path):
+        """
+        Writes the model as neo4j-admin import files, see neo4j_bulk. Does not connect to Neo4j
+        :param path_to_model: directory of the model
+        :param path: directory where the files are written
+        :return: the neo4j-admin command that imports them
+        """
+        field_network = fieldnetwork.deserialize_network(path_to_model)
+        nodes_file, relationship_files = neo4j_bulk.write_bulk_import_csv(field_network, path)
+        return neo4j_bulk.import_command(nodes_file, relationship_files)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports a model to Neo4j")
+    parser.add_argument('--model', help='Directory of the model', required=True)
+    parser.add_argument('--csv', help='Write neo4j-admin import files to this directory instead of exporting '
+                                      'through a running Neo4j')
+    args = parser.parse_args()
+
+    exporter = Neo4jExporter()
+    if args.csv is not None:
+        print(exporter.export_csv(args.model, args.csv))
+    else:
+        exporter.export(args.model)
@@ -1,5 +1,15 @@
+import csv
+import io
+
 import psycopg2 as db
 
+from api.apiutils import Relation
+
+# rows sent in each COPY, each batch is committed on its own
+BULK_BATCH_SIZE = 100000
+# rows fetched from the server in each round trip of a server-side cursor
+FETCH_SIZE = 10000
+
 
 class PGStore:
 
@@ -23,16 +33,27 @@ class PGStore:
         return con
 
     def init_schema(self):
-        self.cur.execute("CREATE TABLE nodes (node_id integer PRIMARY KEY, "
+        # nids are CRC32 hashes, which do not fit in a signed integer
+        self.cur.execute("CREATE TABLE nodes (node_id bigint PRIMARY KEY, "
                          "node_name varchar, "
                          "table_name varchar, "
                          "unique_ratio real);")
-        self.cur.execute("CREATE TABLE edges (source_node_id integer, "
-                         "target_node_id integer, "
+        self.cur.execute("CREATE TABLE edges (source_node_id bigint, "
+                         "target_node_id bigint, "
                          "relation_type smallint, "
                          "weight real);")
         self.con.commit()
 
+    def create_indexes(self):
+        """
+        Indexes the edges by source and relation, which is how neighbour and path queries read them. Create them
+        after bulk loading, building the index once is much faster than updating it on every insert
+        """
+        self.cur.execute("CREATE INDEX IF NOT EXISTS edges_source_relation_idx "
+                         "ON edges (source_node_id, relation_type);")
+        self.cur.execute("ANALYZE edges;")
+        self.con.commit()
+
     def reset_cursor(self):
         self.cur.close()
         self.cur = self.con.cursor()
@@ -61,45 +82,115 @@ class PGStore:
                          "values (%s, %s, %s, %s)",
                          (source_node_id, target_node_id, relation_type, weight))
 
+    def copy_rows(self, table, columns, rows):
+        """
+        Inserts rows with one COPY, sent as CSV. None values are stored as NULL. Does not commit
+        :param table: name of the table
+        :param columns: names of the columns of each row
+        :param rows: list of tuples
+        """
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        self.cur.copy_expert("COPY " + table + " (" + ", ".join(columns) + ") FROM STDIN WITH (FORMAT csv)", buffer)
+
+    def copy_in_batches(self, table, columns, rows, batch_size=BULK_BATCH_SIZE):
+        """
+        Inserts the rows of a generator with one COPY and one commit per batch of batch_size rows
+        :return: number of rows inserted
+        """
+        total = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                self.copy_rows(table, columns, batch)
+                self.con.commit()
+                total += len(batch)
+                batch = []
+        if len(batch) > 0:
+            self.copy_rows(table, columns, batch)
+            self.con.commit()
+            total += len(batch)
+        return total
+
+    def load_network(self, network, batch_size=BULK_BATCH_SIZE):
+        """
+        Bulk loads the nodes and edges of a FieldNetwork, then creates the indexes. Each undirected edge is stored in
+        both directions, so the neighbours of a node are the rows with it as source
+        :param network: a FieldNetwork or CSRFieldNetwork
+        :param batch_size: rows per COPY and commit
+        :return: (nodes, edge rows) inserted
+        """
+        def node_rows():
+            for nid, (db_name, source_name, field_name, data_type) in \
+                    network._get_underlying_repr_id_to_field_info().items():
+                yield nid, field_name, source_name, network.get_cardinality_of(nid)
+
+        def edge_rows():
+            for relation in Relation:
+                for src, tgt, score in network.iterate_edges(relation):
+                    yield src, tgt, relation.value, score
+                    if src != tgt:
+                        yield tgt, src, relation.value, score
+
+        total_nodes = self.copy_in_batches("nodes", ["node_id", "node_name", "table_name", "unique_ratio"],
+                                           node_rows(), batch_size=batch_size)
+        total_edges = self.copy_in_batches("edges", ["source_node_id", "target_node_id", "relation_type", "weight"],
+                                           edge_rows(), batch_size=batch_size)
+        self.create_indexes()
+        return total_nodes, total_edges
+
     """
     READ
     """
 
+    def fetch_all(self, query, params, fetch_size=FETCH_SIZE):
+        """
+        Runs a query with a server-side cursor, so the results are streamed in batches of fetch_size rows instead
+        of being materialized in the client at once
+        :return: list with the rows of the result
+        """
+        cur = self.con.cursor(name="pg_store_fetch")
+        cur.itersize = fetch_size
+        try:
+            cur.execute(query, params)
+            results = []
+            res = cur.fetchmany(size=fetch_size)
+            while res:
+                results.extend(res)
+                res = cur.fetchmany(size=fetch_size)
+            return results
+        finally:
+            cur.close()
+
     def connected_to(self, nid, relation_type):
-        self.cur.execute("select target_node_id from edges where source_node_id = %s and relation_type = %s",
-                         (nid, relation_type))
-        results = []
-        res = self.cur.fetchmany(size=10)
-        while res:
-            for el in res:
-                results.append(el)
-            res = self.cur.fetchmany(size=10)
-        return results
-
-    def paths(self, source_id, target_id, relation_type=1):
-        self.cur.execute("WITH RECURSIVE transitive_closure (src, tgt, path_string) AS "
-                         "(SELECT e.source_node_id, "
-                         "e.target_node_id, e.source_node_id || %(dot_str)s || e.target_node_id || %(dot_str)s"
-                         "AS path_string FROM edges e WHERE e.source_node_id = %(source_id)s"
-                         "UNION "
-                         "SELECT tc.src, e.target_node_id, tc.path_string || e.target_node_id || %(dot_str)s "
-                         "AS path_string FROM edges "
-                         "AS e JOIN transitive_closure AS tc ON e.source_node_id = tc.tgt "
-                         "WHERE tc.path_string NOT LIKE %(perc_str)s || e.target_node_id || %(dotperc_str)s ) "
-                         "SELECT * FROM transitive_closure tc WHERE tc.tgt = %(tid)s",
-                         {'dot_str': '.',
-                          'source_id': source_id,
-                          'perc_str': '%',
-                          'dotperc_str': '.%',
-                          'tid': target_id})
-
-        results = []
-        res = self.cur.fetchmany(size=10)
-        while res:
-            for el in res:
-                results.append(el)
-            res = self.cur.fetchmany(size=10)
-        return results
+        return self.fetch_all("select target_node_id from edges where source_node_id = %s and relation_type = %s",
+                              (nid, relation_type))
+
+    def paths(self, source_id, target_id, relation_type=1, max_hops=5):
+        """
+        All the paths from source_id to target_id with up to max_hops edges of relation_type that do not visit a
+        node twice. Each path is an array of node ids, and the recursion does not extend paths that reached
+        the target or max_hops
+        :return: list with the node ids of each path, from source to target
+        """
+        results = self.fetch_all("WITH RECURSIVE transitive_closure (tgt, path, hops) AS "
+                                 "(SELECT e.target_node_id, ARRAY[e.source_node_id, e.target_node_id], 1 "
+                                 "FROM edges e "
+                                 "WHERE e.source_node_id = %(source_id)s AND e.relation_type = %(relation_type)s "
+                                 "UNION ALL "
+                                 "SELECT e.target_node_id, tc.path || e.target_node_id, tc.hops + 1 "
+                                 "FROM transitive_closure AS tc JOIN edges AS e "
+                                 "ON e.source_node_id = tc.tgt AND e.relation_type = %(relation_type)s "
+                                 "WHERE tc.hops < %(max_hops)s AND tc.tgt <> %(tid)s "
+                                 "AND NOT e.target_node_id = ANY(tc.path)) "
+                                 "SELECT tc.path FROM transitive_closure tc WHERE tc.tgt = %(tid)s",
+                                 {'source_id': source_id,
+                                  'relation_type': relation_type,
+                                  'max_hops': max_hops,
+                                  'tid': target_id})
+        return [path for (path,) in results]
 
 if __name__ == "__main__":
     print("pg store")
@@ -0,0 +1,53 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from api.apiutils import Relation
+from knowledgerepr.ekgstore import neo4j_bulk
+from knowledgerepr.testutils import edges_of
+from knowledgerepr.testutils import random_network
+
+
+class TestNeo4jBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.network, _ = random_network(6, 20, 60, [Relation.CONTENT_SIM, Relation.PKFK], num_sources=4,
+                                         source_format='table, "{}"')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def read(self, path):
+        with open(path, newline='') as f:
+            rows = list(csv.reader(f))
+        return rows[0], rows[1:]
+
+    def test_write_bulk_import_csv(self):
+        nodes_file, relationship_files = neo4j_bulk.write_bulk_import_csv(self.network, self.path)
+        header, rows = self.read(nodes_file)
+        self.assertEqual(neo4j_bulk.NODE_HEADER, header)
+        self.assertEqual(sorted(self.network.iterate_ids()), sorted(row[0] for row in rows))
+        id_names = self.network._get_underlying_repr_id_to_field_info()
+        for row in rows:
+            self.assertEqual(list(id_names[row[0]]), row[1:5])
+            self.assertEqual('Node', row[-1])
+
+        self.assertEqual({Relation.CONTENT_SIM, Relation.PKFK}, set(relationship_files.keys()))
+        for relation, relationship_file in relationship_files.items():
+            self.assertEqual(relation.name + ".csv", os.path.basename(relationship_file))
+            header, rows = self.read(relationship_file)
+            self.assertEqual(neo4j_bulk.RELATIONSHIP_HEADER, header)
+            expected = edges_of(self.network, relation)
+            self.assertEqual(len(expected), len(rows))
+            for a, b, score, relation_type in rows:
+                self.assertEqual(relation.name, relation_type)
+                self.assertAlmostEqual(expected[frozenset((a, b))], float(score))
+        command = neo4j_bulk.import_command(nodes_file, relationship_files)
+        self.assertTrue(command.startswith("neo4j-admin import --nodes=" + nodes_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import csv
+import io
+import os
+import unittest
+
+try:
+    from knowledgerepr.ekgstore import pg_store
+except ImportError:
+    pg_store = None  # psycopg2 is not installed
+
+
+class FakeConnection:
+
+    def __init__(self, log):
+        self.log = log
+
+    def commit(self):
+        self.log.append(('commit',))
+
+
+class FakeCursor:
+    """
+    Records the rows of each COPY, as read back from the CSV that PGStore sends
+    """
+
+    def __init__(self, log):
+        self.log = log
+
+    def copy_expert(self, sql, buffer):
+        self.log.append(('copy', sql, [tuple(row) for row in csv.reader(io.StringIO(buffer.read()))]))
+
+
+@unittest.skipIf(pg_store is None, "psycopg2 is not installed")
+class TestCopyInBatches(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+        # no server: the store only talks to the fake connection and cursor
+        self.store = pg_store.PGStore.__new__(pg_store.PGStore)
+        self.store.con = FakeConnection(self.log)
+        self.store.cur = FakeCursor(self.log)
+
+    def copy(self, rows, batch_size):
+        return self.store.copy_in_batches("edges", ["source_node_id", "target_node_id", "relation_type", "weight"],
+                                          iter(rows), batch_size=batch_size)
+
+    def test_one_copy_and_commit_per_batch(self):
+        rows = [(i, i + 1, 1, 0.5) for i in range(7)]
+        self.assertEqual(self.copy(rows, 3), 7)
+        self.assertEqual([entry[0] for entry in self.log], ['copy', 'commit'] * 3)
+        copies = [entry for entry in self.log if entry[0] == 'copy']
+        self.assertEqual([len(batch) for _, _, batch in copies], [3, 3, 1])
+        self.assertEqual([row for _, _, batch in copies for row in batch],
+                         [(str(a), str(b), str(c), str(d)) for a, b, c, d in rows])
+        self.assertEqual(copies[0][1], "COPY edges (source_node_id, target_node_id, relation_type, weight) "
+                                       "FROM STDIN WITH (FORMAT csv)")
+
+    def test_full_batches(self):
+        # no empty COPY after the last full batch
+        self.assertEqual(self.copy([(i, i, 1, None) for i in range(6)], 3), 6)
+        self.assertEqual([entry[0] for entry in self.log], ['copy', 'commit'] * 2)
+        # None is an empty unquoted value, which COPY reads as NULL
+        self.assertEqual(self.log[0][2][0], ('0', '0', '1', ''))
+
+    def test_no_rows(self):
+        self.assertEqual(self.copy([], 3), 0)
+        self.assertEqual(self.log, [])
+
+
+@unittest.skipIf(pg_store is None, "psycopg2 is not installed")
+class TestPaths(unittest.TestCase):
+    """
+    Runs the path queries on a PostgreSQL server, given by the AURUM_PG_* environment variables, in a schema of its
+    own that is dropped afterwards
+    """
+
+    schema = "aurum_test_pg_store"
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.store = pg_store.PGStore(db_ip=os.environ.get("AURUM_PG_HOST", "localhost"),
+                                         db_port=os.environ.get("AURUM_PG_PORT", "5432"),
+                                         db_name=os.environ.get("AURUM_PG_DB", "postgres"),
+                                         db_user=os.environ.get("AURUM_PG_USER", "postgres"),
+                                         db_passwd=os.environ.get("AURUM_PG_PASSWORD", ""))
+        except pg_store.db.OperationalError:
+            raise unittest.SkipTest("No PostgreSQL server")
+        cls.store.cur.execute("DROP SCHEMA IF EXISTS " + cls.schema + " CASCADE;")
+        cls.store.cur.execute("CREATE SCHEMA " + cls.schema + ";")
+        cls.store.cur.execute("SET search_path TO " + cls.schema + ";")
+        cls.store.init_schema()
+        # relation 1: the cycle 1 - 2 - 3 - 1 and 3 - 4. Relation 2: 2 - 4
+        edges = [(1, 2, 1), (2, 3, 1), (3, 1, 1), (3, 4, 1), (2, 4, 2)]
+        rows = [(s, t, r, 0.5) for s, t, r in edges] + [(t, s, r, 0.5) for s, t, r in edges]
+        cls.store.copy_in_batches("edges", ["source_node_id", "target_node_id", "relation_type", "weight"], rows,
+                                  batch_size=4)
+        cls.store.create_indexes()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.store.cur.execute("DROP SCHEMA " + cls.schema + " CASCADE;")
+        cls.store.commit()
+        cls.store.close_con()
+
+    def paths(self, source, target, relation_type, max_hops):
+        return sorted(self.store.paths(source, target, relation_type=relation_type, max_hops=max_hops))
+
+    def test_hop_limit(self):
+        self.assertEqual(self.paths(1, 4, 1, 3), [[1, 2, 3, 4], [1, 3, 4]])
+        self.assertEqual(self.paths(1, 4, 1, 2), [[1, 3, 4]])
+        self.assertEqual(self.paths(1, 4, 1, 1), [])
+
+    def test_cycles(self):
+        # the cycle back to 1 is never followed, and paths stop at the target
+        self.assertEqual(self.paths(1, 3, 1, 10), [[1, 2, 3], [1, 3]])
+        self.assertEqual(self.paths(1, 1, 1, 10), [])
+
+    def test_relation(self):
+        self.assertEqual(self.paths(2, 4, 2, 5), [[2, 4]])
+        self.assertEqual(self.paths(1, 4, 2, 5), [])
+        self.assertEqual(self.store.connected_to(2, 2), [(4,)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,261 @@
+from array import array
+from collections.abc import Mapping
+
+NO_KEY = -1  # empty slot of the key table, and key of the rows whose nid has no key
+
+
+def nid_key(nid):
+    """
+    :return: the int64 key of a nid that is the decimal string of a non-negative int64 without leading zeros, as
+    the CRC32 nids of compute_field_id are, or None for any other nid
+    """
+    if type(nid) is not str:
+        return None
+    try:
+        key = int(nid)
+    except ValueError:
+        return None
+    if key < 0 or key >= 2 ** 63 or str(key) != nid:
+        return None
+    return key
+
+
+class FieldInfoTable(Mapping):
+    """
+    Compact table of nid -> (db_name, source_name, field_name, data_type). Instead of one tuple of strings per
+    field, it keeps one row per field with:
+     - dictionary codes of the db and source names, which repeat across all the fields of a table
+     - the offset of the field name into one UTF-8 buffer
+     - a 1-byte code of the data type
+    It reads as the dict it replaces, so existing callers keep working, and it also answers the source -> nids
+    lookups, through the SourceIds view.
+    Nids are not kept as strings: numerical nids (see nid_key) are int64 keys, in an open addressing hash table
+    of two flat arrays, keys and rows, with linear probing. A lookup takes O(1) probes, as with a dict, but a key
+    takes 12 bytes per slot instead of a str object and a dict entry. Other nids are kept in a dict.
+    """
+
+    def __init__(self):
+        self.row_keys = array('q')  # row -> key of its nid, NO_KEY if the nid has no key
+        self.alive = bytearray()  # row -> 1 while the row holds a field, 0 once it is removed
+        self.num_fields = 0
+        # key table, a power of two of slots. The key of a removed field keeps its slot, pointing to its dead row,
+        # until the table grows
+        self.slot_keys = array('q', [NO_KEY]) * 8
+        self.slot_rows = array('i', [0]) * 8
+        self.num_keys = 0
+        self.other_rows = dict()  # nid -> row, for nids without a key
+        self.other_nids = dict()  # row -> nid, for nids without a key
+        self.db_names = []
+        self.db_codes = dict()
+        self.db = array('i')
+        self.source_names = []
+        self.source_codes = dict()
+        self.source = array('i')
+        self.source_rows = []  # source code -> rows of its fields
+        self.field_offsets = array('q', [0])
+        self.field_names = bytearray()
+        self.data_types = []
+        self.type_codes = dict()
+        self.type = array('B')
+
+    @staticmethod
+    def from_dicts(id_names, source_ids):
+        """
+        :param id_names: dict of nid -> (db_name, source_name, field_name, data_type)
+        :param source_ids: dict of source_name -> [nid], the order of nids in each source is kept
+        :return: the FieldInfoTable
+        """
+        table = FieldInfoTable()
+        for nid, (db_name, source_name, field_name, data_type) in id_names.items():
+            table.add(nid, db_name, source_name, field_name, data_type)
+        for source_name, nids in source_ids.items():
+            code = table.source_codes.get(source_name)
+            if code is not None:
+                rows = (table.row_of(nid) for nid in nids)
+                table.source_rows[code] = array('i', [row for row in rows if row is not None])
+        return table
+
+    @staticmethod
+    def _code_of(name, names, codes):
+        code = codes.get(name)
+        if code is None:
+            code = len(names)
+            codes[name] = code
+            names.append(name)
+        return code
+
+    def _slot(self, key):
+        """
+        :return: the slot of key in the key table, or the empty slot where it goes
+        """
+        mask = len(self.slot_keys) - 1
+        slot = key & mask
+        while True:
+            k = self.slot_keys[slot]
+            if k == key or k == NO_KEY:
+                return slot
+            slot = (slot + 1) & mask
+
+    def _grow(self):
+        """
+        Doubles the key table, and drops the keys of removed fields
+        """
+        rows = [(self.slot_keys[slot], self.slot_rows[slot]) for slot in range(len(self.slot_keys))
+                if self.slot_keys[slot] != NO_KEY and self.alive[self.slot_rows[slot]]]
+        self.slot_keys = array('q', [NO_KEY]) * (2 * len(self.slot_keys))
+        self.slot_rows = array('i', [0]) * len(self.slot_keys)
+        for key, row in rows:
+            slot = self._slot(key)
+            self.slot_keys[slot] = key
+            self.slot_rows[slot] = row
+        self.num_keys = len(rows)
+
+    def row_of(self, nid):
+        """
+        :return: the row of nid, or None if it is not in the table
+        """
+        key = nid_key(nid)
+        if key is None:
+            return self.other_rows.get(nid)
+        slot = self._slot(key)
+        if self.slot_keys[slot] == key:
+            row = self.slot_rows[slot]
+            if self.alive[row]:
+                return row
+        return None
+
+    def rows_of(self, nids):
+        """
+        :return: list with the row of each nid, None for the nids not in the table
+        """
+        return [self.row_of(nid) for nid in nids]
+
+    def infos(self, nids):
+        """
+        :return: list with the info of each nid, as __getitem__, with the rows of all of them found with rows_of
+        """
+        nids = list(nids)
+        infos = []
+        for nid, row in zip(nids, self.rows_of(nids)):
+            if row is None:
+                raise KeyError(nid)
+            infos.append(self.info(row))
+        return infos
+
+    def nid_of(self, row):
+        key = self.row_keys[row]
+        if key == NO_KEY:
+            return self.other_nids[row]
+        return str(key)
+
+    def add(self, nid, db_name, source_name, field_name, data_type):
+        """
+        Adds the info of a field, replacing the previous info if nid was already in the table
+        """
+        if self.row_of(nid) is not None:
+            self.remove(nid)
+        row = len(self.row_keys)
+        self.alive.append(1)
+        key = nid_key(nid)
+        if key is None:
+            self.other_rows[nid] = row
+            self.other_nids[row] = nid
+            self.row_keys.append(NO_KEY)
+        else:
+            slot = self._slot(key)
+            if self.slot_keys[slot] == NO_KEY:
+                self.slot_keys[slot] = key
+                self.num_keys += 1
+            self.slot_rows[slot] = row
+            self.row_keys.append(key)
+            if 4 * self.num_keys > 3 * len(self.slot_keys):
+                self._grow()
+        self.num_fields += 1
+        self.db.append(self._code_of(db_name, self.db_names, self.db_codes))
+        source = self._code_of(source_name, self.source_names, self.source_codes)
+        if source == len(self.source_rows):
+            self.source_rows.append(array('i'))
+        self.source.append(source)
+        self.source_rows[source].append(row)
+        self.field_names.extend(field_name.encode('utf8'))
+        self.field_offsets.append(len(self.field_names))
+        self.type.append(self._code_of(data_type, self.data_types, self.type_codes))
+
+    def remove(self, nid):
+        """
+        Removes the info of a field. Its row is left unused
+        :return: the info of the field
+        """
+        info = self[nid]
+        row = self.row_of(nid)
+        if self.row_keys[row] == NO_KEY:
+            del self.other_rows[nid]
+            del self.other_nids[row]
+        self.alive[row] = 0
+        self.num_fields -= 1
+        self.source_rows[self.source[row]].remove(row)
+        return info
+
+    pop = remove
+
+    def field_name(self, row):
+        return self.field_names[self.field_offsets[row]:self.field_offsets[row + 1]].decode('utf8')
+
+    def info(self, row):
+        return (self.db_names[self.db[row]], self.source_names[self.source[row]], self.field_name(row),
+                self.data_types[self.type[row]])
+
+    def _row(self, nid):
+        row = self.row_of(nid)
+        if row is None:
+            raise KeyError(nid)
+        return row
+
+    def __getitem__(self, nid):
+        return self.info(self._row(nid))
+
+    def __contains__(self, nid):
+        return self.row_of(nid) is not None
+
+    def __iter__(self):
+        # in the order the fields were added, as the dict this table replaces
+        for row in range(len(self.row_keys)):
+            if self.alive[row]:
+                yield self.nid_of(row)
+
+    def __len__(self):
+        return self.num_fields
+
+    def data_type_of(self, nid):
+        return self.data_types[self.type[self._row(nid)]]
+
+    def nids_of_source(self, source_name):
+        code = self.source_codes.get(source_name)
+        if code is None:
+            return []
+        return [self.nid_of(row) for row in self.source_rows[code]]
+
+    def sources(self):
+        return [name for name, rows in zip(self.source_names, self.source_rows) if len(rows) > 0]
+
+
+class SourceIds(Mapping):
+    """
+    Read-only view of source_name -> [nid] over a FieldInfoTable. Unknown sources have no fields, as with the
+    defaultdict it replaces
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, source_name):
+        return self.table.nids_of_source(source_name)
+
+    def __contains__(self, source_name):
+        return len(self.table.nids_of_source(source_name)) > 0
+
+    def __iter__(self):
+        return iter(self.table.sources())
+
+    def __len__(self):
+        return len(self.table.sources())
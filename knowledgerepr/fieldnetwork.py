@@ -1,6 +1,9 @@
+import heapq
+import itertools
 import matplotlib.pyplot as plt
 import operator
 import networkx as nx
+import numpy as np
 import os
 
 
@@ -12,6 +15,8 @@ from api.apiutils import Hit
 from api.apiutils import Relation
 from api.apiutils import compute_field_id
 from api.annotation import MRS
+from knowledgerepr.fieldinfo import FieldInfoTable
+from knowledgerepr.fieldinfo import SourceIds
 
 
 def build_hit(sn, fn):
@@ -24,14 +29,27 @@ class FieldNetwork:
     __G = nx.MultiGraph()
     __id_names = dict()
     __source_ids = defaultdict(list)
+    _table_join_graph = None
+    _reachability_index = None
+    _pairs_per_hop = 1  # key pairs of each join expanded into field paths by find_path_table
+    _edge_counts = None  # Relation -> number of edges, computed on first use and reset when edges change
 
     def __init__(self, graph=None, id_names=None, source_ids=None):
+        """
+        :param graph: the MultiGraph with nodes and relations
+        :param id_names: FieldInfoTable, a read-only mapping with the same methods (see modelformat.MappedFieldInfo),
+        or dict of nid -> (db_name, source_name, field_name, data_type)
+        :param source_ids: dict of source_name -> [nid], when id_names is a dict
+        """
         if graph is None:
             self.__G = nx.MultiGraph()
+            self.__id_names = FieldInfoTable()
         else:
             self.__G = graph
+            if isinstance(id_names, dict):
+                id_names = FieldInfoTable.from_dicts(id_names, source_ids)
             self.__id_names = id_names
-            self.__source_ids = source_ids
+        self.__source_ids = SourceIds(self.__id_names)
 
     def graph_order(self):
         return len(self.__id_names.keys())
@@ -40,7 +58,7 @@ class FieldNetwork:
         return len(self.__source_ids.keys())
 
     def iterate_ids(self):
-        for k, _ in self.__id_names.items():
+        for k in self.__id_names.keys():
             yield k
 
     def iterate_ids_text(self):
@@ -57,13 +75,12 @@ class FieldNetwork:
         return self.__source_ids[source]
 
     def get_data_type_of(self, nid):
-        _, _, _, data_type = self.__id_names[nid]
-        return data_type
+        return self.__id_names.data_type_of(nid)
 
     def get_info_for(self, nids):
+        nids = list(nids)
         info = []
-        for nid in nids:
-            db_name, source_name, field_name, data_type = self.__id_names[nid]
+        for nid, (db_name, source_name, field_name, data_type) in zip(nids, self.__id_names.infos(nids)):
             info.append((nid, db_name, source_name, field_name))
         return info
 
@@ -88,9 +105,15 @@ class FieldNetwork:
         return self.__G
 
     def _get_underlying_repr_id_to_field_info(self):
+        """
+        :return: the FieldInfoTable, which reads as a dict of nid -> (db_name, source_name, field_name, data_type)
+        """
         return self.__id_names
 
     def _get_underlying_repr_table_to_ids(self):
+        """
+        :return: read-only mapping of source_name -> [nid]
+        """
         return self.__source_ids
 
     def _visualize_graph(self):
@@ -109,8 +132,7 @@ class FieldNetwork:
         """
         print("Building schema relation...")
         for (nid, db_name, sn_name, fn_name, total_values, unique_values, data_type) in fields:
-            self.__id_names[nid] = (db_name, sn_name, fn_name, data_type)
-            self.__source_ids[sn_name].append(nid)
+            self.__id_names.add(nid, db_name, sn_name, fn_name, data_type)
             cardinality_ratio = None
             if float(total_values) > 0:
                 cardinality_ratio = float(unique_values) / float(total_values)
@@ -140,6 +162,28 @@ class FieldNetwork:
         self.__G.add_nodes_from(nodes)
         return nodes
 
+    def remove_field(self, nid):
+        """
+        Removes the node of this field, all its relations and its meta schema information
+        :param nid: the id of the node
+        :return:
+        """
+        if nid in self.__G:
+            self.__G.remove_node(nid)
+            self._edge_counts = None
+        self.__id_names.remove(nid)
+
+    def remove_relation(self, relation):
+        """
+        Removes all the edges of relation
+        :param relation: the type of relation (edge)
+        :return: number of edges removed
+        """
+        edges = [(src, tgt, key) for src, tgt, key in self.__G.edges_iter(keys=True) if key == relation]
+        self.__G.remove_edges_from(edges)
+        self._edge_counts = None
+        return len(edges)
+
     def add_relation(self, node_src, node_target, relation, score):
         """
         Adds or updates the score of relation for the edge between node_src and node_target
@@ -151,28 +195,61 @@ class FieldNetwork:
         """
         score = {'score': score}
         self.__G.add_edge(node_src, node_target, relation, score)
+        self._edge_counts = None
+
+    def add_relations(self, nodes_src, nodes_target, relation, scores):
+        """
+        Same as add_relation for many edges of the same relation at once
+        :param nodes_src: the source nodes
+        :param nodes_target: the target nodes
+        :param relation: the type of relation (edge)
+        :param scores: the score of each edge
+        :return:
+        """
+        self.__G.add_edges_from((node_src, node_target, relation, {'score': score})
+                                for node_src, node_target, score in zip(nodes_src, nodes_target, scores))
+        self._edge_counts = None
 
     def fields_degree(self, topk):
-        degree = nx.degree(self.__G)
-        sorted_degree = sorted(degree.items(), key=operator.itemgetter(1))
-        sorted_degree.reverse()
-        topk_nodes = sorted_degree[:topk]
-        return topk_nodes
+        """
+        :param topk: number of fields to return
+        :return: list of (nid, degree) of the topk fields with most edges, of any relation, highest first
+        """
+        return heapq.nlargest(topk, self.__G.degree_iter(), key=operator.itemgetter(1))
+
+    def iterate_edges(self, relation):
+        """
+        Streams the edges of relation, each undirected edge once
+        :param relation: the type of relation (edge)
+        :return: generator of (nid, nid, score)
+        """
+        for src, tgt, key, data in self.__G.edges_iter(keys=True, data=True):
+            if key == relation:
+                yield src, tgt, data['score']
+
+    def relation_count(self, relation):
+        """
+        :param relation: the type of relation (edge)
+        :return: number of edges of relation
+        """
+        if self._edge_counts is None:
+            edge_counts = defaultdict(int)
+            for _, _, key in self.__G.edges_iter(keys=True):
+                edge_counts[key] += 1
+            self._edge_counts = dict(edge_counts)
+        return self._edge_counts.get(relation, 0)
 
     def enumerate_relation(self, relation, as_str=True):
-        seen_pairs = set()
-        for nid in self.iterate_ids():
+        for nid, nid2, score in self.iterate_edges(relation):
             db_name, source_name, field_name, data_type = self.__id_names[nid]
             hit = Hit(nid, db_name, source_name, field_name, 0)
-            neighbors = self.neighbors_id(hit, relation)
-            for n2 in neighbors:
-                if not (n2.nid, nid) in seen_pairs:
-                    seen_pairs.add((nid, n2.nid))
-                    if as_str:
-                        string = str(hit) + " - " + str(n2)
-                        yield string
-                    else:
-                        yield hit, n2
+            db_name, source_name, field_name, data_type = self.__id_names[nid2]
+            n2 = Hit(nid2, db_name, source_name, field_name, score)
+            if as_str:
+                string = str(hit) + " - " + str(n2)
+                yield string
+            else:
+                yield hit, n2
 
     def print_relations(self, relation):
         total_relationships = 0
@@ -220,17 +297,33 @@ class FieldNetwork:
         if isinstance(hit, str):
             nid = hit
         nid = str(nid)
-        data = []
-        neighbours = self.__G[nid]
-        for k, v in neighbours.items():
-            if relation in v:
-                score = v[relation]['score']
-                (db_name, source_name, field_name, data_type) = self.__id_names[k]
-                data.append(Hit(k, db_name, source_name, field_name, score))
+        neighbours = [(k, v[relation]['score']) for k, v in self.__G[nid].items() if relation in v]
+        infos = self.__id_names.infos([k for k, _ in neighbours])
+        data = [Hit(k, db_name, source_name, field_name, score)
+                for (k, score), (db_name, source_name, field_name, data_type) in zip(neighbours, infos)]
         op = self.get_op_from_relation(relation)
         o_drs = DRS(data, Operation(op, params=[hit]))
         return o_drs
 
+    def neighbors_batch(self, nids, relation: Relation):
+        """
+        Neighbours of many nodes through relation, in one call and without building Hits or DRS
+        :param nids: the nids of the nodes
+        :param relation: the type of relation (edge)
+        :return: (src, dst, score) arrays with one entry per edge, src and dst are nids
+        """
+        src = []
+        dst = []
+        score = []
+        for nid in nids:
+            nid = str(nid)
+            for k, v in self.__G[nid].items():
+                if relation in v:
+                    src.append(nid)
+                    dst.append(k)
+                    score.append(v[relation]['score'])
+        return np.array(src, dtype=object), np.array(dst, dtype=object), np.array(score, dtype=np.float64)
+
     def md_neighbors_id(self, hit: Hit, md_neighbors: MRS, relation: Relation) -> DRS:
         if isinstance(hit, Hit):
             nid = str(hit.nid)
@@ -247,7 +340,81 @@ class FieldNetwork:
         o_drs = DRS(data, Operation(op, params=[hit]))
         return o_drs
 
-    def find_path_hit(self, source, target, relation, max_hops=5):
+    def shortest_paths(self, source_nid, target_nid, relation, max_hops=5, k=1):
+        """
+        Bidirectional breadth-first search of the shortest paths between two nodes. Each step expands a whole
+        level of the smaller frontier with one neighbors_batch call
+        :param source_nid: nid of the source node
+        :param target_nid: nid of the target node
+        :param relation: the relation the paths follow
+        :param max_hops: max number of edges of a path
+        :param k: max number of shortest paths returned
+        :return: list of up to k paths, each a list of (nid, score of the edge from the previous node)
+        """
+        source_nid = str(source_nid)
+        target_nid = str(target_nid)
+        if source_nid == target_nid:
+            return [[(source_nid, 0)]]
+        # distance and parents (with the score of the edge) of the nodes visited from each side
+        dist = [{source_nid: 0}, {target_nid: 0}]
+        parents = [{source_nid: []}, {target_nid: []}]
+        frontier = [[source_nid], [target_nid]]
+        depth = [0, 0]
+        meet = []
+        while len(frontier[0]) > 0 and len(frontier[1]) > 0 and depth[0] + depth[1] < max_hops:
+            side = 0 if len(frontier[0]) <= len(frontier[1]) else 1
+            next_frontier = []
+            src, dst, score = self.neighbors_batch(frontier[side], relation)
+            for u, v, sc in zip(src.tolist(), dst.tolist(), score.tolist()):
+                d = dist[side].get(v)
+                if d is None:
+                    dist[side][v] = depth[side] + 1
+                    parents[side][v] = [(u, sc)]
+                    next_frontier.append(v)
+                elif d == depth[side] + 1:
+                    parents[side][v].append((u, sc))
+            depth[side] += 1
+            frontier[side] = next_frontier
+            other = dist[1 - side]
+            meet = [n for n in next_frontier if n in other]
+            if len(meet) > 0:
+                shortest = min(other[n] for n in meet)
+                meet = [n for n in meet if other[n] == shortest]
+                break
+
+        def half_paths(node, parents_of):
+            # all shortest paths from node to the origin of one side, as [(node, score to the next node)]
+            if len(parents_of[node]) == 0:
+                yield [(node, 0)]
+                return
+            for parent, sc in parents_of[node]:
+                for p in half_paths(parent, parents_of):
+                    yield [(node, sc)] + p
+
+        paths = []
+        for m in meet:
+            for forward in half_paths(m, parents[0]):
+                forward.reverse()  # source first, each score is the one of the edge from the previous node
+                for backward in half_paths(m, parents[1]):
+                    # backward starts at m, each score is the one of the edge to the next node
+                    path = list(forward)
+                    for (_, sc), (n, _) in zip(backward, backward[1:]):
+                        path.append((n, sc))
+                    paths.append(path)
+                    if len(paths) == k:
+                        return paths
+        return paths
+
+    def find_path_hit(self, source, target, relation, max_hops=5, k=1):
+        """
+        Finds the shortest paths between source and target following relation
+        :param source: Hit or nid
+        :param target: Hit or nid
+        :param relation: the relation the paths follow
+        :param max_hops: max number of edges of a path
+        :param k: max number of shortest paths in the result, all of the same length
+        :return: DRS with target as data and the paths as provenance, empty if there is no path
+        """
 
         def assemble_field_path_provenance(o_drs, path, relation):
             src = path[0]
@@ -255,63 +422,83 @@ class FieldNetwork:
             origin = DRS([src], Operation(OP.ORIGIN))
             o_drs.absorb_provenance(origin)
             prev_c = src
+            op = self.get_op_from_relation(relation)
             for c in path[1:-1]:
-                nxt = DRS([c], Operation(OP.PKFK, params=[prev_c]))
+                nxt = DRS([c], Operation(op, params=[prev_c]))
                 o_drs.absorb_provenance(nxt)
                 prev_c = c
-            sink = DRS([tgt], Operation(OP.PKFK, params=[prev_c]))
+            sink = DRS([tgt], Operation(op, params=[prev_c]))
             o_drs = o_drs.absorb(sink)
             return o_drs
 
-        def deep_explore(candidates, target_group, already_visited, path, max_hops):
-            """
-            Recursively depth-first explore the graph, checking if candidates are in target_group
-            Returns (boolean, [])
-            """
-            local_max_hops = max_hops
+        def to_hit(nid, score):
+            (db_name, source_name, field_name, data_type) = self.__id_names[nid]
+            return Hit(nid, db_name, source_name, field_name, score)
 
-            if local_max_hops == 0:
-                return False
+        source_nid = str(source.nid) if isinstance(source, Hit) else str(source)
+        target_nid = str(target.nid) if isinstance(target, Hit) else str(target)
+        if not isinstance(source, Hit):
+            source = to_hit(source_nid, 0)
 
-            # first check membership
-            for c in candidates:
-                if c in target_group:
-                    path.insert(0, c)
-                    return True
-
-            # if not, then we explore these individually
-            for c in candidates:
-                if c in already_visited:
-                    continue  # next candidate
-                else:
-                    already_visited.append(c)  # add candidate to set of already visited
+        paths = self.shortest_paths(source_nid, target_nid, relation, max_hops=max_hops, k=k)
+        if len(paths) == 0:
+            return DRS([], Operation(OP.NONE))
 
-                next_level_candidates = [x for x in self.neighbors_id(c, relation)]  # get next set of candidates
+        o_drs = DRS([], Operation(OP.NONE))  # Carrier of provenance
+        for path in paths:
+            hits = [source] + [to_hit(nid, score) for nid, score in path[1:]]
+            if len(hits) == 1:
+                hits.append(source)  # source is the target
+            o_drs = assemble_field_path_provenance(o_drs, hits, relation)
+        return o_drs
 
-                if len(next_level_candidates) == 0:
-                    continue
-                next_max_hops = local_max_hops - 1  # reduce one level depth and go ahead
-                success = deep_explore(next_level_candidates, target_group, already_visited, path, next_max_hops)
-                if success:
-                    path.insert(0, c)
-                    return True
-            return False  # if all nodes were already visited
+    def set_table_join_graph(self, table_join_graph, reachability_index=None, pairs_per_hop=1):
+        """
+        :param table_join_graph: the TableJoinGraph of the PKFK relation, used by find_path_table
+        :param reachability_index: the ReachabilityIndex of table_join_graph, it is built if not given
+        :param pairs_per_hop: find_path_table expands each table path with the pairs_per_hop best key pairs of each
+        join, so it returns up to pairs_per_hop ** hops field paths per table path
+        """
+        from knowledgerepr.tablegraph import ReachabilityIndex
+        self._table_join_graph = table_join_graph
+        self._pairs_per_hop = pairs_per_hop
+        if table_join_graph is not None and reachability_index is None:
+            reachability_index = ReachabilityIndex.from_join_graph(table_join_graph)
+        self._reachability_index = reachability_index
 
-        # maximum number of hops
-        max_hops = 5
+    def get_table_join_graph(self):
+        return self._table_join_graph
 
-        o_drs = DRS([], Operation(OP.NONE))  # Carrier of provenance
+    def get_reachability_index(self):
+        """
+        :return: the ReachabilityIndex of the table join graph, None if the network does not have one
+        """
+        return self._reachability_index
 
-        # TODO: same src == trg, etc
+    def _table_paths_from_join_graph(self, source, target, max_hops):
+        """
+        Join paths between two tables in the format of find_path_table, [(field, entry field of its table)].
+        Table paths come from the join graph, and each one is expanded to the combinations of the best key pairs
+        of its joins, self._pairs_per_hop of them per join. Expanding all the key pairs grows with the product of
+        their numbers, which is large for tables joined on many fields
+        """
 
-        path = []
+        def to_hit(nid, score):
+            (db_name, source_name, field_name, data_type) = self.__id_names[nid]
+            return Hit(nid, db_name, source_name, field_name, score)
 
-        success = deep_explore([source], [target], [], path, max_hops)
-        if success:
-            o_drs = assemble_field_path_provenance(o_drs, path, relation)
-            return o_drs
-        else:
-            return DRS([], Operation(OP.NONE))
+        found_paths = []
+        for tables in self._table_join_graph.paths(source, target, max_hops=max_hops):
+            hops = [self._table_join_graph.key_pairs(t1, t2, limit=self._pairs_per_hop)
+                    for t1, t2 in zip(tables, tables[1:])]
+            for pairs in itertools.product(*hops):
+                path = [(to_hit(pairs[0][0], 0), None)]
+                for (_, entry, score), (leave, _, _) in zip(pairs, pairs[1:]):
+                    path.append((to_hit(leave, 0), to_hit(entry, score)))
+                _, entry, score = pairs[-1]
+                path.append((to_hit(entry, score), to_hit(entry, score)))
+                found_paths.append(path)
+        return found_paths
 
     def find_path_table(self, source: str, target: str, relation, api, max_hops=3, lean_search=False):
 
@@ -412,12 +599,16 @@ class FieldNetwork:
 
         # TODO: same src == trg, etc
 
+        found_paths = []
+        if self._table_join_graph is not None and relation == Relation.PKFK:
+            found_paths = self._table_paths_from_join_graph(source, target, max_hops)
+            return assemble_table_path_provenance(o_drs, found_paths, relation)
+
         # src_drs = api.drs_from_table(source)
         # trg_drs = api.drs_from_table(target)
         src_drs = api.make_drs(source)
         trg_drs = api.make_drs(target)
 
-        found_paths = []
         candidates = [(x, None) for x in src_drs]  # tuple carrying candidate and same-table attribute
 
         paths = [[]]  # to carry partial paths
@@ -446,13 +637,24 @@ def serialize_network_to_csv(network, path):
             s = str(n) + "," + "node\n"
             f.write(s)
 
-def serialize_network(network, path):
+def serialize_network(network, path, model_format='binary'):
     """
     Serialize the meta schema index
     :param network:
     :param path:
+    :param model_format: 'binary' for the columnar format of modelformat, 'pickle' for the gpickle files
     :return:
     """
+    if model_format not in ('binary', 'pickle'):
+        raise ValueError("Unknown model format: " + str(model_format))
+    if network.get_table_join_graph() is not None:
+        os.makedirs(path, exist_ok=True)
+        network.get_table_join_graph().save(path)
+        network.get_reachability_index().save(path)
+    if model_format == 'binary':
+        from knowledgerepr import modelformat
+        modelformat.write_model(network, path)
+        return
     G = network._get_underlying_repr_graph()
     id_to_field_info = network._get_underlying_repr_id_to_field_info()
     table_to_ids = network._get_underlying_repr_table_to_ids()
@@ -461,16 +663,45 @@ def serialize_network(network, path):
     path = path + '/'  # force separator
     os.makedirs(os.path.dirname(path), exist_ok=True)
 
+    # plain dicts, as models written before the FieldInfoTable
     nx.write_gpickle(G, path + "graph.pickle")
-    nx.write_gpickle(id_to_field_info, path + "id_info.pickle")
-    nx.write_gpickle(table_to_ids, path + "table_ids.pickle")
+    nx.write_gpickle(dict(id_to_field_info.items()), path + "id_info.pickle")
+    nx.write_gpickle(defaultdict(list, table_to_ids.items()), path + "table_ids.pickle")
 
 
-def deserialize_network(path):
-    G = nx.read_gpickle(path + "graph.pickle")
-    id_to_info = nx.read_gpickle(path + "id_info.pickle")
-    table_to_ids = nx.read_gpickle(path + "table_ids.pickle")
-    network = FieldNetwork(G, id_to_info, table_to_ids)
+def deserialize_network(path, backend='networkx', metrics=None, mmap=False):
+    """
+    Loads a serialized network, from the binary format if the model has it, or from the pickle format
+    :param path: directory of the serialized model
+    :param backend: 'networkx' for a FieldNetwork backed by a MultiGraph, 'csr' for a read-only CSRFieldNetwork.
+    The MultiGraph is built edge by edge, so a binary model loads fast only with the csr backend
+    :param metrics: optional BuildMetrics where the steps of loading a binary model are recorded
+    :param mmap: memory-map the model read-only, shared by all the processes that load it. Needs the csr backend
+    and a model in the binary format
+    :return: the network
+    """
+    if backend not in ('networkx', 'csr'):
+        raise ValueError("Unknown network backend: " + str(backend))
+    from knowledgerepr import modelformat
+    from knowledgerepr.tablegraph import TableJoinGraph
+    from knowledgerepr.tablegraph import ReachabilityIndex
+    if modelformat.has_model(path):
+        network = modelformat.read_model(path, backend=backend, metrics=metrics, mmap=mmap)
+    elif mmap:
+        raise ValueError("Only binary models can be memory-mapped, convert it with modelformat --convert: " +
+                         str(path))
+    else:
+        G = nx.read_gpickle(path + "graph.pickle")
+        id_to_info = nx.read_gpickle(path + "id_info.pickle")
+        table_to_ids = nx.read_gpickle(path + "table_ids.pickle")
+        network = FieldNetwork(G, id_to_info, table_to_ids)
+        if backend == 'csr':
+            from knowledgerepr.csrnetwork import CSRFieldNetwork
+            network = CSRFieldNetwork.from_field_network(network)
+    table_join_graph = TableJoinGraph.load(path)
+    if table_join_graph is not None:
+        # built here for models saved without it
+        network.set_table_join_graph(table_join_graph, ReachabilityIndex.load(path, table_join_graph))
     return network
 
 
@@ -1,27 +1,57 @@
+import heapq
+import os
+from array import array
+
+import numpy as np
+
 from api.apiutils import DRS
 from api.annotation import MRS
 from api.apiutils import Operation
 from api.apiutils import Hit
 from api.apiutils import Relation
-from knowledgerepr import EKGapi
-from knowledgerepr.ekgstore.pg_store import PGStore
+from knowledgerepr.EKGapi import BackEndType
+from knowledgerepr.EKGapi import EKGapi
+from knowledgerepr.fieldinfo import FieldInfoTable
+from knowledgerepr.fieldinfo import SourceIds
 
 from ctypes import *
 
 global gI
 gI = None
 
+# the library keeps the type of an edge as a bitmask in a char, one bit per relation
+RELATION_BITS = {
+    Relation.SCHEMA_SIM: 1,
+    Relation.CONTENT_SIM: 2,
+    Relation.ENTITY_SIM: 4,
+    Relation.PKFK: 8,
+    Relation.INCLUSION_DEPENDENCY: 16,
+    Relation.MEANS_SAME: 32,
+    Relation.MEANS_DIFF: 64,
+}
+
+DEFAULT_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "graph_index.so")
+
+
 def load_and_config_library(libname):
     global gI
     gI = cdll.LoadLibrary(libname)
-    gI.neighbors.argtypes = [POINTER(POINTER(c_int32))]
-    gI.neighbors.restype = int
-    gI.all_paths.argtypes = [POINTER(POINTER(c_int32))]
-    gI.all_paths.restype = int
+    gI.neighbors.argtypes = [POINTER(POINTER(c_int32)), c_int, c_byte]
+    gI.neighbors.restype = c_int
+    gI.all_paths.argtypes = [POINTER(POINTER(c_int32)), c_int, c_int, c_byte, c_int]
+    gI.all_paths.restype = c_int
     gI.release_array.argtypes = [POINTER(c_int32)]
     gI.release_array.restype = None
     gI.serialize_graph_to_disk.argtypes = [c_char_p]
     gI.serialize_graph_to_disk.restype = None
+    gI.add_node.argtypes = [c_int]
+    gI.add_node.restype = c_bool
+    gI.add_undirected_edge.argtypes = [c_int, c_int, c_byte]
+    gI.add_undirected_edge.restype = c_bool
+    gI.add_undirected_edges.argtypes = [POINTER(c_int32), POINTER(c_int32), c_int, c_byte]
+    gI.add_undirected_edges.restype = c_int
+    gI.clear_graph.argtypes = []
+    gI.clear_graph.restype = None
 
 
 def get_gI_path(path: str):
@@ -29,79 +59,301 @@ def get_gI_path(path: str):
     return p
 
 
-class GIndexEKG(EKGapi):
+def as_int32_buffer(array):
+    """
+    :return: the ctypes pointer to the data of a contiguous int32 numpy array, the array is not copied
+    """
+    return array.ctypes.data_as(POINTER(c_int32))
+
+
+class GIndexEKG:
+    """
+    EKGapi backend on the native graph index of GraphIndex.cpp. The index keeps only the structure of the graph:
+    nodes are dense int ids and each edge has a bitmask with its relations. Everything else is kept here, in memory:
+     - the meta schema of the fields, in a FieldInfoTable, to map ids back to Hits
+     - the cardinality and degree of each node
+     - the edges of each relation, as a sorted int64 array of edge keys (see _edge_keys) and an aligned float32
+       array with their scores. Scores are looked up with a binary search, and bulk loads are merged with numpy
+    The library has one global graph per process, so there can only be one GIndexEKG at a time. It does not keep
+    self loops.
+    """
 
     def __init__(self, config=None):
-        self.backend_type = EKGapi.BackEndType.G_INDEX
-        self.pg = PGStore(db_ip=config.host,
-                          db_port=config.port,
-                          db_name=config.db_name,
-                          db_user=config.db_user,
-                          db_passwd=config.db_passwd)
+        """
+        :param config: optional object with the path of the compiled library in gindex_library
+        """
+        self.backend_type = BackEndType.G_INDEX
+        if gI is None:
+            load_and_config_library(getattr(config, 'gindex_library', DEFAULT_LIBRARY))
+        gI.clear_graph()
+        self._id_names = FieldInfoTable()
+        self._source_ids = SourceIds(self._id_names)
+        self._nids = []  # dense id -> nid
+        self._dense_id = dict()
+        self._cardinality = []
+        self._degree = array('q')
+        self._edges = {relation: np.empty(0, dtype=np.int64) for relation in RELATION_BITS.keys()}
+        self._scores = {relation: np.empty(0, dtype=np.float32) for relation in RELATION_BITS.keys()}
+
+    @staticmethod
+    def from_field_network(network, config=None):
+        """
+        Bulk loads the nodes, meta schema and edges of a FieldNetwork into the native index
+        :param network: a FieldNetwork or CSRFieldNetwork
+        :param config: see __init__
+        :return: the GIndexEKG
+        """
+        ekg = GIndexEKG(config)
+        for nid, (db_name, source_name, field_name, data_type) in \
+                network._get_underlying_repr_id_to_field_info().items():
+            ekg._id_names.add(nid, db_name, source_name, field_name, data_type)
+            ekg.add_field(nid, network.get_cardinality_of(nid))
+        for relation in RELATION_BITS.keys():
+            edges = list(network.iterate_edges(relation))
+            if len(edges) > 0:
+                nodes_src, nodes_target, scores = zip(*edges)
+                ekg.add_relations(nodes_src, nodes_target, relation, scores)
+        return ekg
+
+    @staticmethod
+    def _type_of(relation):
+        return RELATION_BITS.get(relation)
+
+    @staticmethod
+    def _edge_keys(src, tgt):
+        """
+        :return: int64 array with the key of each undirected edge, the lower dense id in the high 32 bits
+        """
+        src = np.asarray(src, dtype=np.int64)
+        tgt = np.asarray(tgt, dtype=np.int64)
+        return (np.minimum(src, tgt) << 32) | np.maximum(src, tgt)
+
+    def _scores_of(self, relation, src, tgt):
+        """
+        :return: list with the score of each edge src[k] - tgt[k] of relation, all of them in the index
+        """
+        edges = self._edges.get(relation)
+        if edges is None or len(src) == 0:
+            return []
+        return self._scores[relation][np.searchsorted(edges, self._edge_keys(src, tgt))].tolist()
+
+    def _add_nodes(self, nids):
+        """
+        Adds the nodes of nids not in the index yet, one call per distinct nid
+        :return: int32 array with the dense id of each nid
+        """
+        distinct, inverse = np.unique(np.array([str(nid) for nid in nids], dtype=object), return_inverse=True)
+        ids = np.array([self.add_field(nid) for nid in distinct.tolist()], dtype=np.int32)
+        return ids[inverse] if len(ids) > 0 else ids
 
     """
     WRITE OPS
     """
 
-    def init(self, fields: (int, str, str, str, int, int, str)):
+    def init_meta_schema(self, fields: (int, str, str, str, int, int, str)):
         print("Building schema relation...")
         for (nid, db_name, sn_name, fn_name, total_values, unique_values, data_type) in fields:
-            #self.__id_names[nid] = (db_name, sn_name, fn_name, data_type)
-            #self.__source_ids[sn_name].append(nid)
+            self._id_names.add(nid, db_name, sn_name, fn_name, data_type)
             uniqueness_ratio = None
             if float(total_values) > 0:
                 uniqueness_ratio = float(unique_values) / float(total_values)
-            self.pg.new_node(node_id=nid, uniqueness_ratio=uniqueness_ratio)
+            self.add_field(nid, uniqueness_ratio)
         print("Building schema relation...OK")
 
-    def add_node(self, nid, uniqueness_ratio=None):
-        self.pg.new_node(node_id=nid, uniqueness_ratio=uniqueness_ratio)
+    def add_field(self, nid, cardinality=None):
+        """
+        Adds the node of a field to the index, if it is not there yet
+        :return: the dense id of the node
+        """
+        i = self._dense_id.get(nid)
+        if i is None:
+            i = len(self._nids)
+            self._dense_id[nid] = i
+            self._nids.append(nid)
+            self._cardinality.append(cardinality)
+            self._degree.append(0)
+            gI.add_node(i)
+        return i
+
+    def add_fields(self, list_of_fields):
+        for nid, sn, fn in list_of_fields:
+            self.add_field(nid)
+
+    def add_relation(self, node_src, node_target, relation, score):
+        self.add_relations([node_src], [node_target], relation, [score])
+
+    def add_relations(self, nodes_src, nodes_target, relation, scores):
+        """
+        Adds many edges of the same relation, passed to the native index as two int32 buffers in one call
+        """
+        edge_type = self._type_of(relation)
+        if edge_type is None:
+            raise ValueError("Relation " + str(relation) + " is not supported by the graph index")
+        ids = self._add_nodes(list(nodes_src) + list(nodes_target))
+        src, tgt = ids[:len(ids) // 2], ids[len(ids) // 2:]
+        scores = np.asarray(scores, dtype=np.float32)
+        keep = src != tgt
+        src, tgt, scores = np.ascontiguousarray(src[keep]), np.ascontiguousarray(tgt[keep]), scores[keep]
+        if len(src) == 0:
+            return
+
+        # the last score of an edge wins, as when edges are added one by one
+        keys = self._edge_keys(src, tgt)
+        order = np.argsort(keys, kind='mergesort')
+        keys, scores = keys[order], scores[order]
+        last = np.append(keys[1:] != keys[:-1], True)
+        keys, scores = keys[last], scores[last]
+
+        edges, edge_scores = self._edges[relation], self._scores[relation]
+        positions = np.searchsorted(edges, keys)
+        known = positions < len(edges)
+        known[known] = edges[positions[known]] == keys[known]
+        edge_scores = edge_scores.copy()
+        edge_scores[positions[known]] = scores[known]
+        new = ~known
+        self._edges[relation] = np.insert(edges, positions[new], keys[new])
+        self._scores[relation] = np.insert(edge_scores, positions[new], scores[new])
+        degree = np.frombuffer(self._degree, dtype=np.int64)
+        np.add.at(degree, keys[new] >> 32, 1)
+        np.add.at(degree, keys[new] & 0xffffffff, 1)
+        del degree
 
-    def add_edge(self, node_src, node_target, relation, score):
-        self.pg.new_edge(source_node_id=node_src, target_node_id=node_target, relation_type=relation, weight=score)
+        gI.add_undirected_edges(as_int32_buffer(src), as_int32_buffer(tgt), len(src), edge_type)
 
     """
     READ OPS
     """
 
+    def _hit(self, i, score):
+        nid = self._nids[i]
+        (db_name, source_name, field_name, data_type) = self._id_names[nid]
+        return Hit(nid, db_name, source_name, field_name, score)
+
+    def _neighbors_of(self, i, edge_type):
+        """
+        :return: list with the dense ids of the neighbours of i, read from the buffer of the library
+        """
+        output = POINTER(c_int32)()
+        size = gI.neighbors(output, i, edge_type)
+        try:
+            if size == 0:
+                return []
+            return np.ctypeslib.as_array(output, shape=(size,)).tolist()
+        finally:
+            gI.release_array(output)
+
     def neighbors_id(self, hit: Hit, relation: Relation) -> DRS:
-        # nid = None
-        # if isinstance(hit, Hit):
-        #     nid = str(hit.nid)
-        # if isinstance(hit, str):
-        #     nid = hit
-        # nid = str(nid)
-        # data = []
-        # neighbours = self.pg.connected_to(nid)
-        # for k, v in neighbours.items():
-        #     if relation in v:
-        #         score = v[relation]['score']
-        #         (db_name, source_name, field_name, data_type) = self.__id_names[k]
-        #         data.append(Hit(k, db_name, source_name, field_name, score))
-        # op = self.get_op_from_relation(relation)
-        # o_drs = DRS(data, Operation(op, params=[hit]))
-        # return o_drs
-        return
+        if isinstance(hit, Hit):
+            nid = str(hit.nid)
+        if isinstance(hit, str):
+            nid = hit
+        nid = str(nid)
+        data = []
+        edge_type = self._type_of(relation)
+        if edge_type is not None:
+            i = self._dense_id[nid]
+            neighbors = self._neighbors_of(i, edge_type)
+            scores = self._scores_of(relation, [i] * len(neighbors), neighbors)
+            data = [self._hit(j, score) for j, score in zip(neighbors, scores)]
+        op = EKGapi.get_op_from_relation(relation)
+        o_drs = DRS(data, Operation(op, params=[hit]))
+        return o_drs
 
     def md_neighbors_id(self, hit: Hit, md_neighbors: MRS, relation: Relation) -> DRS:
-        return
+        if isinstance(hit, Hit):
+            nid = str(hit.nid)
+        if isinstance(hit, str):
+            nid = hit
+        nid = str(nid)
+        data = []
+        score = 1.0
+        for hit in md_neighbors:
+            k = hit.target if hit.target != nid else hit.source
+            (db_name, source_name, field_name, data_type) = self._id_names[k]
+            data.append(Hit(k, db_name, source_name, field_name, score))
+        op = EKGapi.get_op_from_relation(relation)
+        o_drs = DRS(data, Operation(op, params=[hit]))
+        return o_drs
+
+    def shortest_paths(self, source_nid, target_nid, relation, max_hops=5):
+        """
+        All the shortest paths between two nodes, searched by the native index
+        :return: list of paths, each a list of dense ids from source to target
+        """
+        edge_type = self._type_of(relation)
+        i = self._dense_id[str(source_nid)]
+        j = self._dense_id[str(target_nid)]
+        if edge_type is None:
+            return [[i]] if i == j else []
+        output = POINTER(c_int32)()
+        size = gI.all_paths(output, i, j, edge_type, max_hops)
+        if size == 0:
+            return []
+        try:
+            # paths come one after the other, each one starts with -1
+            buffer = np.ctypeslib.as_array(output, shape=(size,))
+            starts = np.flatnonzero(buffer == -1).tolist() + [size]
+            return [buffer[lo + 1:hi].tolist() for lo, hi in zip(starts, starts[1:])]
+        finally:
+            gI.release_array(output)
+
+    def find_path_hit(self, source, target, relation, max_hops=5, k=1):
+        """
+        Same as FieldNetwork.find_path_hit
+        :param source: Hit or nid
+        :param target: Hit or nid
+        :param relation: the relation the paths follow
+        :param max_hops: max number of edges of a path
+        :param k: max number of shortest paths in the result, all of the same length
+        :return: DRS with target as data and the paths as provenance, empty if there is no path
+        """
+        source_nid = str(source.nid) if isinstance(source, Hit) else str(source)
+        target_nid = str(target.nid) if isinstance(target, Hit) else str(target)
+        if not isinstance(source, Hit):
+            source = self._hit(self._dense_id[source_nid], 0)
+
+        paths = self.shortest_paths(source_nid, target_nid, relation, max_hops=max_hops)[:k]
+        return EKGapi.paths_to_drs([[source] + [self._hit(j, score) for j, score in
+                                                zip(path[1:], self._scores_of(relation, path[:-1], path[1:]))]
+                                    for path in paths], relation)
 
     """
     ANALYTICAL OPS
     """
 
     def topk_nodes_by_degree(self, topk):
-        return
+        """
+        :return: list of (nid, degree) of the topk nodes with most edges, of any relation, highest first
+        """
+        top = heapq.nlargest(topk, range(len(self._degree)), key=self._degree.__getitem__)
+        return [(self._nids[i], self._degree[i]) for i in top]
 
     def enumerate_edges_of_type(self, relation):
-        return
+        """
+        :return: generator of (Hit, Hit) with each edge of relation once
+        """
+        edges = self._edges.get(relation)
+        if edges is None:
+            return
+        for i, j, score in zip((edges >> 32).tolist(), (edges & 0xffffffff).tolist(), self._scores[relation].tolist()):
+            yield self._hit(i, 0), self._hit(j, score)
 
     """
     UTILS
     """
 
     def print_edges_of_type(self, relation):
-        return
+        total_relationships = 0
+        for hit, n2 in self.enumerate_edges_of_type(relation):
+            total_relationships += 1
+            print(str(hit) + " - " + str(n2))
+        print("Total " + str(relation) + " relations: " + str(total_relationships))
+
+    def serialize_graph(self, path):
+        """
+        Writes the edges of the native index, as dense ids and type bitmasks, to a CSV file
+        """
+        gI.serialize_graph_to_disk(get_gI_path(path))
 
 
 if __name__ == "__main__":
@@ -1,7 +1,195 @@
-from knowledgerepr import EKGapi
+import heapq
+import os
+import pickle
 
+from api.apiutils import DRS
+from api.annotation import MRS
+from api.apiutils import Operation
+from api.apiutils import Hit
+from api.apiutils import Relation
+from knowledgerepr.EKGapi import BackEndType
+from knowledgerepr.EKGapi import EKGapi
+from knowledgerepr.fieldinfo import FieldInfoTable
+from knowledgerepr.fieldinfo import SourceIds
+from knowledgerepr.lite_graph import LiteGraph
 
-class InMemoryEKG(EKGapi):
+
+class InMemoryEKG:
+    """
+    EKGapi backend on a LiteGraph, with the meta schema of the fields in a FieldInfoTable and the cardinality of
+    each field. It answers the same queries as FieldNetwork with a fraction of the memory of the networkx graph.
+    """
+
+    file_name = "lite_graph.pickle"
 
     def __init__(self, config=None):
-        self.backend_type = EKGapi.BackEndType.IN_MEMORY
\ No newline at end of file
+        self.backend_type = BackEndType.IN_MEMORY
+        self._graph = LiteGraph()
+        self._id_names = FieldInfoTable()
+        self._source_ids = SourceIds(self._id_names)
+        self._cardinality = dict()
+
+    @staticmethod
+    def from_field_network(network):
+        """
+        :param network: a FieldNetwork or CSRFieldNetwork
+        :return: the InMemoryEKG with the fields and edges of network
+        """
+        ekg = InMemoryEKG()
+        for nid, (db_name, source_name, field_name, data_type) in \
+                network._get_underlying_repr_id_to_field_info().items():
+            ekg._id_names.add(nid, db_name, source_name, field_name, data_type)
+            ekg.add_field(nid, network.get_cardinality_of(nid))
+        for relation in Relation:
+            for node_src, node_target, score in network.iterate_edges(relation):
+                ekg.add_relation(node_src, node_target, relation, score)
+        return ekg
+
+    """
+    WRITE OPS
+    """
+
+    def init_meta_schema(self, fields: (int, str, str, str, int, int, str)):
+        print("Building schema relation...")
+        for (nid, db_name, sn_name, fn_name, total_values, unique_values, data_type) in fields:
+            self._id_names.add(nid, db_name, sn_name, fn_name, data_type)
+            cardinality_ratio = None
+            if float(total_values) > 0:
+                cardinality_ratio = float(unique_values) / float(total_values)
+            self.add_field(nid, cardinality_ratio)
+        print("Building schema relation...OK")
+
+    def add_field(self, nid, cardinality=None):
+        self._graph.add_node(nid)
+        self._cardinality[nid] = cardinality
+        return nid
+
+    def add_fields(self, list_of_fields):
+        for nid, sn, fn in list_of_fields:
+            self.add_field(nid)
+
+    def add_relation(self, node_src, node_target, relation, score):
+        self._graph.add_undirected_edge(node_src, node_target, relation, score)
+
+    """
+    READ OPS
+    """
+
+    def get_cardinality_of(self, nid):
+        card = self._cardinality.get(nid)
+        if card is None:
+            return 0  # no cardinality is like card 0
+        return card
+
+    def _hit(self, nid, score):
+        (db_name, source_name, field_name, data_type) = self._id_names[nid]
+        return Hit(nid, db_name, source_name, field_name, score)
+
+    def neighbors_id(self, hit: Hit, relation: Relation) -> DRS:
+        if isinstance(hit, Hit):
+            nid = str(hit.nid)
+        if isinstance(hit, str):
+            nid = hit
+        nid = str(nid)
+        data = [self._hit(k, score) for k, score in self._graph.neighbors_with_scores(nid, relation)]
+        op = EKGapi.get_op_from_relation(relation)
+        o_drs = DRS(data, Operation(op, params=[hit]))
+        return o_drs
+
+    def md_neighbors_id(self, hit: Hit, md_neighbors: MRS, relation: Relation) -> DRS:
+        if isinstance(hit, Hit):
+            nid = str(hit.nid)
+        if isinstance(hit, str):
+            nid = hit
+        nid = str(nid)
+        data = []
+        score = 1.0
+        for hit in md_neighbors:
+            k = hit.target if hit.target != nid else hit.source
+            data.append(self._hit(k, score))
+        op = EKGapi.get_op_from_relation(relation)
+        o_drs = DRS(data, Operation(op, params=[hit]))
+        return o_drs
+
+    def find_path_hit(self, source, target, relation, max_hops=5, k=1):
+        """
+        Same as FieldNetwork.find_path_hit
+        """
+        source_nid = str(source.nid) if isinstance(source, Hit) else str(source)
+        target_nid = str(target.nid) if isinstance(target, Hit) else str(target)
+        if not isinstance(source, Hit):
+            source = self._hit(source_nid, 0)
+        paths = self._graph.shortest_paths(source_nid, target_nid, relation, max_hops=max_hops)[:k]
+        return EKGapi.paths_to_drs([[source] + [self._hit(j, self._graph.score(i, j, relation))
+                                                for i, j in zip(path, path[1:])] for path in paths], relation)
+
+    """
+    ANALYTICAL OPS
+    """
+
+    def topk_nodes_by_degree(self, topk):
+        """
+        :return: list of (nid, degree) of the topk nodes with most edges, of any relation, highest first
+        """
+        return heapq.nlargest(topk, ((nid, self._graph.degree(nid)) for nid in self._graph.nodes()),
+                              key=lambda x: x[1])
+
+    def enumerate_edges_of_type(self, relation):
+        """
+        :return: generator of (Hit, Hit) with each edge of relation once
+        """
+        for nid, nid2, score in self._graph.edges(relation):
+            yield self._hit(nid, 0), self._hit(nid2, score)
+
+    def relation_count(self, relation):
+        return self._graph.edge_count(relation)
+
+    """
+    UTILS
+    """
+
+    def print_edges_of_type(self, relation):
+        total_relationships = 0
+        for hit, n2 in self.enumerate_edges_of_type(relation):
+            total_relationships += 1
+            print(str(hit) + " - " + str(n2))
+        print("Total " + str(relation) + " relations: " + str(total_relationships))
+
+    def serialize(self, path):
+        """
+        Writes the EKG to path as plain lists and dicts, so it loads without this class
+        :param path: directory where the EKG is written
+        """
+        os.makedirs(path, exist_ok=True)
+        edges = dict()
+        for relation in Relation:
+            relation_edges = list(self._graph.edges(relation))
+            if len(relation_edges) > 0:
+                edges[relation.name] = relation_edges
+        model = dict(nodes=list(self._graph.nodes()),
+                     id_names=[(nid,) + self._id_names[nid] for nid in self._id_names.keys()],
+                     source_ids={source: self._source_ids[source] for source in self._source_ids.keys()},
+                     cardinality=self._cardinality,
+                     edges=edges)
+        with open(os.path.join(path, self.file_name), 'wb') as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def deserialize(path):
+        """
+        :param path: directory where the EKG was written by serialize
+        :return: the InMemoryEKG
+        """
+        with open(os.path.join(path, InMemoryEKG.file_name), 'rb') as f:
+            model = pickle.load(f)
+        ekg = InMemoryEKG()
+        ekg._id_names = FieldInfoTable.from_dicts({info[0]: info[1:] for info in model['id_names']},
+                                                  model['source_ids'])
+        ekg._source_ids = SourceIds(ekg._id_names)
+        for nid in model['nodes']:
+            ekg._graph.add_node(nid)
+        ekg._cardinality = model['cardinality']
+        for name, relation_edges in model['edges'].items():
+            for node_src, node_target, score in relation_edges:
+                ekg.add_relation(node_src, node_target, Relation[name], score)
+        return ekg
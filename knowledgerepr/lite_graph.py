@@ -1,54 +1,150 @@
+from array import array
 from bitarray import bitarray
-from enum import Enum
 from collections import defaultdict
 
-num_edge_types = 4
+from api.apiutils import Relation
 
-
-class EdgeType(Enum):
-    SCHEMA_SIM = 0
-    CONTENT_SIM = 1
-    PKFK = 2
-    SEMANTIC = 3
+# one bit per relation in the edge type of each edge
+relation_bit = {relation: i for i, relation in enumerate(Relation)}
+num_edge_types = len(relation_bit)
 
 
 class LiteGraph:
+    """
+    Graph with one dict of target -> edge per node. An edge keeps a bitarray with one bit per relation and the
+    scores of the relations it has, in bit order, as float32. Undirected edges are stored in both directions.
+    Self loops are not kept.
+    """
 
     def __init__(self):
         self._node_count = 0
         self._edge_count = 0
+        self._edge_counts = defaultdict(int)  # relation -> undirected edges
         self._node_index = dict()
 
     def add_node(self, nid):
         if nid not in self._node_index:
-            self._node_index[nid] = defaultdict(bitarray)
+            self._node_index[nid] = dict()
             self._node_count += 1
 
-    def add_edge(self, source, target, type):
+    def add_edge(self, source, target, type, score=1.0):
+        """
+        Adds or updates the score of the directed edge of relation type between source and target
+        :return: True if the edge is new
+        """
         if source == target:
-            return
-        type = type.value
+            return False
+        bit = relation_bit[type]
         self.add_node(source)
         self.add_node(target)
-        if target not in self._node_index[source]:
+        edge = self._node_index[source].get(target)
+        if edge is None:
             edge_type = bitarray(num_edge_types)
             edge_type.setall(False)
-            edge_type[type] = True
-            self._node_index[source][target] = edge_type
-            self._edge_count += 1
-        elif self._node_index[source][target][type] is False:
-            self._node_index[source][target][type] = True
+            edge_type[bit] = True
+            self._node_index[source][target] = (edge_type, array('f', [score]))
             self._edge_count += 1
+            return True
+        edge_type, scores = edge
+        rank = edge_type[:bit].count()  # position of the score of bit among the scores of the edge
+        if edge_type[bit]:
+            scores[rank] = score
+            return False
+        edge_type[bit] = True
+        scores.insert(rank, score)
+        self._edge_count += 1
+        return True
+
+    def add_undirected_edge(self, source, target, type, score=1.0):
+        if self.add_edge(source, target, type, score):
+            self._edge_counts[type] += 1
+        self.add_edge(target, source, type, score)
+
+    def has_node(self, nid):
+        return nid in self._node_index
+
+    def nodes(self):
+        return self._node_index.keys()
+
+    def edge_count(self, type):
+        """
+        :return: number of undirected edges of relation type
+        """
+        return self._edge_counts[type]
 
-    def add_undirected_edge(self, source, target, type):
-        self.add_edge(source, target, type)
-        self.add_edge(target, source, type)
+    def degree(self, nid):
+        """
+        :return: number of edges of nid, of any relation
+        """
+        return sum(edge_type.count() for edge_type, _ in self._node_index[nid].values())
 
     def neighbors(self, nid, type):
-        type = type.value
+        bit = relation_bit[type]
         n = []
         nodes = self._node_index[nid]
-        for target, edge_type in nodes.items():
-            if edge_type[type]:
+        for target, (edge_type, _) in nodes.items():
+            if edge_type[bit]:
                 n.append(target)
-        return n
\ No newline at end of file
+        return n
+
+    def neighbors_with_scores(self, nid, type):
+        """
+        :return: list of (target, score) of the neighbours of nid through relation type
+        """
+        bit = relation_bit[type]
+        n = []
+        for target, (edge_type, scores) in self._node_index[nid].items():
+            if edge_type[bit]:
+                n.append((target, scores[edge_type[:bit].count()]))
+        return n
+
+    def score(self, source, target, type):
+        edge_type, scores = self._node_index[source][target]
+        bit = relation_bit[type]
+        return scores[edge_type[:bit].count()]
+
+    def edges(self, type):
+        """
+        :return: generator of (source, target, score) with each undirected edge of relation type once
+        """
+        seen = set()
+        for source in self._node_index.keys():
+            seen.add(source)
+            for target, score in self.neighbors_with_scores(source, type):
+                if target not in seen:
+                    yield source, target, score
+
+    def shortest_paths(self, source, target, type, max_hops=5):
+        """
+        Breadth-first search of all the shortest paths between two nodes, up to max_hops edges
+        :return: list of paths, each a list of nodes from source to target
+        """
+        if source == target:
+            return [[source]]
+        pred = {source: []}
+        level = [source]
+        hops = 0
+        while len(level) > 0 and target not in pred and hops < max_hops:
+            hops += 1
+            next_level = dict()
+            for node in level:
+                for n in self.neighbors(node, type):
+                    if n in pred:
+                        continue
+                    if n not in next_level:
+                        next_level[n] = []
+                    next_level[n].append(node)
+            pred.update(next_level)
+            level = list(next_level.keys())
+        if target not in pred:
+            return []
+        paths = []
+        stack = [[target]]
+        while len(stack) > 0:
+            path = stack.pop()
+            if path[-1] == source:
+                paths.append(list(reversed(path)))
+                continue
+            for p in pred[path[-1]]:
+                stack.append(path + [p])
+        return paths
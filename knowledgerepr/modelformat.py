@@ -0,0 +1,431 @@
+"""
+Binary model format. A model directory holds an ekg/ directory with:
+ - format.json: format name and version, number of nodes, data type codes, relations and edges of each relation
+ - strings.bin and string_offsets.npy: UTF-8 string table with the nids, db, source and field names
+ - node_*.npy: one column per node attribute, strings as ids into the string table, and the degree of each node
+ - node_key.npy, node_sorted_key.npy, node_sorted_id.npy: the int64 key of each nid, and the keys sorted with their
+   node, when all nids are numerical. They are looked up without building a dict of the nids
+ - source_names.npy, source_indptr.npy, source_fields.npy: the sources sorted by name, and the nodes of each one
+ - <RELATION>_indptr.npy, <RELATION>_indices.npy, <RELATION>_scores.npy: CSR adjacency of each relation
+Every file is a plain array, so loading is reading arrays, without unpickling an object per node or edge.
+"""
+
+import argparse
+import json
+import os
+import time
+from collections.abc import Mapping
+
+import networkx as nx
+import numpy as np
+
+from api.apiutils import Relation
+from knowledgerepr import buildmetrics
+from knowledgerepr.csrnetwork import CSRAdjacency
+from knowledgerepr.csrnetwork import CSRFieldNetwork
+from knowledgerepr.csrnetwork import NidKeys
+from knowledgerepr.fieldinfo import FieldInfoTable
+from knowledgerepr.fieldnetwork import FieldNetwork
+
+FORMAT_NAME = "aurum-ekg"
+FORMAT_VERSION = 1
+MODEL_DIR = "ekg/"
+NO_STRING = -1  # db, source and field of nodes without meta schema information
+
+
+def has_model(path):
+    """
+    :return: True if path holds a model in the binary format
+    """
+    return os.path.isfile(os.path.join(path, MODEL_DIR, "format.json"))
+
+
+class StringTable:
+    """
+    Assigns an int id to each distinct string, and writes them as one UTF-8 buffer plus offsets
+    """
+
+    def __init__(self):
+        self.ids = dict()
+        self.strings = []
+
+    def id_of(self, s):
+        i = self.ids.get(s)
+        if i is None:
+            i = len(self.strings)
+            self.ids[s] = i
+            self.strings.append(s)
+        return i
+
+    def write(self, path):
+        encoded = [s.encode('utf8') for s in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        with open(path + "strings.bin", 'wb') as f:
+            f.write(b"".join(encoded))
+        np.save(path + "string_offsets.npy", offsets)
+
+
+def read_strings(path):
+    """
+    :return: list with the strings of the string table, by id
+    """
+    with open(path + "strings.bin", 'rb') as f:
+        buffer = f.read()
+    offsets = np.load(path + "string_offsets.npy").tolist()
+    return [buffer[offsets[i]:offsets[i + 1]].decode('utf8') for i in range(len(offsets) - 1)]
+
+
+class MappedStrings:
+    """
+    The string table of a model, decoded string by string on access, so it can stay memory-mapped
+    """
+
+    def __init__(self, path, mmap_mode=None):
+        self.offsets = np.load(path + "string_offsets.npy", mmap_mode=mmap_mode)
+        if mmap_mode is not None and os.path.getsize(path + "strings.bin") > 0:
+            self.buffer = np.memmap(path + "strings.bin", dtype=np.uint8, mode=mmap_mode)
+        else:
+            self.buffer = np.fromfile(path + "strings.bin", dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf8')
+
+
+class MappedFieldInfo(Mapping):
+    """
+    Read-only nid -> (db_name, source_name, field_name, data_type) over the node columns and string table of a
+    model. Nothing is decoded up front: each lookup finds the node of the nid with NidKeys, and decodes its
+    strings. It has the methods of FieldInfoTable that FieldNetwork uses, and SourceIds works over it
+    """
+
+    def __init__(self, strings, nids, columns, data_types, source_names, source_indptr, source_fields):
+        """
+        :param strings: MappedStrings
+        :param nids: NidKeys
+        :param columns: dict with the db, source, field and type columns
+        :param data_types: the data type of each type code
+        :param source_names: string ids of the sources, sorted by name
+        :param source_indptr: the nodes of source i are source_fields[source_indptr[i]:source_indptr[i + 1]]
+        :param source_fields: the nodes of each source, in node order
+        """
+        self.strings = strings
+        self.nids = nids
+        self.db = columns['db']
+        self.source = columns['source']
+        self.field = columns['field']
+        self.type = columns['type']
+        self.data_types = data_types
+        self.source_names = source_names
+        self.source_indptr = source_indptr
+        self.source_fields = source_fields
+
+    def _node(self, nid):
+        try:
+            i = self.nids.dense_id(nid)
+        except KeyError:
+            raise KeyError(nid)
+        if self.db[i] == NO_STRING:
+            raise KeyError(nid)
+        return i
+
+    def __getitem__(self, nid):
+        i = self._node(nid)
+        return (self.strings[self.db[i]], self.strings[self.source[i]], self.strings[self.field[i]],
+                self.data_types[self.type[i]])
+
+    def infos(self, nids):
+        """
+        :return: list with the info of each nid, as __getitem__, with the nodes of all of them found at once
+        """
+        nids = list(nids)
+        nodes = self.nids.dense_ids(nids)
+        infos = []
+        for nid, i in zip(nids, nodes.tolist()):
+            if self.db[i] == NO_STRING:
+                raise KeyError(nid)
+            infos.append((self.strings[self.db[i]], self.strings[self.source[i]], self.strings[self.field[i]],
+                          self.data_types[self.type[i]]))
+        return infos
+
+    def __iter__(self, block_rows=4096):
+        for start in range(0, len(self.db), block_rows):
+            nodes = np.flatnonzero(self.db[start:start + block_rows] != NO_STRING) + start
+            yield from self.nids.nids_of(nodes).tolist()
+
+    def __len__(self):
+        return int(self.source_indptr[-1])
+
+    def data_type_of(self, nid):
+        return self.data_types[self.type[self._node(nid)]]
+
+    def _source_code(self, source_name):
+        lo, hi = 0, len(self.source_names)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.strings[self.source_names[mid]] < source_name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.source_names) and self.strings[self.source_names[lo]] == source_name:
+            return lo
+        return None
+
+    def nids_of_source(self, source_name):
+        code = self._source_code(source_name)
+        if code is None:
+            return []
+        return self.nids.nids_of(self.source_fields[self.source_indptr[code]:self.source_indptr[code + 1]]).tolist()
+
+    def sources(self):
+        return [self.strings[i] for i in self.source_names]
+
+
+def write_source_index(path, strings, source_column):
+    """
+    Writes the sources sorted by name, and the nodes of each source, for MappedFieldInfo
+    :param strings: the StringTable of the model
+    :param source_column: string id of the source of each node, NO_STRING for nodes without one
+    """
+    fields = np.flatnonzero(source_column != NO_STRING)
+    codes = np.unique(source_column[fields])
+    names = sorted(codes.tolist(), key=lambda i: strings.strings[i])
+    rank = np.zeros(len(strings.strings), dtype=np.int64)
+    rank[names] = np.arange(len(names))
+    ranks = rank[source_column[fields]]
+    order = np.argsort(ranks, kind='mergesort')
+    indptr = np.searchsorted(ranks[order], np.arange(len(names) + 1)).astype(np.int64)
+    np.save(path + "source_names.npy", np.asarray(names, dtype=np.int32))
+    np.save(path + "source_indptr.npy", indptr)
+    np.save(path + "source_fields.npy", fields[order].astype(np.int32))
+
+
+def write_model(network, path):
+    """
+    Writes network in the binary format
+    :param network: a FieldNetwork or CSRFieldNetwork
+    :param path: directory of the model, the model is written to its ekg/ directory
+    """
+    path = os.path.join(path, MODEL_DIR)
+    os.makedirs(path, exist_ok=True)
+    if not isinstance(network, CSRFieldNetwork):
+        network = CSRFieldNetwork.from_field_network(network)
+    id_names = network._get_underlying_repr_id_to_field_info()
+
+    strings = StringTable()
+    data_types = []
+    num_nodes = len(network._nids)
+    columns = dict(nid=np.empty(num_nodes, dtype=np.int32),
+                   db=np.full(num_nodes, NO_STRING, dtype=np.int32),
+                   source=np.full(num_nodes, NO_STRING, dtype=np.int32),
+                   field=np.full(num_nodes, NO_STRING, dtype=np.int32),
+                   type=np.zeros(num_nodes, dtype=np.uint8))
+    for i, nid in enumerate(network._nids):
+        columns['nid'][i] = strings.id_of(nid)
+        if nid not in id_names:
+            continue
+        db_name, source_name, field_name, data_type = id_names[nid]
+        columns['db'][i] = strings.id_of(db_name)
+        columns['source'][i] = strings.id_of(source_name)
+        columns['field'][i] = strings.id_of(field_name)
+        if data_type not in data_types:
+            data_types.append(data_type)
+        columns['type'][i] = data_types.index(data_type)
+
+    strings.write(path)
+    for name, column in columns.items():
+        np.save(path + "node_" + name + ".npy", column)
+    keys = NidKeys.from_nids(network._nids)
+    if keys is not None:
+        np.save(path + "node_key.npy", keys.keys)
+        np.save(path + "node_sorted_key.npy", keys.sorted_keys)
+        np.save(path + "node_sorted_id.npy", keys.sorted_ids)
+        write_source_index(path, strings, columns['source'])
+    np.save(path + "node_cardinality.npy", network._cardinality)
+    np.save(path + "node_degree.npy", np.asarray(network._degree, dtype=np.int32))
+    for relation, adjacency in network._adjacency.items():
+        np.save(path + relation.name + "_indptr.npy", adjacency.indptr)
+        np.save(path + relation.name + "_indices.npy", adjacency.indices)
+        np.save(path + relation.name + "_scores.npy", adjacency.scores)
+
+    # written last, so a model interrupted while writing is not taken as complete
+    meta = dict(format=FORMAT_NAME, version=FORMAT_VERSION, num_nodes=num_nodes, num_strings=len(strings.strings),
+                data_types=data_types, relations=[relation.name for relation in network._adjacency.keys()],
+                edge_counts={relation.name: count for relation, count in network._edge_counts.items()})
+    with open(path + "format.json", 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def read_model(path, backend='csr', metrics=None, mmap=False):
+    """
+    Loads a model in the binary format
+    :param path: directory of the model
+    :param backend: 'csr' for a CSRFieldNetwork, 'networkx' for a FieldNetwork. The MultiGraph of a FieldNetwork
+    is built edge by edge in Python, so only the csr backend loads in the time of reading the arrays
+    :param metrics: optional BuildMetrics where the time, memory and rows of each load step are recorded
+    :param mmap: if True, the arrays of the model are memory-mapped read-only instead of read. The processes that
+    map the same model share one copy of them through the page cache, and neighbour lookups read the mapped
+    buffers directly. Only for the csr backend
+    :return: the network. With the csr backend and a model whose nids are numerical, nids and the meta schema are
+    looked up in the arrays of the model (see NidKeys and MappedFieldInfo) instead of being read into Python objects
+    """
+    if backend not in ('networkx', 'csr'):
+        raise ValueError("Unknown network backend: " + str(backend))
+    if mmap and backend != 'csr':
+        raise ValueError("Memory-mapped models need the csr backend")
+    mmap_mode = 'r' if mmap else None
+    if metrics is None:
+        metrics = buildmetrics.BuildMetrics()
+    path = os.path.join(path, MODEL_DIR)
+    st = time.time()
+    with open(path + "format.json") as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT_NAME or meta.get('version') != FORMAT_VERSION:
+        raise ValueError("Unsupported model format: " + str(meta.get('format')) + " version " +
+                         str(meta.get('version')))
+
+    # models written before the nid keys, or with other nids, are read into a list of nids and a FieldInfoTable
+    mapped = backend == 'csr' and os.path.isfile(path + "node_key.npy")
+
+    with buildmetrics.record_stage("load_strings") as record:
+        if mapped:
+            strings = MappedStrings(path, mmap_mode)
+        else:
+            strings = read_strings(path)
+        buildmetrics.add_rows_pulled(len(strings))
+    metrics.add(record)
+
+    with buildmetrics.record_stage("load_nodes") as record:
+        cardinality = np.load(path + "node_cardinality.npy", mmap_mode=mmap_mode)
+        degree = None  # models written before the degree was stored compute it from the adjacency
+        if os.path.isfile(path + "node_degree.npy"):
+            degree = np.load(path + "node_degree.npy", mmap_mode=mmap_mode)
+        if mapped:
+            nids, id_names = read_mapped_nodes(path, meta, strings, mmap_mode)
+        else:
+            nids, id_names = read_nodes(path, meta, strings)
+        buildmetrics.add_rows_pulled(len(nids))
+    metrics.add(record)
+
+    if backend == 'networkx':
+        network = read_networkx(path, meta, nids, cardinality, id_names, metrics)
+        et = time.time()
+        print("Loaded model from " + str(path) + " in " + str(et - st))
+        return network
+
+    with buildmetrics.record_stage("load_edges") as record:
+        adjacency = dict()
+        for name in meta['relations']:
+            adjacency[Relation[name]] = CSRAdjacency(np.load(path + name + "_indptr.npy", mmap_mode=mmap_mode),
+                                                     np.load(path + name + "_indices.npy", mmap_mode=mmap_mode),
+                                                     np.load(path + name + "_scores.npy", mmap_mode=mmap_mode))
+            record.edges[name] = len(adjacency[Relation[name]].indices)
+        buildmetrics.add_rows_pulled(sum(record.edges.values()))
+    metrics.add(record)
+
+    with buildmetrics.record_stage("load_network") as record:
+        edge_counts = None
+        if 'edge_counts' in meta:
+            edge_counts = {Relation[name]: count for name, count in meta['edge_counts'].items()}
+        network = CSRFieldNetwork(nids, cardinality, adjacency, id_names, edge_counts=edge_counts, degree=degree)
+    metrics.add(record)
+    et = time.time()
+    print("Loaded model from " + str(path) + " in " + str(et - st))
+    return network
+
+
+def read_nodes(path, meta, strings):
+    """
+    :param strings: the list of strings of the model
+    :return: (list with the nid of each node, FieldInfoTable)
+    """
+    columns = {name: np.load(path + "node_" + name + ".npy").tolist()
+               for name in ['nid', 'db', 'source', 'field', 'type']}
+    data_types = meta['data_types']
+    nids = [strings[i] for i in columns['nid']]
+    id_names = FieldInfoTable()
+    for nid, db, source, field, data_type in zip(nids, columns['db'], columns['source'], columns['field'],
+                                                 columns['type']):
+        if db == NO_STRING:
+            continue
+        id_names.add(nid, strings[db], strings[source], strings[field], data_types[data_type])
+    return nids, id_names
+
+
+def read_mapped_nodes(path, meta, strings, mmap_mode):
+    """
+    :param strings: the MappedStrings of the model
+    :return: (NidKeys, MappedFieldInfo) over the arrays of the model
+    """
+    def load(name):
+        return np.load(path + name + ".npy", mmap_mode=mmap_mode)
+
+    nids = NidKeys(load("node_key"), load("node_sorted_key"), load("node_sorted_id"))
+    columns = {name: load("node_" + name) for name in ['db', 'source', 'field', 'type']}
+    id_names = MappedFieldInfo(strings, nids, columns, meta['data_types'], load("source_names"),
+                               load("source_indptr"), load("source_fields"))
+    return nids, id_names
+
+
+def read_networkx(path, meta, nids, cardinality, id_names, metrics):
+    """
+    Builds the FieldNetwork of a model directly from its columns. Each relation is read, added to the MultiGraph
+    and released before the next one, so its arrays and the graph are not kept in memory at the same time
+    :param path: the ekg/ directory of the model
+    :return: the FieldNetwork
+    """
+    with buildmetrics.record_stage("load_edges") as record:
+        G = nx.MultiGraph()
+        G.add_nodes_from((nid, {'cardinality': None if np.isnan(card) else card})
+                         for nid, card in zip(nids, cardinality.tolist()))
+        for name in meta['relations']:
+            relation = Relation[name]
+            src, tgt, scores = CSRAdjacency(np.load(path + name + "_indptr.npy"),
+                                            np.load(path + name + "_indices.npy"),
+                                            np.load(path + name + "_scores.npy")).edges()
+            G.add_edges_from((nids[s], nids[t], relation, {'score': score})
+                             for s, t, score in zip(src.tolist(), tgt.tolist(), scores.tolist()))
+            record.edges[name] = len(src)
+            del src, tgt, scores
+        buildmetrics.add_rows_pulled(sum(record.edges.values()))
+    metrics.add(record)
+
+    with buildmetrics.record_stage("load_network") as record:
+        network = FieldNetwork(G, id_names)
+        if 'edge_counts' in meta:
+            network._edge_counts = {Relation[name]: count for name, count in meta['edge_counts'].items()}
+    metrics.add(record)
+    return network
+
+
+def convert_pickle_model(path, metrics=None):
+    """
+    Writes the binary format of a model serialized in the pickle format, in the same directory
+    :param path: directory of the model
+    :param metrics: optional BuildMetrics where the time and memory of the conversion are recorded
+    """
+    if metrics is None:
+        metrics = buildmetrics.BuildMetrics()
+    path = path + '/'
+    with buildmetrics.record_stage("read_pickle") as record:
+        G = nx.read_gpickle(path + "graph.pickle")
+        id_to_info = nx.read_gpickle(path + "id_info.pickle")
+        table_to_ids = nx.read_gpickle(path + "table_ids.pickle")
+    metrics.add(record)
+    with buildmetrics.record_stage("write_binary") as record:
+        write_model(FieldNetwork(G, id_to_info, table_to_ids), path)
+    metrics.add(record)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts pickle models to the binary model format")
+    parser.add_argument('--convert', help='Directory of the pickle model to convert', required=True)
+    args = parser.parse_args()
+
+    metrics = buildmetrics.BuildMetrics()
+    convert_pickle_model(args.convert, metrics=metrics)
+    read_model(args.convert, metrics=metrics)
+    metrics.print_report()
@@ -1,19 +1,24 @@
+import copy
+import os
 import time
 
 from dataanalysis import dataanalysis as da
 from math import isinf
 
-from enum import Enum
 from knowledgerepr.fieldnetwork import Relation
+from knowledgerepr import buildmetrics
 from nearpy import Engine
 from nearpy.hashes import RandomBinaryProjections, RandomBinaryProjectionTree
 from nearpy.hashes import RandomDiscretizedProjections
 from nearpy.distances import CosineDistance, EuclideanDistance, ManhattanDistance
 from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
 from datasketch import MinHash, MinHashLSH
 
 from sklearn.cluster import DBSCAN
+from sklearn.preprocessing import normalize
 import numpy as np
+import scipy.sparse
 
 from collections import defaultdict
 
@@ -22,23 +27,24 @@ rbp = RandomBinaryProjections('default', 30)
 
 def create_sim_graph_text(nid_gen, network, text_engine, tfidf, relation, tfidf_is_dense=False):
     st = time.time()
-    row_idx = 0
-    for nid in nid_gen:
-        if tfidf_is_dense:
-            dense_row = tfidf[row_idx]
-            array = dense_row
-        else:
-            sparse_row = tfidf.getrow(row_idx)
-            dense_row = sparse_row.todense()
-            array = dense_row.A[0]
-        row_idx += 1
-        N = text_engine.neighbours(array)
-        if len(N) > 1:
-            for n in N:
-                (data, key, value) = n
-                if nid != key:
-                    #print("tsim: {0} <-> {1}".format(nid, key))
-                    network.add_relation(nid, key, relation, value)
+    with buildmetrics.step("lsh_query"):
+        row_idx = 0
+        for nid in nid_gen:
+            if tfidf_is_dense:
+                dense_row = tfidf[row_idx]
+                array = dense_row
+            else:
+                sparse_row = tfidf.getrow(row_idx)
+                dense_row = sparse_row.todense()
+                array = dense_row.A[0]
+            row_idx += 1
+            N = text_engine.neighbours(array)
+            if len(N) > 1:
+                for n in N:
+                    (data, key, value) = n
+                    if nid != key:
+                        #print("tsim: {0} <-> {1}".format(nid, key))
+                        network.add_relation(nid, key, relation, value)
     et = time.time()
     print("Create graph schema: {0}".format(str(et - st)))
 
@@ -51,17 +57,18 @@ def index_in_text_engine(nid_gen, tfidf, lsh_projections, tfidf_is_dense=False):
                          distance=CosineDistance())
 
     st = time.time()
-    row_idx = 0
-    for key in nid_gen:
-        if tfidf_is_dense:
-            dense_row = tfidf[row_idx]
-            array = dense_row
-        else:
-            sparse_row = tfidf.getrow(row_idx)
-            dense_row = sparse_row.todense()
-            array = dense_row.A[0]
-        row_idx += 1
-        text_engine.store_vector(array, key)
+    with buildmetrics.step("lsh_index"):
+        row_idx = 0
+        for key in nid_gen:
+            if tfidf_is_dense:
+                dense_row = tfidf[row_idx]
+                array = dense_row
+            else:
+                sparse_row = tfidf.getrow(row_idx)
+                dense_row = sparse_row.todense()
+                array = dense_row.A[0]
+            row_idx += 1
+            text_engine.store_vector(array, key)
     et = time.time()
     print("Total index text: " + str((et - st)))
     return text_engine
@@ -76,10 +83,10 @@ def lsa_dimensionality_reduction(tfidf):
 
 class LSHRandomProjectionsIndex:
 
-    def __init__(self, num_features, projection_count=30):
+    def __init__(self, num_features, projection_count=30, rand_seed=None):
         self.num_features = num_features
         #self.rbp = RandomDiscretizedProjections('default', projection_count, bin_width=100)
-        self.rbp = RandomBinaryProjections('default', projection_count)
+        self.rbp = RandomBinaryProjections('default', projection_count, rand_seed=rand_seed)
         #self.rbp = RandomBinaryProjectionTree('default', projection_count, 1)
         self.text_engine = Engine(num_features, lshashes=[self.rbp], distance=CosineDistance())
 
@@ -94,7 +101,7 @@ class LSHRandomProjectionsIndex:
         return res
 
 
-def build_schema_sim_relation(network):
+def build_schema_sim_relation(network, rand_seed=None):
 
     def connect(nid1, nid2, score):
         network.add_relation(nid1, nid2, Relation.SCHEMA_SIM, score)
@@ -104,49 +111,276 @@ def build_schema_sim_relation(network):
     for (_, _, field_name, _) in network.iterate_values():
         docs.append(field_name)
 
-    tfidf = da.get_tfidf_docs(docs)
+    with buildmetrics.step("tfidf"):
+        tfidf = da.get_tfidf_docs(docs)
     et = time.time()
     print("Time to create docs and TF-IDF: ")
     print("Create docs and TF-IDF: {0}".format(str(et - st)))
 
     nid_gen = network.iterate_ids()
     num_features = tfidf.shape[1]
-    new_index_engine = LSHRandomProjectionsIndex(num_features)
+    new_index_engine = LSHRandomProjectionsIndex(num_features, rand_seed=rand_seed)
 
     # Index vectors in engine
     st = time.time()
-    row_idx = 0
-    for key in nid_gen:
-        sparse_row = tfidf.getrow(row_idx)
-        dense_row = sparse_row.todense()
-        array = dense_row.A[0]
-        row_idx += 1
-        new_index_engine.index(array, key)
+    with buildmetrics.step("lsh_index"):
+        row_idx = 0
+        for key in nid_gen:
+            sparse_row = tfidf.getrow(row_idx)
+            dense_row = sparse_row.todense()
+            array = dense_row.A[0]
+            row_idx += 1
+            new_index_engine.index(array, key)
     et = time.time()
     print("Total index text: " + str((et - st)))
 
     # Create schema_sim links
     nid_gen = network.iterate_ids()
     st = time.time()
-    row_idx = 0
-    for nid in nid_gen:
-
-        sparse_row = tfidf.getrow(row_idx)
-        dense_row = sparse_row.todense()
-        array = dense_row.A[0]
-        row_idx += 1
-        N = new_index_engine.query(array)
-        if len(N) > 1:
-            for n in N:
-                (data, key, value) = n
-                if nid != key:
-                    connect(nid, key, value)
+    with buildmetrics.step("lsh_query"):
+        row_idx = 0
+        for nid in nid_gen:
+
+            sparse_row = tfidf.getrow(row_idx)
+            dense_row = sparse_row.todense()
+            array = dense_row.A[0]
+            row_idx += 1
+            N = new_index_engine.query(array)
+            if len(N) > 1:
+                for n in N:
+                    (data, key, value) = n
+                    if nid != key:
+                        connect(nid, key, value)
     et = time.time()
     print("Create graph schema: {0}".format(str(et - st)))
 
     return new_index_engine
 
 
+class SparseLSHRandomProjectionsIndex:
+    """
+    Random binary projections index that works on a whole sparse matrix at once. It hashes rows in the same way
+    nearpy's RandomBinaryProjections does (one bit per hyperplane, set when the projection is > 0), but computes
+    all the bucket keys with a single matrix product and keeps rows in a sorted bucket layout instead of a dict
+    of dense vectors.
+    """
+
+    def __init__(self, num_features, projection_count=30, max_neighbours=10, rand_seed=None):
+        if projection_count > 62:
+            print("ERROR projection_count: " + str(projection_count) + " does not fit in an int64 bucket key")
+            raise Exception
+        self.num_features = num_features
+        self.projection_count = projection_count
+        self.max_neighbours = max_neighbours  # equivalent to nearpy's default NearestFilter(10)
+        rand = np.random.RandomState(rand_seed)
+        self.normals = rand.randn(projection_count, num_features)
+        self.bit_weights = np.left_shift(np.int64(1), np.arange(projection_count - 1, -1, -1, dtype=np.int64))
+        self.matrix = None
+        self.keys = None
+        self.codes = None
+        self.bucket_order = None
+        self.bucket_codes = None
+        self.bucket_bounds = None
+        self.vectorizer = None  # the fitted TF-IDF vectorizer, to add rows to the index later
+
+    def hash_matrix(self, matrix, chunk_size=100000):
+        codes = np.empty(matrix.shape[0], dtype=np.int64)
+        normals_t = self.normals.T
+        for start in range(0, matrix.shape[0], chunk_size):
+            end = start + chunk_size
+            projection = matrix[start:end].dot(normals_t)
+            codes[start:end] = (projection > 0.0).dot(self.bit_weights)
+        return codes
+
+    def index_matrix(self, matrix, keys):
+        if matrix.shape[1] != self.num_features:
+            print("ERROR received matrix.dim: " + str(matrix.shape[1]) + " on index.dim: " + str(self.num_features))
+            raise Exception
+        # rows are stored normalized, as nearpy does, so cosine similarity is a plain dot product
+        self.matrix = normalize(matrix.tocsr(), norm='l2', copy=True)
+        self.keys = list(keys)
+        self.codes = self.hash_matrix(self.matrix)
+        self.sort_buckets()
+
+    def update(self, matrix, keys, removed_keys):
+        """
+        Removes the rows of removed_keys and appends the rows of matrix. Only the new rows are hashed
+        :param matrix: rows to add, with the features of the index
+        :param keys: the key of each new row
+        :param removed_keys: keys of the rows to remove
+        """
+        if matrix.shape[1] != self.num_features:
+            print("ERROR received matrix.dim: " + str(matrix.shape[1]) + " on index.dim: " + str(self.num_features))
+            raise Exception
+        removed_keys = set(removed_keys)
+        keep = np.asarray([key not in removed_keys for key in self.keys], dtype=bool)
+        matrix = normalize(matrix.tocsr(), norm='l2', copy=True)
+        self.matrix = scipy.sparse.vstack([self.matrix[np.flatnonzero(keep)], matrix], format='csr')
+        self.keys = [key for key, k in zip(self.keys, keep) if k] + list(keys)
+        self.codes = np.r_[self.codes[keep], self.hash_matrix(matrix)]
+        self.sort_buckets()
+
+    def sort_buckets(self):
+        self.bucket_order = np.argsort(self.codes, kind='mergesort')
+        sorted_codes = self.codes[self.bucket_order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        self.bucket_codes = sorted_codes[starts]
+        self.bucket_bounds = np.r_[starts, len(sorted_codes)]
+
+    def buckets(self):
+        """
+        Yields the row positions of every bucket with at least two members
+        """
+        for idx in range(len(self.bucket_codes)):
+            start, end = self.bucket_bounds[idx], self.bucket_bounds[idx + 1]
+            if end - start > 1:
+                yield self.bucket_order[start:end]
+
+    def bucket_of(self, code):
+        idx = np.searchsorted(self.bucket_codes, code)
+        if idx == len(self.bucket_codes) or self.bucket_codes[idx] != code:
+            return self.bucket_order[0:0]
+        return self.bucket_order[self.bucket_bounds[idx]:self.bucket_bounds[idx + 1]]
+
+    def nearest_in_bucket(self, rows, members, block_size=2 ** 22):
+        """
+        For each row in rows, finds the max_neighbours members with the smallest cosine distance
+        :param rows: row positions to query
+        :param members: row positions of the bucket the rows fall in
+        :param block_size: max number of similarity values materialized at once
+        :return: generator of (row, [member], [distance])
+        """
+        members_t = self.matrix[members].T.tocsc()
+        k = min(self.max_neighbours, len(members))
+        block_rows = max(1, block_size // len(members))
+        for start in range(0, len(rows), block_rows):
+            block = rows[start:start + block_rows]
+            sims = self.matrix[block].dot(members_t).toarray()
+            if k < len(members):
+                top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(len(members)), (len(block), 1))
+            top_sims = sims[np.arange(len(block))[:, None], top]
+            for i in range(len(block)):
+                order = np.lexsort((top[i], -top_sims[i]))
+                yield block[i], members[top[i][order]], 1.0 - top_sims[i][order]
+
+    def query(self, vector):
+        """
+        Same output as LSHRandomProjectionsIndex.query: a list of (vector, key, distance)
+        """
+        vector = np.asarray(vector, dtype=float).reshape(1, -1)
+        norm = np.linalg.norm(vector)
+        if norm > 0.0:
+            vector = vector / norm
+        code = (vector.dot(self.normals.T) > 0.0).dot(self.bit_weights)[0]
+        members = self.bucket_of(code)
+        if len(members) == 0:
+            return []
+        sims = self.matrix[members].dot(vector[0])
+        order = np.lexsort((np.arange(len(members)), -sims))[:self.max_neighbours]
+        return [(self.matrix[members[i]], self.keys[members[i]], 1.0 - sims[i]) for i in order]
+
+
+def build_schema_sim_relation_sparse(network, projection_count=30, max_neighbours=10, rand_seed=None):
+    """
+    Same SCHEMA_SIM relation as build_schema_sim_relation, but the TF-IDF matrix stays sparse: all rows are
+    hashed with one matrix product and candidates are only scored against rows in the same bucket, in blocks.
+    :param network: the FieldNetwork, initialized with init_meta_schema
+    :param projection_count: number of random hyperplanes, i.e., bits of the bucket key
+    :param max_neighbours: max number of neighbours considered per field, including the field itself
+    :param rand_seed: seed of the random hyperplanes, the same seed gives the same hyperplanes as
+    build_schema_sim_relation
+    :return: the SparseLSHRandomProjectionsIndex
+    """
+
+    def connect(nid1, nid2, score):
+        network.add_relation(nid1, nid2, Relation.SCHEMA_SIM, score)
+
+    st = time.time()
+    docs = []
+    for (_, _, field_name, _) in network.iterate_values():
+        docs.append(field_name)
+
+    with buildmetrics.step("tfidf"):
+        tfidf = da.get_tfidf_docs(docs)
+    et = time.time()
+    print("Create docs and TF-IDF: {0}".format(str(et - st)))
+
+    # Index matrix
+    st = time.time()
+    with buildmetrics.step("lsh_index"):
+        nids = [nid for nid in network.iterate_ids()]
+        index = SparseLSHRandomProjectionsIndex(tfidf.shape[1],
+                                                projection_count=projection_count,
+                                                max_neighbours=max_neighbours,
+                                                rand_seed=rand_seed)
+        index.index_matrix(tfidf, nids)
+        index.vectorizer = copy.deepcopy(da.vect)
+    et = time.time()
+    print("Total index text: " + str((et - st)))
+
+    # Create schema_sim links, bucket by bucket
+    st = time.time()
+    with buildmetrics.step("lsh_query"):
+        for members in index.buckets():
+            for row, neighbours, distances in index.nearest_in_bucket(members, members):
+                nid = nids[row]
+                for n_row, distance in zip(neighbours, distances):
+                    if n_row != row:
+                        connect(nid, nids[n_row], distance)
+    et = time.time()
+    print("Create graph schema: {0}".format(str(et - st)))
+
+    return index
+
+
+def update_schema_sim_relation_sparse(network, index, nids, removed_nids):
+    """
+    Updates a model built with build_schema_sim_relation_sparse: removes removed_nids from the index, adds nids,
+    which must already be in the network, and connects them with SCHEMA_SIM. Only buckets that contain one of
+    the new fields are scored, and only pairs that include one of them are connected.
+    :param network: the FieldNetwork
+    :param index: the SparseLSHRandomProjectionsIndex of the model
+    :param nids: new fields
+    :param removed_nids: fields removed from the model
+    :return: the updated index
+    """
+
+    def connect(nid1, nid2, score):
+        network.add_relation(nid1, nid2, Relation.SCHEMA_SIM, score)
+
+    if index.vectorizer is None:
+        print("ERROR the schema_sim index has no vectorizer, the model must be built from scratch")
+        raise Exception
+
+    st = time.time()
+    nids = list(nids)
+    docs = [field_name for (_, _, _, field_name) in network.get_info_for(nids)]
+    tfidf = index.vectorizer.transform(docs)
+    index.update(tfidf, nids, removed_nids)
+    et = time.time()
+    print("Update index text: " + str((et - st)))
+
+    st = time.time()
+    new_rows = np.arange(len(index.keys) - len(nids), len(index.keys))
+    is_new = np.zeros(len(index.keys), dtype=bool)
+    is_new[new_rows] = True
+    for code in np.unique(index.codes[new_rows]):
+        members = index.bucket_of(code)
+        if len(members) < 2:
+            continue
+        for row, neighbours, distances in index.nearest_in_bucket(members, members):
+            nid = index.keys[row]
+            for n_row, distance in zip(neighbours, distances):
+                if n_row != row and (is_new[row] or is_new[n_row]):
+                    connect(nid, index.keys[n_row], distance)
+    et = time.time()
+    print("Update graph schema: {0}".format(str(et - st)))
+
+    return index
+
+
 def build_schema_sim_relation_lsa(network, fields):
     docs = []
     for (nid, sn, fn, _, _) in fields:
@@ -179,6 +413,108 @@ def build_entity_sim_relation(network, fields, entities):
                               tfidf, Relation.ENTITY_SIM)
 
 
+def blocks_by_nnz(row_nnz, max_nnz):
+    """
+    Splits rows into consecutive blocks whose estimated nnz add up to at most max_nnz, a row more than max_nnz
+    is a block by itself
+    :param row_nnz: estimated nnz of each row
+    :return: generator of (start, end)
+    """
+    budget = np.cumsum(row_nnz)
+    start = 0
+    while start < len(row_nnz):
+        offset = budget[start - 1] if start > 0 else 0
+        end = max(start + 1, int(np.searchsorted(budget, offset + max_nnz, side='right')))
+        yield start, end
+        start = end
+
+
+def top_k_by_value(cols, values, k):
+    """
+    :return: positions of the k highest values, highest first and ties by col, sorting only the candidates
+    """
+    if len(values) > k:
+        kth = values[np.argpartition(-values, k - 1)[k - 1]]
+        candidates = np.flatnonzero(values >= kth)  # all the ties of the k-th value, so ties are broken by col
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.lexsort((cols[candidates], -values[candidates]))][:k]
+
+
+def build_entity_sim_relation_sparse(network, fields, entities, topk=10, max_nnz=2 ** 24):
+    """
+    ENTITY_SIM relation from the entities of each field, without densifying TF-IDF rows. Rows are l2-normalized,
+    so the cosine similarity of a block of rows with all the others is a sparse product of the block with the
+    transposed matrix. Each field is connected to the topk fields with the highest similarity (> 0), with the
+    cosine distance as score, as the schema_sim relation does.
+    :param network: the FieldNetwork
+    :param fields: list of (nid, source_name, field_name), as returned by get_all_fields_entities
+    :param entities: the entities of each field, as returned by get_all_fields_entities
+    :param topk: max number of neighbours per field
+    :param max_nnz: max similarity values materialized at once. Entities share common tokens, so a product row
+    may have as many values as there are fields, blocks are sized by an upper bound of the nnz of their rows
+    """
+
+    def connect(nid1, nid2, score):
+        network.add_relation(nid1, nid2, Relation.ENTITY_SIM, score)
+
+    # Append only fields with non-empty documents
+    nids = []
+    docs = []
+    for (nid, _, _), e in zip(fields, entities):
+        if e is not None and e != "":
+            nids.append(nid)
+            docs.append(e)
+    if len(docs) == 0:  # no entity similarity will be found
+        return
+
+    st = time.time()
+    with buildmetrics.step("tfidf"):
+        # not the shared vectorizer of dataanalysis, which holds the vocabulary of the schema_sim index
+        vect = TfidfVectorizer(min_df=1, sublinear_tf=True, use_idf=True)
+        tfidf = normalize(vect.fit_transform(docs).tocsr(), norm='l2', copy=False)
+    et = time.time()
+    print("Create entity docs and TF-IDF: {0}".format(str(et - st)))
+
+    st = time.time()
+    total = 0
+    with buildmetrics.step("entity_topk"):
+        tfidf_t = tfidf.T.tocsc()
+        # a row has at most as many similarities as the fields sharing any of its tokens
+        token_df = np.diff(tfidf_t.indptr)
+        row_nnz = np.minimum(np.add.reduceat(np.append(token_df[tfidf.indices], 0), tfidf.indptr[:-1]) *
+                             (np.diff(tfidf.indptr) > 0), tfidf.shape[0])
+        for start, end in blocks_by_nnz(row_nnz, max_nnz):
+            sims = tfidf[start:end].dot(tfidf_t).tocsr()
+            for i in range(sims.shape[0]):
+                row = start + i
+                lo, hi = sims.indptr[i], sims.indptr[i + 1]
+                cols = sims.indices[lo:hi]
+                values = sims.data[lo:hi]
+                keep = (cols != row) & (values > 0.0)
+                cols, values = cols[keep], values[keep]
+                # highest similarity first, ties by position so the result does not depend on the block size
+                for idx in top_k_by_value(cols, values, topk):
+                    connect(nids[row], nids[cols[idx]], 1.0 - float(values[idx]))
+                    total += 1
+    et = time.time()
+    print("Total entity-sim: {0} in {1}".format(str(total), str(et - st)))
+
+
+def update_entity_sim_relation_sparse(network, fields, entities, topk=10, max_nnz=2 ** 24):
+    """
+    Updates the ENTITY_SIM relation of a model after fields were added, changed or removed. The IDF of the entity
+    tokens and the topk neighbours of any field may change with a single new field, so the relation is removed
+    and built again with build_entity_sim_relation_sparse, which only needs the entities and no index.
+    :param network: the FieldNetwork, with the added fields already in it
+    :param fields: list of (nid, source_name, field_name) of all the fields, as returned by get_all_fields_entities
+    :param entities: the entities of each field, as returned by get_all_fields_entities
+    """
+    removed = network.remove_relation(Relation.ENTITY_SIM)
+    print("Removed entity-sim: {0}".format(str(removed)))
+    build_entity_sim_relation_sparse(network, fields, entities, topk=topk, max_nnz=max_nnz)
+
+
 def build_content_sim_relation_text_lsa(network, signatures):
 
     def get_nid_gen(signatures):
@@ -237,102 +573,528 @@ def build_content_sim_mh_text(network, mh_signatures):
     content_index = MinHashLSH(threshold=0.7, num_perm=512)
 
     # Create minhash objects and index
-    for nid, mh_sig in mh_signatures:
-        mh_obj = MinHash(num_perm=512)
-        mh_array = np.asarray(mh_sig, dtype=int)
-        mh_obj.hashvalues = mh_array
-        content_index.insert(nid, mh_obj)
-        mh_sig_obj.append((nid, mh_obj))
+    with buildmetrics.step("minhash_index"):
+        for nid, mh_sig in mh_signatures:
+            mh_obj = MinHash(num_perm=512)
+            mh_array = np.asarray(mh_sig, dtype=int)
+            mh_obj.hashvalues = mh_array
+            content_index.insert(nid, mh_obj)
+            mh_sig_obj.append((nid, mh_obj))
 
     # Query objects
-    for nid, mh_obj in mh_sig_obj:
-        res = content_index.query(mh_obj)
-        for r_nid in res:
+    with buildmetrics.step("minhash_query"):
+        for nid, mh_obj in mh_sig_obj:
+            res = content_index.query(mh_obj)
+            for r_nid in res:
+                if r_nid != nid:
+                    connect(nid, r_nid, 1)
+
+    return content_index
+
+
+class MatrixMinHashLSH:
+    """
+    MinHash LSH index over a contiguous (num_signatures x num_perm) uint64 matrix. It uses the same bands as
+    datasketch's MinHashLSH for the given threshold and num_perm, so two signatures are candidates iff all the
+    hash values of one of the bands are equal, but it hashes each band of all the rows at once and groups rows
+    by sorting the band hashes instead of keeping one MinHash object per signature. query() takes a MinHash, as
+    MinHashLSH.query does, so the index can be serialized with the model in its place.
+
+    The signatures may be a memory-mapped array. If a directory is given, the per band arrays are written there
+    and memory-mapped as well, and pickling the index only stores the directory, so it must stay next to the
+    serialized index.
+    """
+
+    # FNV-1a 64 bit parameters, used to fold each band into a single uint64
+    fnv_offset = np.uint64(14695981039346656037)
+    fnv_prime = np.uint64(1099511628211)
+
+    def __init__(self, threshold=0.7, num_perm=512, directory=None, chunk_rows=2 ** 20):
+        """
+        :param directory: if given, where the per band arrays are written
+        :param chunk_rows: max number of rows of a band materialized at once
+        """
+        lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.b = lsh.b
+        self.r = lsh.r
+        self.hashranges = [(i * self.r, (i + 1) * self.r) for i in range(self.b)]
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.signatures = None
+        self.keys = None
+        self.band_hashes = []  # per band, band hashes in sorted order
+        self.band_orders = []  # per band, rows in the order of band_hashes
+        self.band_bounds = []  # per band, start of each group of rows with identical band, plus the end
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.directory is not None:
+            for name in ['signatures', 'band_hashes', 'band_orders', 'band_bounds']:
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if getattr(self, 'directory', None) is not None:
+            self._load_arrays()
+        elif not hasattr(self, 'chunk_rows'):
+            self.chunk_rows = 2 ** 20
+
+    def _array_path(self, name):
+        return os.path.join(self.directory, name + ".npy")
+
+    def _store_array(self, name, array):
+        """
+        Writes array to the index directory and returns it memory-mapped, if the index has one
+        """
+        if self.directory is None:
+            return array
+        np.save(self._array_path(name), array)
+        return np.load(self._array_path(name), mmap_mode='r')
+
+    def _load_arrays(self):
+        self.signatures = np.memmap(self.signatures_path(), dtype=np.uint64, mode='r').reshape(-1, self.num_perm)
+        self.band_hashes = [np.load(self._array_path("band_hashes_" + str(i)), mmap_mode='r')
+                            for i in range(self.b)]
+        self.band_orders = [np.load(self._array_path("band_orders_" + str(i)), mmap_mode='r')
+                            for i in range(self.b)]
+        self.band_bounds = [np.load(self._array_path("band_bounds_" + str(i)), mmap_mode='r')
+                            for i in range(self.b)]
+
+    def signatures_path(self):
+        """
+        :return: where the signatures of an index with a directory are expected, as raw uint64 values
+        """
+        return os.path.join(self.directory, "signatures.u64")
+
+    def hash_band(self, band):
+        h = np.full(band.shape[0], self.fnv_offset, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            for c in range(band.shape[1]):
+                h ^= band[:, c]
+                h *= self.fnv_prime
+        return h
+
+    def _hash_band_chunked(self, start, end):
+        n = self.signatures.shape[0]
+        h = np.empty(n, dtype=np.uint64)
+        for row in range(0, n, self.chunk_rows):
+            h[row:row + self.chunk_rows] = self.hash_band(self.signatures[row:row + self.chunk_rows, start:end])
+        return h
+
+    def _has_collisions(self, start, end, order, heads, group_of):
+        for pos in range(0, len(order), self.chunk_rows):
+            rows = order[pos:pos + self.chunk_rows]
+            head_rows = order[heads[group_of[pos:pos + self.chunk_rows]]]
+            if np.any(self.signatures[rows, start:end] != self.signatures[head_rows, start:end]):
+                return True
+        return False
+
+    def index_matrix(self, signatures, keys):
+        """
+        :param signatures: (num_signatures x num_perm) uint64 matrix
+        :param keys: the key of each row
+        """
+        if signatures.shape[1] != self.num_perm:
+            raise ValueError("Expecting signatures with " + str(self.num_perm) + " permutations")
+        if len(set(keys)) != len(keys):
+            raise ValueError("The given keys are not unique")
+        self.signatures = signatures
+        self.keys = keys
+        self.band_hashes = []
+        self.band_orders = []
+        self.band_bounds = []
+        for i, (start, end) in enumerate(self.hashranges):
+            h = self._hash_band_chunked(start, end)
+            order = np.argsort(h, kind='mergesort')
+            sorted_h = h[order]
+            new_group = np.empty(len(order), dtype=bool)
+            new_group[:1] = True
+            new_group[1:] = sorted_h[1:] != sorted_h[:-1]
+            heads = np.flatnonzero(new_group)
+            group_of = np.cumsum(new_group) - 1
+            if self._has_collisions(start, end, order, heads, group_of):
+                # Band hash collision: order by hash and then by the band values, so groups are exact
+                band = np.asarray(signatures[:, start:end])
+                order = np.lexsort(tuple(band[:, c] for c in range(band.shape[1] - 1, -1, -1)) + (h,))
+                sorted_h = h[order]
+                sorted_band = band[order]
+                new_group[1:] = (sorted_h[1:] != sorted_h[:-1]) | np.any(sorted_band[1:] != sorted_band[:-1], axis=1)
+                heads = np.flatnonzero(new_group)
+            del h, group_of
+            self.band_hashes.append(self._store_array("band_hashes_" + str(i), sorted_h))
+            self.band_orders.append(self._store_array("band_orders_" + str(i), order))
+            self.band_bounds.append(self._store_array("band_bounds_" + str(i), np.append(heads, len(order))))
+
+    def update(self, signatures, keys, removed_keys):
+        """
+        Removes the rows of removed_keys, appends signatures and re-indexes all bands
+        :param signatures: (num_signatures x num_perm) uint64 matrix of the rows to add
+        :param keys: the key of each new row
+        :param removed_keys: keys of the rows to remove
+        """
+        if self.directory is not None:
+            print("ERROR an index with a directory can not be updated, the model must be built from scratch")
+            raise Exception
+        removed_keys = set(removed_keys)
+        keep = np.flatnonzero([key not in removed_keys for key in self.keys])
+        all_signatures = np.concatenate([self.signatures[keep], signatures.reshape(-1, self.num_perm)])
+        all_keys = [self.keys[row] for row in keep] + list(keys)
+        self.index_matrix(all_signatures, all_keys)
+
+    def iter_candidate_pairs(self, chunk_size=2 ** 22):
+        """
+        Yields chunks of candidate pairs, band by band. A pair is only yielded once per band, but it may be
+        yielded by more than one band
+        :return: generator of (rows, rows) arrays, lowest row first
+        """
+        n = len(self.keys)
+        for order, bounds in zip(self.band_orders, self.band_bounds):
+            # every position in a group is paired with the positions after it in the same group
+            group_end = np.repeat(bounds[1:], np.diff(bounds))
+            counts = group_end - np.arange(n) - 1
+            cum_counts = np.cumsum(counts)
+            start = 0
+            while start < n:
+                done = cum_counts[start - 1] if start > 0 else 0
+                end = max(start + 1, int(np.searchsorted(cum_counts, done + chunk_size, side='right')))
+                c = counts[start:end]
+                if c.sum() > 0:
+                    pos_a = np.repeat(np.arange(start, end), c)
+                    first = np.repeat(np.cumsum(c) - c, c)
+                    pos_b = pos_a + 1 + (np.arange(len(pos_a)) - first)
+                    a = order[pos_a]
+                    b = order[pos_b]
+                    yield np.minimum(a, b), np.maximum(a, b)
+                start = end
+
+    def candidate_pairs(self, chunk_size=2 ** 22):
+        """
+        :return: array of unique (row, row) candidate pairs, lowest row first, encoded as row_a * n + row_b
+        """
+        n = len(self.keys)
+        pairs = np.empty(0, dtype=np.int64)
+        pending = []
+        pending_size = 0
+        for a, b in self.iter_candidate_pairs(chunk_size=chunk_size):
+            pending.append(a.astype(np.int64) * n + b)
+            pending_size += len(a)
+            if pending_size >= chunk_size:
+                pairs = np.union1d(pairs, np.concatenate(pending))
+                pending = []
+                pending_size = 0
+        if len(pending) > 0:
+            pairs = np.union1d(pairs, np.concatenate(pending))
+        return pairs
+
+    def query(self, minhash):
+        """
+        :param minhash: a MinHash, or an array with its hash values
+        :return: list of keys that share at least one band with minhash
+        """
+        hashvalues = getattr(minhash, 'hashvalues', minhash)
+        hashvalues = np.asarray(hashvalues).astype(np.uint64)
+        if len(hashvalues) != self.num_perm:
+            raise ValueError("Expecting minhash with " + str(self.num_perm) + " permutations")
+        rows = set()
+        for (start, end), sorted_h, order in zip(self.hashranges, self.band_hashes, self.band_orders):
+            band = hashvalues[start:end].reshape(1, -1)
+            h = self.hash_band(band)[0]
+            left = np.searchsorted(sorted_h, h, side='left')
+            right = np.searchsorted(sorted_h, h, side='right')
+            candidates = np.sort(order[left:right])
+            equal = np.all(self.signatures[candidates, start:end] == band, axis=1)
+            rows.update(candidates[equal].tolist())
+        return [self.keys[row] for row in rows]
+
+
+def build_content_sim_mh_text_matrix(network, mh_signatures, threshold=0.7, num_perm=512):
+    """
+    Same CONTENT_SIM relation as build_content_sim_mh_text, but signatures are kept in a single uint64 matrix
+    and candidate pairs are found with MatrixMinHashLSH instead of one MinHash object and query per field
+    :param network: the FieldNetwork
+    :param mh_signatures: list of (nid, minhash hash values), as returned by the store
+    :return: the MatrixMinHashLSH
+    """
+
+    def connect(nid1, nid2, score):
+        network.add_relation(nid1, nid2, Relation.CONTENT_SIM, score)
+
+    st = time.time()
+    with buildmetrics.step("minhash_index"):
+        nids = []
+        signatures = np.empty((len(mh_signatures), num_perm), dtype=np.uint64)
+        for row, (nid, mh_sig) in enumerate(mh_signatures):
+            nids.append(nid)
+            signatures[row] = mh_sig
+        content_index = MatrixMinHashLSH(threshold=threshold, num_perm=num_perm)
+        content_index.index_matrix(signatures, nids)
+    et = time.time()
+    print("Total index minhash: " + str((et - st)))
+
+    st = time.time()
+    with buildmetrics.step("minhash_query"):
+        pairs = content_index.candidate_pairs()
+    n = len(nids)
+    for a, b in zip((pairs // n).tolist(), (pairs % n).tolist()):
+        connect(nids[a], nids[b], 1)
+    et = time.time()
+    print("Total text content-sim: {0} in {1}".format(str(len(pairs)), str(et - st)))
+
+    return content_index
+
+
+def build_content_sim_mh_text_streamed(network, content_index, signatures, nids, chunk_size=2 ** 22):
+    """
+    Same CONTENT_SIM relation as build_content_sim_mh_text_matrix for signatures that may not fit in memory:
+    candidate pairs are sent to the network in chunks, band by band, without deduplicating them first, so this
+    is meant for a network that buffers relations on disk (see outofcore.SpillingEdgeCollector)
+    :param network: the FieldNetwork, or a collector of its relations
+    :param content_index: an empty MatrixMinHashLSH, usually with a directory
+    :param signatures: (len(nids) x num_perm) uint64 matrix, usually memory-mapped
+    :param nids: the nid of each row of signatures
+    :param chunk_size: max number of candidate pairs materialized at once
+    :return: the MatrixMinHashLSH
+    """
+    st = time.time()
+    with buildmetrics.step("minhash_index"):
+        content_index.index_matrix(signatures, nids)
+    et = time.time()
+    print("Total index minhash: " + str((et - st)))
+
+    st = time.time()
+    total = 0
+    with buildmetrics.step("minhash_query"):
+        for a, b in content_index.iter_candidate_pairs(chunk_size=chunk_size):
+            network.add_relations([nids[i] for i in a.tolist()], [nids[i] for i in b.tolist()],
+                                  Relation.CONTENT_SIM, [1] * len(a))
+            total += len(a)
+    et = time.time()
+    print("Total text content-sim candidates: {0} in {1}".format(str(total), str(et - st)))
+
+    return content_index
+
+
+def update_content_sim_mh_text_matrix(network, index, mh_signatures, removed_nids):
+    """
+    Updates a model built with build_content_sim_mh_text_matrix: removes removed_nids from the index, adds
+    mh_signatures and connects the new fields with CONTENT_SIM to every field they share a band with
+    :param network: the FieldNetwork
+    :param index: the MatrixMinHashLSH of the model
+    :param mh_signatures: list of (nid, minhash hash values) of the new fields
+    :param removed_nids: fields removed from the model
+    :return: the updated index
+    """
+
+    def connect(nid1, nid2, score):
+        network.add_relation(nid1, nid2, Relation.CONTENT_SIM, score)
+
+    st = time.time()
+    nids = []
+    signatures = np.empty((len(mh_signatures), index.num_perm), dtype=np.uint64)
+    for row, (nid, mh_sig) in enumerate(mh_signatures):
+        nids.append(nid)
+        signatures[row] = mh_sig
+    index.update(signatures, nids, removed_nids)
+    et = time.time()
+    print("Update index minhash: " + str((et - st)))
+
+    st = time.time()
+    total = 0
+    for nid, signature in zip(nids, signatures):
+        for r_nid in index.query(signature):
             if r_nid != nid:
                 connect(nid, r_nid, 1)
+                total += 1
+    et = time.time()
+    print("Total text content-sim: {0} in {1}".format(str(total), str(et - st)))
 
-    return content_index
+    return index
 
 
-def build_content_sim_relation_num_overlap_distr_indexed(network, id_sig):
+def connect_single_point_clusters(network, single_points, score, nids=None):
+    """
+    Clusters fields whose (median - iqr, median + iqr) interval is a single point, and connects all fields
+    within the same cluster with CONTENT_SIM
+    :param single_points: list of (nid, domain, x_min, x_left, x_right, x_max)
+    :param score: the score given to the new relations
+    :param nids: if given, only pairs that include one of these fields are connected
+    """
+    fields = []
+    medians = []
 
-    def compute_overlap(value1, value2):
-        ov = 0
-        if value1 == value2:
-            ov = 1
-        if value1 > value2:
-            if value1 > 0:
-                ov = value2 / value1
-        else:
-            if value2 > 0:
-                ov = value1 / value2
-        return ov
+    for (nid, domain, x_min, x_left, x_right, x_max) in single_points:
+        median = x_right - float(x_right / 2)
+        fields.append(nid)
+        medians.append(median)
 
-    def check_overlap_maybe_connect(overlap):
+    x_median = np.asarray(medians)
+    x_median = x_median.reshape(-1, 1)
+
+    # At this point, we may have not found any points at all, in which case we can
+    # safely exit
+    if len(x_median) == 0:
         return
 
-    class Event(Enum):
-        OPEN = 0
-        CLOSE = 1
-        FINISHED = 2
+    db_median = DBSCAN(eps=0.1, min_samples=2).fit(x_median)
+    labels_median = db_median.labels_
+    n_clusters = len(set(labels_median)) - (1 if -1 in labels_median else 0)
+    #print("#clusters: " + str(n_clusters))
+
+    clusters_median = defaultdict(list)
+    for i in range(len(labels_median)):
+        clusters_median[labels_median[i]].append(i)
+
+    for k, v in clusters_median.items():
+        if k == -1:
+            continue
+        #print("Cluster: " + str(k))
+        for el in v:
+            nid = fields[el]
+            info = network.get_info_for([nid])
+            (nid, db_name, source_name, field_name) = info[0]
+            #print(source_name + " - " + field_name + " median: " + str(medians[el]))
+            for el2 in v:
+                if el != el2:
+                    nid1 = fields[el]
+                    nid2 = fields[el2]
+                    if nids is not None and nid1 not in nids and nid2 not in nids:
+                        continue
+                    network.add_relation(nid1, nid2, Relation.CONTENT_SIM, score)
+
+
+def build_content_sim_relation_num_overlap_distr_indexed(network, id_sig, chunk_size=2 ** 20, nids=None):
+    """
+    Same CONTENT_SIM and INCLUSION_DEPENDENCY relations as build_content_sim_relation_num_overlap_distr, without
+    comparing every pair of numerical fields. Both relations require the (median - iqr, median + iqr) intervals of
+    the two fields to overlap, so intervals are sorted by their left end and each one is only compared with the
+    intervals that start before it ends (sweep line). The checks run vectorized over chunks of candidate pairs.
+    :param network: the FieldNetwork
+    :param id_sig: list of (nid, (median, iqr, min, max)), as returned by the store
+    :param chunk_size: max number of candidate pairs materialized at once
+    :param nids: if given, only pairs that include one of these fields are compared and connected, which is
+    used to update a model with new fields
+    """
+
+    overlap = 0.85
+    ind_dep_overlap = 0.3
+
+    def compute_overlap(ref, cand):
+        ref_left, ref_right = x_left[ref], x_right[ref]
+        left, right = x_left[cand], x_right[cand]
+        ref_domain = ref_right - ref_left
+        contained = (left >= ref_left) & (right <= ref_right)
+        left_in = ~contained & (left >= ref_left) & (left <= ref_right)
+        right_in = ~contained & ~left_in & (right <= ref_right) & (right >= ref_left)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ov = np.where(contained, (right - left) / ref_domain,
+                          np.where(left_in, (ref_right - left) / ref_domain,
+                                   np.where(right_in, (right - ref_left) / ref_domain, 0.0)))
+        return ov
 
-    overlap = 0.7
+    def check_pairs(ref, cand):
+        """
+        Mirrors the checks of the nested loop for ref -> cand, returns masks for both relations and the overlap
+        """
+        valid = non_zero_domain[ref]
+        # candidates without a float domain go through the inclusion dependency check, which skips infinite values
+        check_ind_dep = ~float_domain[cand]
+        skip = check_ind_dep & (inf_extremes[ref] | inf_extremes[cand])
+        valid &= ~skip
+        ov = compute_overlap(ref, cand)
+        ind_dep = valid & check_ind_dep & (x_min[cand] >= x_min[ref]) & (x_max[cand] <= x_max[ref]) & \
+            (x_min[cand] >= 0) & (ov >= ind_dep_overlap)
+        content_sim = valid & (ov >= overlap)
+        return ind_dep, content_sim, ov
 
     # Materialize data
-    nids = []
-    # events are one of (value, open_event) or (value, close_event)
-    events = []
+    fields = []
+    domains = []
+    stats = []
+    float_domain = []
     for c_k, (c_median, c_iqr, c_min_v, c_max_v) in id_sig:
-        nids.append(c_k)
-        open_event_value = c_median - c_iqr
-        events.append((open_event_value, Event.OPEN))
-        nids.append(c_k)
-        close_event_value = c_median + c_iqr
-        events.append((close_event_value, Event.CLOSE))
-
-    # Sort data
-    sorted_data = sorted(zip(events, nids), key=lambda x: x[0][0])
-    events = [x for x, y in sorted_data]
-    nids = [y for x, y in sorted_data]
-    active_set = dict()
-    start_events = dict()
-
-    # Iterate data
-    for idx in range(len(events)):
-        event_value, event_type = events[idx]
-        current_nid = nids[idx]
-        # Open or Close event?
-        if event_type == Event.OPEN:
-            for active_element_nid, active_element_values in active_set.items():
-                active_element_values[current_nid] = (event_value, event_type)
-            active_set[current_nid] = dict()
-            start_events[current_nid] = event_value
-        elif event_type == Event.CLOSE:
-            for key in list(active_set.keys()):
-                active_element_nid = key
-                active_element_values = active_set[active_element_nid]
-                if current_nid != active_element_nid:
-                    if current_nid in active_element_values.keys():
-                        open_event_value = active_element_values[current_nid][0]  # 1 is event_type
-                        overlap = event_value - open_event_value
-                        active_element_values[current_nid] = (overlap, Event.FINISHED)
-                elif current_nid == active_element_nid:
-                    for key in list(active_element_values.keys()):
-                        ae_nid = key
-                        ae_event = active_element_values[ae_nid]
-                        ae_value, ae_type = ae_event
-                        if ae_type == Event.FINISHED:
-                            closing_event_start_time = start_events[current_nid]
-                            overlap = compute_overlap(closing_event_start_time, ae_value)
-                            check_overlap_maybe_connect(overlap)
-                        elif ae_type == Event.OPEN:
-                            overlap = compute_overlap(event_value, ae_value)
-                            # store value in the active element
-                            active_set[active_element_nid][ae_nid] = (overlap, Event.FINISHED)
-                        # remove entry from values
-                        #del active_element_values[current_nid]
-                    # remove entry from active set
-                    del active_set[current_nid]
+        fields.append(c_k)
+        domain = (c_median + c_iqr) - (c_median - c_iqr)
+        domains.append(domain)
+        float_domain.append(isinstance(domain, float))
+        stats.append((c_min_v, c_median - c_iqr, c_median + c_iqr, c_max_v))
+
+    if len(fields) == 0:
+        return
+
+    x_domain = np.asarray(domains, dtype=float)
+    x_min, x_left, x_right, x_max = [np.asarray(x, dtype=float) for x in zip(*stats)]
+    float_domain = np.asarray(float_domain, dtype=bool)
+    non_zero_domain = x_domain != 0
+    inf_extremes = np.isinf(x_min) | np.isinf(x_max)
+
+    # The nested loop visits refs by decreasing domain, and the last visit of a pair sets the score of the edge
+    visit_order = sorted(range(len(fields)), key=lambda i: (domains[i], fields[i], stats[i]), reverse=True)
+    visit_rank = np.empty(len(fields), dtype=np.int64)
+    visit_rank[visit_order] = np.arange(len(fields))
+
+    # Sweep line: a pair of intervals overlaps iff the one starting later starts before the other one ends
+    by_left = np.argsort(x_left, kind='mergesort')
+    sorted_left = x_left[by_left]
+    ends = np.searchsorted(sorted_left, x_right[by_left], side='right')
+    counts = np.maximum(ends - np.arange(len(fields)) - 1, 0)
+    cum_counts = np.cumsum(counts)
+
+    totals = [0, 0]  # inclusion dependencies, content-sim
+
+    def connect_pairs(pos_a, pos_b):
+        a = by_left[pos_a]
+        b = by_left[pos_b]
+
+        ind_dep_ab, content_sim_ab, ov_ab = check_pairs(a, b)
+        ind_dep_ba, content_sim_ba, ov_ba = check_pairs(b, a)
+
+        for idx in np.flatnonzero(ind_dep_ab | ind_dep_ba):
+            network.add_relation(fields[a[idx]], fields[b[idx]], Relation.INCLUSION_DEPENDENCY, 1)
+            totals[0] += 1
+
+        # when both directions pass, keep the score of the ref visited last
+        a_last = visit_rank[a] > visit_rank[b]
+        score = np.where(content_sim_ab & (a_last | ~content_sim_ba), ov_ab, ov_ba)
+        for idx in np.flatnonzero(content_sim_ab | content_sim_ba):
+            network.add_relation(fields[a[idx]], fields[b[idx]], Relation.CONTENT_SIM, float(score[idx]))
+            totals[1] += 1
+
+    with buildmetrics.step("overlap_sweep"):
+        if nids is None:
+            start = 0
+            while start < len(fields):
+                done = cum_counts[start - 1] if start > 0 else 0
+                end = max(start + 1, int(np.searchsorted(cum_counts, done + chunk_size, side='right')))
+                c = counts[start:end]
+                if c.sum() > 0:
+                    pos_a = np.repeat(np.arange(start, end), c)
+                    first = np.repeat(np.cumsum(c) - c, c)
+                    pos_b = pos_a + 1 + (np.arange(len(pos_a)) - first)
+                    connect_pairs(pos_a, pos_b)
+                start = end
+        else:
+            # pairs of each selected field with the intervals that start after it and before it ends, and
+            # with the not selected intervals that start before it and end after its start
+            nids = set(nids)
+            selected = np.asarray([fields[i] in nids for i in by_left], dtype=bool)
+            for pos in np.flatnonzero(selected):
+                after = np.arange(pos + 1, pos + 1 + counts[pos])
+                before = np.flatnonzero((ends[:pos] > pos) & ~selected[:pos])
+                if len(after) + len(before) > 0:
+                    connect_pairs(np.r_[np.full(len(after), pos, dtype=np.int64), before],
+                                  np.r_[after, np.full(len(before), pos, dtype=np.int64)])
+
+    total_ind_dep, total_content_sim = totals
+    print("Total num content-sim: {0}".format(str(total_content_sim)))
+    print("Total num inclusion-dep: {0}".format(str(total_ind_dep)))
+
+    # Final clustering for single points, visited in the same order as in the nested loop
+    single_points = [(fields[i], domains[i]) + stats[i] for i in visit_order if domains[i] == 0]
+    with buildmetrics.step("single_point_clusters"):
+        connect_single_point_clusters(network, single_points, overlap, nids=nids)
 
 
 def build_content_sim_relation_num_overlap_distr(network, id_sig):
@@ -479,46 +1241,7 @@ def build_content_sim_relation_num_overlap_distr(network, id_sig):
             """
 
     # Final clustering for single points
-
-    fields = []
-    medians = []
-
-    for (nid, domain, x_min, x_left, x_right, x_max) in single_points:
-        median = x_right - float(x_right / 2)
-        fields.append(nid)
-        medians.append(median)
-
-    x_median = np.asarray(medians)
-    x_median = x_median.reshape(-1, 1)
-
-    # At this point, we may have not found any points at all, in which case we can
-    # safely exit
-    if len(x_median) == 0:
-        return
-
-    db_median = DBSCAN(eps=0.1, min_samples=2).fit(x_median)
-    labels_median = db_median.labels_
-    n_clusters = len(set(labels_median)) - (1 if -1 in labels_median else 0)
-    #print("#clusters: " + str(n_clusters))
-
-    clusters_median = defaultdict(list)
-    for i in range(len(labels_median)):
-        clusters_median[labels_median[i]].append(i)
-
-    for k, v in clusters_median.items():
-        if k == -1:
-            continue
-        #print("Cluster: " + str(k))
-        for el in v:
-            nid = fields[el]
-            info = network.get_info_for([nid])
-            (nid, db_name, source_name, field_name) = info[0]
-            #print(source_name + " - " + field_name + " median: " + str(medians[el]))
-            for el2 in v:
-                if el != el2:
-                    nid1 = fields[el]
-                    nid2 = fields[el2]
-                    connect(nid1, nid2, overlap)
+    connect_single_point_clusters(network, single_points, overlap)
 
 
 def build_content_sim_relation_num_double_clustering(network, id_sig):
@@ -655,6 +1378,128 @@ def build_pkfk_relation(network):
     print("Total number PKFK: {0}".format(str(total_pkfk_relations)))
 
 
+def build_pkfk_relation_vectorized(network):
+    """
+    Same PKFK relation as build_pkfk_relation, computed over arrays: cardinalities and data types are indexed by
+    a dense node id, and the INCLUSION_DEPENDENCY and CONTENT_SIM adjacency is read once as edge arrays. A node
+    is a candidate if its cardinality is > 0.7, and it is connected to its neighbours through the relation that
+    matches its data type, with the highest cardinality of the pair as score.
+    :param network: the FieldNetwork, with the CONTENT_SIM and INCLUSION_DEPENDENCY relations
+    """
+    st = time.time()
+    G = network._get_underlying_repr_graph()
+    nids = [nid for nid in network.iterate_ids()]
+    if len(nids) == 0:
+        return
+    dense_id = {nid: i for i, nid in enumerate(nids)}
+    card = np.asarray([G.node[nid]['cardinality'] or 0 for nid in nids], dtype=np.float64)
+    data_type = np.asarray([network.get_data_type_of(nid) for nid in nids])
+    candidate = card > 0.7
+    neighbourhood_type = {Relation.INCLUSION_DEPENDENCY: "N", Relation.CONTENT_SIM: "T"}
+
+    # The adjacency has every edge in both directions, so each candidate sees all its neighbours
+    with buildmetrics.step("pkfk_edge_arrays"):
+        src = {relation: [] for relation in neighbourhood_type.keys()}
+        tgt = {relation: [] for relation in neighbourhood_type.keys()}
+        for u, neighbours in G.adj.items():
+            for v, relations in neighbours.items():
+                for relation in neighbourhood_type.keys():
+                    if relation in relations:
+                        src[relation].append(dense_id[u])
+                        tgt[relation].append(dense_id[v])
+    et = time.time()
+    print("Extract edge arrays: {0}".format(str(et - st)))
+
+    st = time.time()
+    with buildmetrics.step("pkfk_candidates"):
+        pairs = []
+        for relation, dt in neighbourhood_type.items():
+            a = np.asarray(src[relation], dtype=np.int64)
+            b = np.asarray(tgt[relation], dtype=np.int64)
+            selected = candidate[a] & (data_type[a] == dt)
+            a, b = a[selected], b[selected]
+            pairs.append(np.minimum(a, b) * len(nids) + np.maximum(a, b))
+        pairs = np.unique(np.concatenate(pairs))
+        a = pairs // len(nids)
+        b = pairs % len(nids)
+        scores = np.maximum(card[a], card[b])
+    et = time.time()
+    print("Compute PKFK: {0}".format(str(et - st)))
+
+    st = time.time()
+    with buildmetrics.step("pkfk_insert"):
+        network.add_relations([nids[i] for i in a], [nids[i] for i in b], Relation.PKFK, scores.tolist())
+    et = time.time()
+    print("Total number PKFK: {0} in {1}".format(str(len(pairs)), str(et - st)))
+
+
+def build_pkfk_relation_csr(network, add_edges, max_nnz=2 ** 22):
+    """
+    Same PKFK relation as build_pkfk_relation_vectorized, for a CSRFieldNetwork, e.g., the one assembled by an
+    out-of-core build. The INCLUSION_DEPENDENCY and CONTENT_SIM adjacency is read in blocks of rows, and the PKFK
+    edges of each block are passed on as dense ids, so memory does not grow with the number of edges. A pair of
+    two candidates is passed on once from each side, with the same score.
+    :param network: the CSRFieldNetwork, with the CONTENT_SIM and INCLUSION_DEPENDENCY relations
+    :param add_edges: function called as add_edges(Relation.PKFK, source dense ids, target dense ids, scores),
+    e.g., EdgeSpill.add_dense
+    :param max_nnz: max adjacency entries read at once
+    :return: number of edges passed on
+    """
+    st = time.time()
+    nids = network._nids
+    card = np.nan_to_num(network._cardinality)  # no cardinality is like card 0
+    data_type = np.asarray([network.get_data_type_of(nid) for nid in nids])
+    candidate = card > 0.7
+    neighbourhood_type = {Relation.INCLUSION_DEPENDENCY: "N", Relation.CONTENT_SIM: "T"}
+
+    total = 0
+    with buildmetrics.step("pkfk_candidates"):
+        for relation, dt in neighbourhood_type.items():
+            adjacency = network._adjacency.get(relation)
+            if adjacency is None:
+                continue
+            selected = candidate & (data_type == dt)
+            # the adjacency has every edge in both directions, so each candidate sees all its neighbours
+            for start, end in blocks_by_nnz(np.diff(adjacency.indptr), max_nnz):
+                lo, hi = adjacency.indptr[start], adjacency.indptr[end]
+                rows = np.repeat(np.arange(start, end, dtype=np.int64), np.diff(adjacency.indptr[start:end + 1]))
+                keep = selected[rows]
+                a = rows[keep]
+                b = np.asarray(adjacency.indices[lo:hi], dtype=np.int64)[keep]
+                if len(a) > 0:
+                    add_edges(Relation.PKFK, a, b, np.maximum(card[a], card[b]))
+                    total += len(a)
+    et = time.time()
+    print("Total PKFK candidates: {0} in {1}".format(str(total), str(et - st)))
+    return total
+
+
+def update_pkfk_relation(network, nids):
+    """
+    Adds the PKFK relations that build_pkfk_relation would create for pairs that include one of nids, i.e., a
+    candidate in nids connected to its neighbourhood, or a candidate with one of nids in its neighbourhood
+    :param network: the FieldNetwork, with the CONTENT_SIM and INCLUSION_DEPENDENCY relations of nids
+    :param nids: new fields
+    """
+    neighbourhood_relation = {"N": Relation.INCLUSION_DEPENDENCY, "T": Relation.CONTENT_SIM}
+
+    total_pkfk_relations = 0
+    for n in nids:
+        n_card = network.get_cardinality_of(n)
+        for relation in [Relation.INCLUSION_DEPENDENCY, Relation.CONTENT_SIM]:
+            n_is_candidate = n_card > 0.7 and neighbourhood_relation.get(network.get_data_type_of(n)) == relation
+            for ne in network.neighbors_id(n, relation):
+                if ne.nid == n:
+                    continue
+                ne_card = network.get_cardinality_of(ne.nid)
+                ne_is_candidate = ne_card > 0.7 and \
+                    neighbourhood_relation.get(network.get_data_type_of(ne.nid)) == relation
+                if n_is_candidate or ne_is_candidate:
+                    network.add_relation(n, ne.nid, Relation.PKFK, max(n_card, ne_card))
+                    total_pkfk_relations += 1
+    print("Total number PKFK: {0}".format(str(total_pkfk_relations)))
+
+
 if __name__ == "__main__":
     print("TODO")
 
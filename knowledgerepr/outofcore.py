@@ -0,0 +1,273 @@
+import heapq
+import os
+import shutil
+
+import numpy as np
+
+from array import array
+from collections import defaultdict
+
+from knowledgerepr.buildscheduler import EdgeCollector
+from knowledgerepr.csrnetwork import CSRAdjacency
+from knowledgerepr.csrnetwork import CSRFieldNetwork
+from knowledgerepr.csrnetwork import NidKeys
+from knowledgerepr.csrnetwork import NidList
+
+
+class MemoryBudget:
+    """
+    Memory available to an out-of-core build, split among the buffers of the different steps
+    """
+
+    def __init__(self, megabytes):
+        self.bytes = int(megabytes) * 2 ** 20
+
+    def rows(self, bytes_per_row, fraction=0.25):
+        """
+        :return: how many rows of bytes_per_row fit in the given fraction of the budget
+        """
+        return max(1, int(self.bytes * fraction) // int(bytes_per_row))
+
+
+def write_mh_signatures(chunks, path, num_perm=512):
+    """
+    Appends chunks of minhash signatures to a raw uint64 file, one chunk in memory at a time
+    :param chunks: iterable of lists of (nid, minhash hash values)
+    :param path: the file to write
+    :return: (list of nids, read-only memory-mapped (len(nids) x num_perm) matrix)
+    """
+    nids = []
+    with open(path, 'wb') as f:
+        for chunk in chunks:
+            block = np.empty((len(chunk), num_perm), dtype=np.uint64)
+            for row, (nid, mh_sig) in enumerate(chunk):
+                nids.append(nid)
+                block[row] = mh_sig
+            block.tofile(f)
+    if len(nids) == 0:
+        return nids, np.empty((0, num_perm), dtype=np.uint64)
+    return nids, np.memmap(path, dtype=np.uint64, mode='r', shape=(len(nids), num_perm))
+
+
+class EdgeSpill:
+    """
+    Buffers edges per relation and, when the buffers are full, spills them to disk as runs sorted by node pair.
+    Nodes are stored by dense id, pairs with the lowest id first. The runs of a relation are merged straight into
+    the CSR adjacency of the model (see csrnetwork.CSRAdjacency), whose arrays are memory-mapped files, so the
+    edges are never held in memory all at once. When the same pair is added more than once, the score added
+    last is kept, as add_relation does.
+    """
+
+    run_dtype = np.dtype([('pair', np.int64), ('seq', np.int64), ('score', np.float64)])
+    merged_dtype = np.dtype([('pair', np.int64), ('score', np.float64)])
+    bytes_per_edge = 32  # src, tgt, seq and score while buffered
+
+    def __init__(self, directory, nids, max_edges=2 ** 22):
+        """
+        :param directory: where runs are written, it is created if it does not exist
+        :param nids: all the nodes of the network, their position is their dense id
+        :param max_edges: max number of edges buffered in memory, across relations
+        """
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        nids = list(nids)
+        # numerical nids are found in sorted int64 keys, without a dict of nid -> dense id
+        self.nids = NidKeys.from_nids(nids)
+        if self.nids is None:
+            self.nids = NidList(nids)
+        self.num_nodes = len(nids)
+        self.max_edges = max_edges
+        self.buffers = defaultdict(lambda: ([], [], array('q'), array('d')))
+        self.buffered = 0
+        self.runs = defaultdict(list)
+        self.seq = 0
+        self.adjacency = dict()  # relation -> CSRAdjacency, of the relations assembled so far
+        self.edge_counts = dict()  # relation -> number of edges, of the relations assembled so far
+        self.degree = np.zeros(self.num_nodes, dtype=np.int64)
+        self.cardinality = None
+
+    def add(self, node_src, node_target, relation, score):
+        # nids are turned into dense ids a buffer at a time, when it is spilled
+        src, tgt, seq, scores = self.buffers[relation]
+        src.append(node_src)
+        tgt.append(node_target)
+        seq.append(self.seq)
+        scores.append(score)
+        self.seq += 1
+        self.buffered += 1
+        if self.buffered >= self.max_edges:
+            self.spill()
+
+    def add_many(self, nodes_src, nodes_target, relation, scores):
+        for node_src, node_target, score in zip(nodes_src, nodes_target, scores):
+            self.add(node_src, node_target, relation, score)
+
+    def add_dense(self, relation, src, tgt, scores):
+        """
+        Writes a block of edges given by dense id as a run of its own
+        :param src: dense id of the source of each edge
+        :param tgt: dense id of the target of each edge
+        :param scores: score of each edge
+        """
+        seq = np.arange(self.seq, self.seq + len(src), dtype=np.int64)
+        self.seq += len(src)
+        self._write_run(relation, np.asarray(src, dtype=np.int64), np.asarray(tgt, dtype=np.int64), seq,
+                        np.asarray(scores, dtype=np.float64))
+
+    def _write_run(self, relation, a, b, seq, scores):
+        if len(a) == 0:
+            return
+        run = np.empty(len(a), dtype=self.run_dtype)
+        run['pair'] = np.minimum(a, b) * self.num_nodes + np.maximum(a, b)
+        run['seq'] = seq
+        run['score'] = scores
+        run = run[np.lexsort((run['seq'], run['pair']))]
+        path = os.path.join(self.directory, relation.name + "_" + str(len(self.runs[relation])) + ".npy")
+        np.save(path, run)
+        self.runs[relation].append(path)
+
+    def spill(self):
+        """
+        Writes every non empty buffer as a sorted run
+        """
+        for relation, (src, tgt, seq, scores) in self.buffers.items():
+            if len(src) == 0:
+                continue
+            self._write_run(relation, self.nids.dense_ids(src), self.nids.dense_ids(tgt),
+                            np.frombuffer(seq, dtype=np.int64), np.frombuffer(scores, dtype=np.float64))
+        self.buffers.clear()
+        self.buffered = 0
+
+    def _iterate_run(self, path, block_rows):
+        run = np.load(path, mmap_mode='r')
+        for start in range(0, len(run), block_rows):
+            block = np.asarray(run[start:start + block_rows])
+            yield from zip(block['pair'].tolist(), block['seq'].tolist(), block['score'].tolist())
+
+    def merge(self, relation, block_rows=65536, block_edges=65536):
+        """
+        Merges the runs of relation, keeping the last score added for each pair
+        :param block_rows: rows read at a time from each run
+        :return: generator of (pairs, scores) arrays of up to block_edges pairs, in pair order. A pair is
+        min(dense ids) * num_nodes + max(dense ids)
+        """
+        runs = [self._iterate_run(path, block_rows) for path in self.runs[relation]]
+        pairs, scores = array('q'), array('d')
+        last = None
+        for pair, seq, score in heapq.merge(*runs):
+            if last is not None and last[0] != pair:
+                pairs.append(last[0])
+                scores.append(last[2])
+                if len(pairs) >= block_edges:
+                    yield np.frombuffer(pairs, dtype=np.int64), np.frombuffer(scores, dtype=np.float64)
+                    pairs, scores = array('q'), array('d')
+            last = (pair, seq, score)
+        if last is not None:
+            pairs.append(last[0])
+            scores.append(last[2])
+        if len(pairs) > 0:
+            yield np.frombuffer(pairs, dtype=np.int64), np.frombuffer(scores, dtype=np.float64)
+
+    def _mapped(self, name, dtype, length):
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.lib.format.open_memmap(os.path.join(self.directory, name), mode='w+', dtype=dtype,
+                                         shape=(length,))
+
+    def _assemble_relation(self, relation, block_edges):
+        """
+        Merges the runs of relation into a CSRAdjacency in two passes: the first writes the merged edges to a
+        file and counts the entries of each row, the second places each block of edges in its rows. Edges come in
+        pair order, so the columns of each row are placed in increasing order, as CSRAdjacency.from_edges sorts them
+        """
+        n = self.num_nodes
+        # block reads per run are bounded so all runs of a relation fit in the buffer budget together
+        block_rows = max(1, self.max_edges // max(1, len(self.runs[relation])))
+        row_nnz = np.zeros(n, dtype=np.int64)
+        self_loops = np.zeros(n, dtype=np.int64)
+        total = 0
+        merged_path = os.path.join(self.directory, relation.name + "_merged.bin")
+        with open(merged_path, 'wb') as f:
+            for pairs, scores in self.merge(relation, block_rows=block_rows, block_edges=block_edges):
+                a, b = pairs // n, pairs % n
+                for ids in (a, b[a != b]):
+                    rows, counts = np.unique(ids, return_counts=True)
+                    row_nnz[rows] += counts
+                rows, counts = np.unique(a[a == b], return_counts=True)
+                self_loops[rows] += counts
+                block = np.empty(len(pairs), dtype=self.merged_dtype)
+                block['pair'] = pairs
+                block['score'] = scores
+                block.tofile(f)
+                total += len(pairs)
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(row_nnz, out=indptr[1:])
+        indices = self._mapped(relation.name + "_indices.npy", np.int32, int(indptr[-1]))
+        values = self._mapped(relation.name + "_scores.npy", np.float32, int(indptr[-1]))
+        if total > 0:
+            merged = np.memmap(merged_path, dtype=self.merged_dtype, mode='r', shape=(total,))
+            cursor = indptr[:-1].copy()
+            for start in range(0, total, block_edges):
+                block = np.asarray(merged[start:start + block_edges])
+                a, b = block['pair'] // n, block['pair'] % n
+                reverse = a != b
+                rows = np.concatenate([a, b[reverse]])
+                cols = np.concatenate([b, a[reverse]])
+                scores = np.concatenate([block['score'], block['score'][reverse]])
+                order = np.lexsort((cols, rows))
+                rows, cols, scores = rows[order], cols[order], scores[order]
+                positions = cursor[rows] + np.arange(len(rows)) - np.searchsorted(rows, rows)
+                indices[positions] = cols
+                values[positions] = scores
+                block_rows_of, counts = np.unique(rows, return_counts=True)
+                cursor[block_rows_of] += counts
+            del merged
+        os.remove(merged_path)
+        for path in self.runs.pop(relation):
+            os.remove(path)
+
+        self.adjacency[relation] = CSRAdjacency(indptr, indices, values)
+        self.edge_counts[relation] = total
+        # self loops count twice, as in networkx
+        self.degree += row_nnz + self_loops
+
+    def assemble(self, network, block_edges=65536):
+        """
+        Merges the runs of every relation spilled so far into its CSR adjacency, one block of edges at a time
+        :param network: the FieldNetwork with the meta schema and the cardinality of the nodes, or the
+        CSRFieldNetwork returned by a previous assemble
+        :return: a CSRFieldNetwork over the dense ids of the spill, with all the relations assembled so far
+        """
+        self.spill()
+        for relation in list(self.runs.keys()):
+            self._assemble_relation(relation, block_edges)
+        if self.cardinality is None:
+            G = network._get_underlying_repr_graph()
+            self.cardinality = np.full(self.num_nodes, np.nan, dtype=np.float64)
+            for i, nid in enumerate(self.nids):
+                card = G.node[nid].get('cardinality')
+                if card is not None:
+                    self.cardinality[i] = card
+        return CSRFieldNetwork(self.nids, self.cardinality, dict(self.adjacency),
+                               network._get_underlying_repr_id_to_field_info(), edge_counts=dict(self.edge_counts),
+                               degree=self.degree.copy())
+
+    def clear(self):
+        shutil.rmtree(self.directory)
+
+
+class SpillingEdgeCollector(EdgeCollector):
+    """
+    EdgeCollector that sends relations to an EdgeSpill instead of keeping them in memory
+    """
+
+    def __init__(self, network, spill):
+        super().__init__(network)
+        self._spill = spill
+
+    def add_relation(self, node_src, node_target, relation, score):
+        self._spill.add(node_src, node_target, relation, score)
+
+    def add_relations(self, nodes_src, nodes_target, relation, scores):
+        self._spill.add_many(nodes_src, nodes_target, relation, scores)
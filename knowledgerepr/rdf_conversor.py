@@ -1,9 +1,20 @@
-import rdflib
-from rdflib import Namespace
-from rdflib import Graph
+import gzip
+import multiprocessing
+import os
+import re
+import sys
 import pprint as pp
 
-n = Namespace("http://ex.org/")
+from api.apiutils import Relation
+
+NAMESPACE = "http://ex.org/"
+
+# lines kept in memory by a TripleWriter before they are written out
+BUFFER_LINES = 65536
+
+# local names that can be written as ex:name in Turtle
+TURTLE_LOCAL_NAME = re.compile(r'^[A-Za-z0-9_]+$')
+
 
 def parse_line(l):
     tokens = l.split(",")
@@ -25,6 +36,8 @@ def yield_triple(path):
 
 
 def create_rdf_graph_from_csv(csv_path):
+    # builds the whole graph in memory, use export_edge_csv for large graphs
+    import rdflib
     from rdflib import Graph
     g = Graph()
     c = 0
@@ -42,8 +55,163 @@ def create_rdf_graph_from_csv(csv_path):
     g.serialize(destination="test.rdf", format='xml')
 
 
+def escape_literal(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class TripleWriter:
+    """
+    Writes triples as N-Triples ('nt') or Turtle ('ttl') lines, with the names of NAMESPACE. Lines are kept in a
+    buffer of up to buffer_lines lines and written out in one call when it fills, so memory does not grow with the
+    number of triples. With compress, the file is written with gzip.
+    """
+
+    def __init__(self, path, fmt='nt', compress=False, buffer_lines=BUFFER_LINES):
+        if fmt not in ('nt', 'ttl'):
+            raise ValueError("Unknown RDF format: " + str(fmt))
+        self.fmt = fmt
+        self.buffer_lines = buffer_lines
+        self.path = path
+        self.buffer = []
+        self.triples = 0
+        if compress:
+            self.f = gzip.open(path, 'wt', encoding='utf8')
+        else:
+            self.f = open(path, 'w', encoding='utf8')
+        if fmt == 'ttl':
+            self.f.write("@prefix ex: <" + NAMESPACE + "> .\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def term(self, name):
+        name = str(name)
+        if self.fmt == 'ttl' and TURTLE_LOCAL_NAME.match(name):
+            return "ex:" + name
+        return "<" + NAMESPACE + name + ">"
+
+    def _append(self, line):
+        self.buffer.append(line)
+        self.triples += 1
+        if len(self.buffer) >= self.buffer_lines:
+            self.flush()
+
+    def write(self, subject, predicate, obj):
+        self._append(self.term(subject) + " " + self.term(predicate) + " " + self.term(obj) + " .\n")
+
+    def write_literal(self, subject, predicate, value):
+        self._append(self.term(subject) + " " + self.term(predicate) + ' "' + escape_literal(value) + '" .\n')
+
+    def flush(self):
+        self.f.write("".join(self.buffer))
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def output_file(path, name, fmt, compress):
+    return os.path.join(path, name + "." + fmt + (".gz" if compress else ""))
+
+
+def write_nodes(network, writer):
+    """
+    Writes the meta schema of each field as literals
+    """
+    for nid, (db_name, source_name, field_name, data_type) in \
+            network._get_underlying_repr_id_to_field_info().items():
+        writer.write_literal(nid, "db_name", db_name)
+        writer.write_literal(nid, "source_name", source_name)
+        writer.write_literal(nid, "field_name", field_name)
+
+
+def write_relation(network, relation, writer):
+    """
+    Writes each undirected edge of relation once, as nid relation nid
+    """
+    for src, tgt, score in network.iterate_edges(relation):
+        writer.write(src, relation.name, tgt)
+
+
+# network of the parallel export, set before forking the workers so they do not receive it pickled
+_export_network = None
+
+
+def _export_relation(args):
+    relation, path, fmt, compress, buffer_lines = args
+    with TripleWriter(path, fmt=fmt, compress=compress, buffer_lines=buffer_lines) as writer:
+        if relation is None:
+            write_nodes(_export_network, writer)
+        else:
+            write_relation(_export_network, relation, writer)
+    return path, writer.triples
+
+
+def export_network(network, path, fmt='nt', compress=False, processes=1, buffer_lines=BUFFER_LINES):
+    """
+    Streams a FieldNetwork to RDF, with one file for the meta schema of the fields (nodes) and one per relation with
+    edges, written by processes forked processes in parallel
+    :param network: a FieldNetwork or CSRFieldNetwork
+    :param path: directory where the files are written
+    :param fmt: 'nt' for N-Triples, 'ttl' for Turtle
+    :param compress: if True, the files are written with gzip
+    :param processes: number of files written at the same time
+    :param buffer_lines: lines buffered by each writer
+    :return: dict of file path -> number of triples written
+    """
+    global _export_network
+    os.makedirs(path, exist_ok=True)
+    tasks = [(None, output_file(path, "nodes", fmt, compress), fmt, compress, buffer_lines)]
+    for relation in Relation:
+        if network.relation_count(relation) > 0:
+            tasks.append((relation, output_file(path, relation.name, fmt, compress), fmt, compress, buffer_lines))
+    _export_network = network
+    try:
+        if processes > 1:
+            ctx = multiprocessing.get_context('fork')
+            with ctx.Pool(processes) as pool:
+                written = pool.map(_export_relation, tasks, chunksize=1)
+        else:
+            written = [_export_relation(task) for task in tasks]
+    finally:
+        _export_network = None
+    return dict(written)
+
+
+def export_edge_csv(csv_path, path, fmt='nt', compress=False, buffer_lines=BUFFER_LINES):
+    """
+    Streams an edge CSV with a source,target,type header to RDF in one pass, with one file per edge type
+    :param csv_path: path of the edge CSV
+    :param path: directory where the files are written
+    :param fmt: 'nt' for N-Triples, 'ttl' for Turtle
+    :param compress: if True, the files are written with gzip
+    :param buffer_lines: lines buffered by each writer
+    :return: dict of file path -> number of triples written
+    """
+    os.makedirs(path, exist_ok=True)
+    writers = dict()
+    try:
+        for source, target, rtype in yield_triple(csv_path):
+            rtype = rtype.strip()
+            writer = writers.get(rtype)
+            if writer is None:
+                writer = TripleWriter(output_file(path, rtype, fmt, compress), fmt=fmt, compress=compress,
+                                      buffer_lines=buffer_lines)
+                writers[rtype] = writer
+            writer.write(source.strip(), rtype, target.strip())
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return {writer.path: writer.triples for writer in writers.values()}
+
+
 if __name__ == "__main__":
     print("RDF conversor")
 
-    create_rdf_graph_from_csv("/Users/ra-mit/Downloads/graph-1.csv")
-
+    # python rdf_conversor.py <edge csv> <output directory>
+    written = export_edge_csv(sys.argv[1], sys.argv[2], fmt='nt', compress=True)
+    pp.pprint(written)
@@ -0,0 +1,294 @@
+import os
+
+import numpy as np
+
+from collections import defaultdict
+from scipy.sparse import csr_matrix
+from scipy.sparse import identity
+from scipy.sparse.csgraph import connected_components
+
+from api.apiutils import Relation
+
+
+class TableJoinGraph:
+    """
+    Table-level view of a field relation, PKFK by default: one node per table, and an edge between two tables when
+    any of their fields are related. Each edge keeps its key pairs (field of one table, field of the other, score)
+    sorted by score, so paths are searched among tables and only expanded to fields when they are assembled.
+    Both directions of an edge are stored, in CSR form over table ids.
+    """
+
+    file_name = "table_join_graph.npz"
+
+    def __init__(self, tables, indptr, neighbors, pair_indptr, pair_src, pair_dst, pair_scores):
+        """
+        :param tables: name of each table id
+        :param indptr: the neighbours of table i are neighbors[indptr[i]:indptr[i + 1]], sorted
+        :param neighbors: table id of the other end of each edge
+        :param pair_indptr: the key pairs of edge e are the entries pair_indptr[e]:pair_indptr[e + 1] of pair_*
+        :param pair_src: nid of the key pair field in the table of the edge
+        :param pair_dst: nid of the key pair field in the neighbour table
+        :param pair_scores: score of the key pair
+        """
+        self.tables = list(tables)
+        self.table_id = {t: i for i, t in enumerate(self.tables)}
+        self.indptr = indptr
+        self.neighbors = neighbors
+        self.pair_indptr = pair_indptr
+        self.pair_src = pair_src
+        self.pair_dst = pair_dst
+        self.pair_scores = pair_scores
+
+    @staticmethod
+    def from_network(network, relation=Relation.PKFK):
+        """
+        Aggregates the field edges of relation between fields of different tables
+        :param network: the FieldNetwork
+        :param relation: the field relation
+        :return: the TableJoinGraph
+        """
+        id_names = network._get_underlying_repr_id_to_field_info()
+        src, dst, score = network.neighbors_batch(list(network.iterate_ids()), relation)
+        pairs = defaultdict(list)
+        for u, v, sc in zip(src.tolist(), dst.tolist(), score.tolist()):
+            t1 = id_names[u][1]
+            t2 = id_names[v][1]
+            if t1 != t2:
+                pairs[(t1, t2)].append((-sc, u, v))
+
+        tables = sorted(set(t for t, _ in pairs.keys()))
+        table_id = {t: i for i, t in enumerate(tables)}
+        edges = sorted(pairs.keys(), key=lambda e: (table_id[e[0]], table_id[e[1]]))
+        indptr = np.zeros(len(tables) + 1, dtype=np.int64)
+        np.cumsum(np.bincount([table_id[t1] for t1, _ in edges], minlength=len(tables)), out=indptr[1:])
+        neighbors = np.array([table_id[t2] for _, t2 in edges], dtype=np.int32)
+        pair_indptr = np.zeros(len(edges) + 1, dtype=np.int64)
+        pair_src, pair_dst, pair_scores = [], [], []
+        for e, edge in enumerate(edges):
+            for neg_score, u, v in sorted(pairs[edge]):
+                pair_src.append(u)
+                pair_dst.append(v)
+                pair_scores.append(-neg_score)
+            pair_indptr[e + 1] = len(pair_src)
+        return TableJoinGraph(tables, indptr, neighbors, pair_indptr, np.array(pair_src, dtype=str),
+                              np.array(pair_dst, dtype=str), np.array(pair_scores, dtype=np.float64))
+
+    def save(self, path):
+        """
+        :param path: directory of the model
+        """
+        np.savez(os.path.join(path, self.file_name), tables=np.array(self.tables, dtype=str), indptr=self.indptr,
+                 neighbors=self.neighbors, pair_indptr=self.pair_indptr, pair_src=self.pair_src,
+                 pair_dst=self.pair_dst, pair_scores=self.pair_scores)
+
+    @staticmethod
+    def load(path):
+        """
+        :param path: directory of the model
+        :return: the TableJoinGraph of the model, None if the model does not have one
+        """
+        path = os.path.join(path, TableJoinGraph.file_name)
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as f:
+            return TableJoinGraph(f['tables'].tolist(), f['indptr'], f['neighbors'], f['pair_indptr'],
+                                  f['pair_src'], f['pair_dst'], f['pair_scores'])
+
+    def _edges_of(self, table):
+        i = self.table_id.get(table)
+        if i is None:
+            return range(0)
+        return range(self.indptr[i], self.indptr[i + 1])
+
+    def neighbors_of(self, table):
+        """
+        :return: list of (neighbour table, best key pair score)
+        """
+        return [(self.tables[self.neighbors[e]], float(self.pair_scores[self.pair_indptr[e]]))
+                for e in self._edges_of(table)]
+
+    def key_pairs(self, table1, table2, limit=None):
+        """
+        :param limit: if given, only the limit best key pairs are returned
+        :return: list of (nid in table1, nid in table2, score), best score first
+        """
+        j = self.table_id.get(table2)
+        for e in self._edges_of(table1):
+            if self.neighbors[e] == j:
+                lo, hi = self.pair_indptr[e], self.pair_indptr[e + 1]
+                if limit is not None:
+                    hi = min(hi, lo + limit)
+                return list(zip(self.pair_src[lo:hi].tolist(), self.pair_dst[lo:hi].tolist(),
+                                self.pair_scores[lo:hi].tolist()))
+        return []
+
+    def paths(self, source, target, max_hops=3):
+        """
+        All paths between two tables that do not visit a table twice, iteratively and depth-first
+        :param source: source table
+        :param target: target table
+        :param max_hops: max number of joins of a path
+        :return: list of paths, each a list of tables from source to target
+        """
+        if source == target or source not in self.table_id or target not in self.table_id:
+            return []
+        target_id = self.table_id[target]
+        found = []
+        path = [self.table_id[source]]
+        on_path = {path[0]}
+        stack = [iter(self.neighbors[self.indptr[path[0]]:self.indptr[path[0] + 1]].tolist())]
+        while len(stack) > 0:
+            nxt = next(stack[-1], None)
+            if nxt is None:
+                stack.pop()
+                on_path.discard(path.pop())
+            elif nxt == target_id:
+                found.append([self.tables[t] for t in path] + [target])
+            elif nxt not in on_path and len(path) < max_hops:
+                path.append(nxt)
+                on_path.add(nxt)
+                stack.append(iter(self.neighbors[self.indptr[nxt]:self.indptr[nxt + 1]].tolist()))
+        return found
+
+
+class ReachabilityIndex:
+    """
+    Answers whether two tables can be joined within a number of hops without searching paths. It keeps the
+    connected component of each table in the join graph and, for components of up to max_component_tables tables,
+    bitsets with the tables reachable from each table within 1..max_hops hops. Hop queries on larger components,
+    or beyond max_hops, run a bounded breadth-first search on the join graph.
+    """
+
+    file_name = "reachability_index.npz"
+
+    def __init__(self, graph, labels, sizes, local, bits, bits_offset, max_hops):
+        """
+        :param graph: the TableJoinGraph
+        :param labels: component of each table id
+        :param sizes: number of tables of each component
+        :param local: index of each table id among the tables of its component
+        :param bits: bitsets of all components, concatenated
+        :param bits_offset: start of the (max_hops x size x bytes per row) bitsets of each component in bits, -1 if
+        the component has none
+        :param max_hops: max hops of the bitsets
+        """
+        self.graph = graph
+        self.labels = labels
+        self.sizes = sizes
+        self.local = local
+        self.bits = bits
+        self.bits_offset = bits_offset
+        self.max_hops = max_hops
+
+    @staticmethod
+    def from_join_graph(graph, max_hops=3, max_component_tables=4096):
+        """
+        :param graph: the TableJoinGraph
+        :param max_hops: max hops of the bitsets
+        :param max_component_tables: components with more tables than this do not get bitsets
+        :return: the ReachabilityIndex
+        """
+        num_tables = len(graph.tables)
+        adjacency = csr_matrix((np.ones(len(graph.neighbors), dtype=np.int8), graph.neighbors, graph.indptr),
+                               shape=(num_tables, num_tables))
+        _, labels = connected_components(adjacency, directed=False)
+        labels = labels.astype(np.int32)
+        sizes = np.bincount(labels)
+        local = np.zeros(num_tables, dtype=np.int32)
+        bits = []
+        bits_offset = np.full(len(sizes), -1, dtype=np.int64)
+        total = 0
+        order = np.argsort(labels, kind='mergesort')
+        starts = np.concatenate([[0], np.cumsum(sizes)])
+        for c in range(len(sizes)):
+            members = order[starts[c]:starts[c + 1]]
+            local[members] = np.arange(len(members))
+            if len(members) > max_component_tables:
+                continue
+            sub = adjacency[members][:, members]
+            reach = identity(len(members), dtype=np.int8, format='csr')
+            levels = []
+            for _ in range(max_hops):
+                reach = reach + reach.dot(sub)
+                reach.data[:] = 1
+                levels.append(np.packbits(reach.toarray().astype(bool), axis=1))
+            block = np.stack(levels).ravel()
+            bits_offset[c] = total
+            bits.append(block)
+            total += len(block)
+        bits = np.concatenate(bits) if len(bits) > 0 else np.zeros(0, dtype=np.uint8)
+        return ReachabilityIndex(graph, labels, sizes, local, bits, bits_offset, max_hops)
+
+    def save(self, path):
+        """
+        :param path: directory of the model
+        """
+        np.savez(os.path.join(path, self.file_name), labels=self.labels, sizes=self.sizes, local=self.local,
+                 bits=self.bits, bits_offset=self.bits_offset, max_hops=self.max_hops)
+
+    @staticmethod
+    def load(path, graph):
+        """
+        :param path: directory of the model
+        :param graph: the TableJoinGraph of the model
+        :return: the ReachabilityIndex of the model, None if the model does not have one
+        """
+        path = os.path.join(path, ReachabilityIndex.file_name)
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as f:
+            return ReachabilityIndex(graph, f['labels'], f['sizes'], f['local'], f['bits'], f['bits_offset'],
+                                     int(f['max_hops']))
+
+    def same_component(self, tables):
+        """
+        :return: True if all tables are in the same component, so a join graph can connect them
+        """
+        labels = set()
+        for table in tables:
+            i = self.graph.table_id.get(table)
+            if i is None:
+                return len(set(tables)) == 1  # a table without joins only joins with itself
+            labels.add(self.labels[i])
+        return len(labels) <= 1
+
+    def _bit(self, c, hops, i, j):
+        size = int(self.sizes[c])
+        row_bytes = (size + 7) // 8
+        byte = self.bits[self.bits_offset[c] + ((hops - 1) * size + i) * row_bytes + j // 8]
+        return bool((byte >> (7 - j % 8)) & 1)
+
+    def _bounded_search(self, i, j, max_hops):
+        visited = {i}
+        frontier = [i]
+        for _ in range(max_hops):
+            next_frontier = []
+            for t in frontier:
+                for n in self.graph.neighbors[self.graph.indptr[t]:self.graph.indptr[t + 1]].tolist():
+                    if n == j:
+                        return True
+                    if n not in visited:
+                        visited.add(n)
+                        next_frontier.append(n)
+            frontier = next_frontier
+        return False
+
+    def reachable(self, table1, table2, max_hops):
+        """
+        :return: True if table2 can be reached from table1 with at most max_hops joins
+        """
+        if table1 == table2:
+            return True
+        i = self.graph.table_id.get(table1)
+        j = self.graph.table_id.get(table2)
+        if i is None or j is None or max_hops < 1 or self.labels[i] != self.labels[j]:
+            return False
+        c = self.labels[i]
+        if max_hops >= self.sizes[c] - 1:
+            return True  # any simple path in the component is short enough
+        if self.bits_offset[c] >= 0:
+            if self._bit(c, min(max_hops, self.max_hops), self.local[i], self.local[j]):
+                return True
+            if max_hops <= self.max_hops:
+                return False
+        return self._bounded_search(i, j, max_hops)
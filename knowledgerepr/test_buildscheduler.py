@@ -0,0 +1,191 @@
+import csv
+import json
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+from collections import defaultdict
+
+import networkx as nx
+
+from api.apiutils import Relation
+from knowledgerepr.buildscheduler import StageScheduler
+from knowledgerepr.buildscheduler import Checkpoint
+from knowledgerepr import buildmetrics
+from knowledgerepr.fieldnetwork import FieldNetwork
+
+
+def make_network():
+    network = FieldNetwork(nx.MultiGraph(), dict(), defaultdict(list))
+    network.init_meta_schema([('1', 'db', 'a', 'x', 10, 10, 'T'),
+                              ('2', 'db', 'b', 'x', 10, 9, 'T'),
+                              ('3', 'db', 'c', 'y', 10, 2, 'T')])
+    return network
+
+
+def content_sim(network):
+    with buildmetrics.step("pull"):
+        buildmetrics.add_rows_pulled(3)
+    network.add_relation('1', '2', Relation.CONTENT_SIM, 0.9)
+    return "content_sim index"
+
+
+def schema_sim(network):
+    network.add_relation('1', '2', Relation.SCHEMA_SIM, 0.0)
+    network.add_relation('2', '3', Relation.SCHEMA_SIM, 0.5)
+
+
+def pkfk(network):
+    for hit in network.neighbors_id('1', Relation.CONTENT_SIM):
+        network.add_relation('1', hit.nid, Relation.PKFK, 1.0)
+
+
+def killed(network):
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def slow(network):
+    time.sleep(60)
+
+
+def failing(network):
+    raise ValueError("no signatures")
+
+
+class TestStageScheduler(unittest.TestCase):
+
+    def run_with(self, workers):
+        network = make_network()
+        scheduler = StageScheduler(workers=workers)
+        scheduler.add_stage("content_sim", content_sim)
+        scheduler.add_stage("schema_sim", schema_sim)
+        scheduler.add_stage("pkfk", pkfk, deps=["content_sim"])
+        results = scheduler.run(network)
+        self.assertEqual(results["content_sim"], "content_sim index")
+        self.assertEqual(scheduler.edges_added, {"content_sim": 1, "schema_sim": 2, "pkfk": 1})
+        self.assertEqual(set(scheduler.wall_times.keys()), {"content_sim", "schema_sim", "pkfk"})
+        self.assertEqual([h.nid for h in network.neighbors_id('1', Relation.PKFK)], ['2'])
+        self.assertEqual(len(list(network.neighbors_id('2', Relation.SCHEMA_SIM))), 2)
+
+    def test_sequential(self):
+        self.run_with(1)
+
+    def test_process_pool(self):
+        self.run_with(2)
+
+    def test_dead_worker(self):
+        scheduler = StageScheduler(workers=2, poll_seconds=0.1)
+        scheduler.add_stage("killed", killed)
+        scheduler.add_stage("slow", slow)
+        st = time.time()
+        with self.assertRaisesRegex(RuntimeError, "Stage killed died"):
+            scheduler.run(make_network())
+        self.assertTrue(time.time() - st < 30)
+        self.assertNoChildren()
+
+    def test_failed_stage(self):
+        scheduler = StageScheduler(workers=2, poll_seconds=0.1)
+        scheduler.add_stage("slow", slow)
+        scheduler.add_stage("failing", failing)
+        st = time.time()
+        with self.assertRaisesRegex(RuntimeError, "Stage failing failed"):
+            scheduler.run(make_network())
+        self.assertTrue(time.time() - st < 30)
+        self.assertNoChildren()
+
+    def assertNoChildren(self):
+        # the workers left running were terminated and joined, no zombie is left to reap
+        self.assertRaises(ChildProcessError, os.waitpid, -1, os.WNOHANG)
+
+    def test_unknown_dependency(self):
+        scheduler = StageScheduler()
+        self.assertRaises(ValueError, scheduler.add_stage, "pkfk", pkfk, ["content_sim"])
+
+    def test_metrics(self):
+        events = []
+        metrics = buildmetrics.BuildMetrics(progress=lambda event, name, record: events.append((event, name)))
+        scheduler = StageScheduler(workers=2, metrics=metrics)
+        scheduler.add_stage("content_sim", content_sim)
+        scheduler.add_stage("pkfk", pkfk, deps=["content_sim"])
+        scheduler.run(make_network())
+        self.assertEqual(events, [('start', 'content_sim'), ('done', 'content_sim'),
+                                  ('start', 'pkfk'), ('done', 'pkfk')])
+        record = metrics.stages["content_sim"]
+        self.assertEqual(record.rows_pulled, 3)
+        self.assertEqual(record.edges, {"CONTENT_SIM": 1})
+        self.assertEqual([step[0] for step in record.steps], ["pull"])
+        self.assertTrue(record.peak_rss_kb > 0)
+
+        path = tempfile.mkdtemp()
+        try:
+            metrics.write_report(path)
+            with open(path + "/build_metrics.json") as f:
+                report = json.load(f)
+            self.assertEqual([s["stage"] for s in report["stages"]], ["content_sim", "pkfk"])
+            with open(path + "/build_metrics.csv") as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(rows[0], ["stage", "step", "wall_time", "cpu_time", "peak_rss_kb", "rows_pulled",
+                                       "CONTENT_SIM", "PKFK"])
+            self.assertEqual(len(rows), 4)
+        finally:
+            shutil.rmtree(path)
+
+    def test_peak_rss_per_stage(self):
+        with buildmetrics.record_stage("large") as large:
+            block = bytearray(200 * 1024 * 1024)
+            del block
+        with buildmetrics.record_stage("small") as small:
+            pass
+        if small.peak_rss_lifetime:
+            self.skipTest("the peak RSS cannot be reset on this platform")
+        self.assertTrue(large.peak_rss_kb - small.peak_rss_kb > 100 * 1024)
+
+
+def fail(network):
+    raise Exception("Stage should have been loaded from the checkpoint")
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_resume(self):
+        scheduler = StageScheduler(checkpoint=Checkpoint(self.path))
+        scheduler.add_stage("content_sim", content_sim)
+        scheduler.add_stage("schema_sim", fail)
+        self.assertRaises(Exception, scheduler.run, make_network())
+
+        network = make_network()
+        scheduler = StageScheduler(checkpoint=Checkpoint(self.path, resume=True))
+        scheduler.add_stage("content_sim", fail)
+        scheduler.add_stage("schema_sim", schema_sim)
+        scheduler.add_stage("pkfk", pkfk, deps=["content_sim"])
+        results = scheduler.run(network)
+        self.assertEqual(results["content_sim"], "content_sim index")
+        self.assertEqual([h.nid for h in network.neighbors_id('1', Relation.PKFK)], ['2'])
+        self.assertEqual([h.score for h in network.neighbors_id('1', Relation.CONTENT_SIM)], [0.9])
+
+    def test_signatures_round_trip(self):
+        checkpoint = Checkpoint(self.path)
+        fields = [('1', 'db', 'a', 'x', 10, 10, 'T'), ('2', 'db', 'b', 'y', 0, 0, 'N')]
+        id_sig = [('2', (5, 1, 0, 10)), ('3', (2.5, 0.5, float('-inf'), 7))]
+        mh_signatures = [('1', [1, 2 ** 32 - 1, 3])]
+        checkpoint.save_fields("fields", fields)
+        checkpoint.save_num_signatures("num", id_sig)
+        checkpoint.save_mh_signatures("mh", mh_signatures)
+        self.assertEqual(checkpoint.load_fields("fields"), fields)
+        loaded = checkpoint.load_num_signatures("num")
+        self.assertEqual(loaded, id_sig)
+        self.assertEqual([type(v) for v in loaded[0][1]], [int] * 4)
+        self.assertEqual(checkpoint.load_mh_signatures("mh"), mh_signatures)
+        self.assertFalse(Checkpoint(self.path).has("fields"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import random
+import shutil
+import tempfile
+import unittest
+
+import networkx as nx
+
+from api.apiutils import Relation
+from knowledgerepr import fieldnetwork
+from knowledgerepr.csrnetwork import CSRFieldNetwork
+from knowledgerepr.testutils import make_network, edges_of
+
+
+class TestCSRFieldNetwork(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(7)
+        fields = [(str(100 + i), 'db', 't' + str(i % 6), 'f' + str(i), 10, rnd.randint(0, 10), 'T')
+                  for i in range(40)]
+        fields.append(('99', 'db', 't0', 'empty', 0, 0, 'N'))  # no cardinality
+        self.network = make_network(fields)
+        for _ in range(300):
+            src, tgt = rnd.choice(fields)[0], rnd.choice(fields)[0]
+            relation = rnd.choice([Relation.CONTENT_SIM, Relation.SCHEMA_SIM, Relation.PKFK])
+            self.network.add_relation(src, tgt, relation, rnd.random())
+        self.csr = CSRFieldNetwork.from_field_network(self.network)
+
+    def test_same_answers(self):
+        for nid in self.network.iterate_ids():
+            self.assertEqual(self.network.get_cardinality_of(nid), self.csr.get_cardinality_of(nid))
+            for relation in [Relation.CONTENT_SIM, Relation.SCHEMA_SIM, Relation.PKFK, Relation.ENTITY_SIM]:
+                expected = {h.nid: h.score for h in self.network.neighbors_id(nid, relation)}
+                found = {h.nid: h.score for h in self.csr.neighbors_id(nid, relation)}
+                self.assertEqual(set(expected.keys()), set(found.keys()))
+                for k, score in expected.items():
+                    self.assertAlmostEqual(score, found[k], places=6)
+        for relation in [Relation.CONTENT_SIM, Relation.PKFK]:
+            expected = set(frozenset((a.nid, b.nid)) for a, b in self.network.enumerate_relation(relation, False))
+            found = [frozenset((a.nid, b.nid)) for a, b in self.csr.enumerate_relation(relation, False)]
+            self.assertEqual(len(found), len(set(found)))
+            self.assertEqual(expected, set(found))
+            self.assertEqual(len(edges_of(self.network, relation)), self.network.relation_count(relation))
+            self.assertEqual(len(found), self.csr.relation_count(relation))
+            edges = [frozenset((a, b)) for a, b, _ in self.csr.iterate_edges(relation, block_rows=7)]
+            self.assertEqual(len(edges), len(set(edges)))
+            self.assertEqual(set(edges_of(self.network, relation).keys()), set(edges))
+        self.assertEqual(sorted(d for _, d in self.network.fields_degree(10)),
+                         sorted(d for _, d in self.csr.fields_degree(10)))
+        self.assertEqual(self.network.get_info_for(['100', '99']), self.csr.get_info_for(['100', '99']))
+
+    def test_neighbors_batch(self):
+        nids = ['100', '99', '120', '100']
+        for relation in [Relation.CONTENT_SIM, Relation.PKFK, Relation.ENTITY_SIM]:
+            expected = sorted(zip(*[a.tolist() for a in self.network.neighbors_batch(nids, relation)]))
+            found = sorted(zip(*[a.tolist() for a in self.csr.neighbors_batch(nids, relation)]))
+            self.assertEqual([(s, d) for s, d, _ in expected], [(s, d) for s, d, _ in found])
+            for (_, _, score1), (_, _, score2) in zip(expected, found):
+                self.assertAlmostEqual(score1, score2, places=6)
+
+    def test_find_path_hit(self):
+        G = nx.Graph()
+        for src, tgt, relation, data in self.network._get_underlying_repr_graph().edges(keys=True, data=True):
+            if relation == Relation.PKFK:
+                G.add_edge(src, tgt, score=data['score'])
+        nids = list(self.network.iterate_ids())
+        for source, target in [(nids[i], nids[-1 - i]) for i in range(15)]:
+            try:
+                expected = set(tuple(p) for p in nx.all_shortest_paths(G, source, target))
+            except (nx.NetworkXNoPath, KeyError):
+                expected = set()
+            for network in [self.network, self.csr]:
+                paths = network.shortest_paths(source, target, Relation.PKFK, max_hops=10, k=1000)
+                self.assertEqual(expected, set(tuple(n for n, _ in p) for p in paths))
+                for path in paths:
+                    for (prev, _), (n, score) in zip(path, path[1:]):
+                        self.assertAlmostEqual(G[prev][n]['score'], score, places=6)
+                if len(expected) > 0:
+                    length = len(next(iter(expected))) - 1
+                    self.assertEqual([], network.shortest_paths(source, target, Relation.PKFK, max_hops=length - 1))
+                    drs = network.find_path_hit(source, target, Relation.PKFK, max_hops=length, k=2)
+                    self.assertEqual([target], [h.nid for h in drs.data])
+                    self.assertEqual(len(drs.paths()), min(2, len(expected)))
+
+    def test_deserialize(self):
+        path = tempfile.mkdtemp()
+        try:
+            fieldnetwork.serialize_network(self.network, path, model_format='pickle')
+            csr = fieldnetwork.deserialize_network(path + '/', backend='csr')
+            self.assertIsInstance(csr, CSRFieldNetwork)
+            G = self.csr._get_underlying_repr_graph()
+            self.assertEqual(G.number_of_edges(), self.network._get_underlying_repr_graph().number_of_edges())
+            for relation in [Relation.CONTENT_SIM, Relation.PKFK]:
+                self.assertEqual(set(edges_of(self.network, relation).keys()), set(edges_of(csr, relation).keys()))
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from api.apiutils import Relation
+from knowledgerepr.EKGapi import BackEndType
+from knowledgerepr.EKGapi import EKGapi
+from knowledgerepr.testutils import edges_of
+from knowledgerepr.testutils import random_network
+
+
+class Config:
+
+    def __init__(self, gindex_library):
+        self.gindex_library = gindex_library
+
+
+class TestGIndexEKG(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = tempfile.mkdtemp()
+        cls.library = os.path.join(cls.path, "graph_index.so")
+        source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "GraphIndex.cpp")
+        try:
+            subprocess.check_call(["g++", "-std=c++11", "-O2", "-shared", "-fPIC", "-o", cls.library, source])
+        except (OSError, subprocess.CalledProcessError):
+            shutil.rmtree(cls.path)
+            raise unittest.SkipTest("Cannot compile GraphIndex.cpp")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+
+    def setUp(self):
+        from knowledgerepr.gindexekg import GIndexEKG
+        # the index does not keep self loops
+        self.network, _ = random_network(5, 40, 150, [Relation.CONTENT_SIM, Relation.SCHEMA_SIM, Relation.PKFK],
+                                         self_loops=False)
+        self.ekg = GIndexEKG.from_field_network(self.network, Config(self.library))
+
+    def test_same_answers(self):
+        for nid in self.network.iterate_ids():
+            for relation in [Relation.CONTENT_SIM, Relation.SCHEMA_SIM, Relation.PKFK, Relation.SCHEMA]:
+                expected = {h.nid: h.score for h in self.network.neighbors_id(nid, relation)}
+                found = {h.nid: h.score for h in self.ekg.neighbors_id(nid, relation)}
+                self.assertEqual(set(expected.keys()), set(found.keys()))
+                for k, score in expected.items():
+                    self.assertAlmostEqual(score, found[k], places=6)
+        for relation in [Relation.CONTENT_SIM, Relation.PKFK]:
+            found = [frozenset((a.nid, b.nid)) for a, b in self.ekg.enumerate_edges_of_type(relation)]
+            self.assertEqual(set(edges_of(self.network, relation).keys()), set(found))
+        self.assertEqual([d for _, d in self.network.fields_degree(10)],
+                         [d for _, d in self.ekg.topk_nodes_by_degree(10)])
+
+    def test_find_path_hit(self):
+        nids = list(self.network.iterate_ids())
+        found = 0
+        for source, target in zip(nids, reversed(nids)):
+            for max_hops in [1, 2, 3]:
+                expected = self.network.find_path_hit(source, target, Relation.PKFK, max_hops=max_hops, k=100)
+                result = self.ekg.find_path_hit(source, target, Relation.PKFK, max_hops=max_hops, k=100)
+                expected_paths = set(tuple(h.nid for h in p) for p in expected.paths())
+                result_paths = set(tuple(h.nid for h in p) for p in result.paths())
+                self.assertEqual(expected_paths, result_paths)
+                found += len(result_paths)
+        self.assertTrue(found > 0)
+
+    def test_ekgapi(self):
+        api = EKGapi(BackEndType.G_INDEX, Config(self.library))
+        api.init([('1', 'db', 'a', 'id', 10, 10, 'N'), ('2', 'db', 'b', 'a_id', 10, 5, 'N')])
+        api.add_edge('1', '2', Relation.PKFK, 0.9)
+        api.add_edge('2', '1', Relation.PKFK, 0.8)  # the last score of an edge wins
+        self.assertEqual([(h.nid, round(h.score, 6)) for h in api.neighbors_id('1', Relation.PKFK)], [('2', 0.8)])
+        self.assertEqual([h.nid for h in api.find_path_hit('1', '2', Relation.PKFK)], ['2'])
+        self.assertEqual(api.topk_nodes_by_degree(1), [('1', 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
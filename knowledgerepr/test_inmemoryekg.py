@@ -0,0 +1,76 @@
+import shutil
+import tempfile
+import unittest
+
+from api.apiutils import Relation
+from knowledgerepr.EKGapi import BackEndType
+from knowledgerepr.EKGapi import EKGapi
+from knowledgerepr.inmemoryekg import InMemoryEKG
+from knowledgerepr.testutils import edges_of
+from knowledgerepr.testutils import random_network
+
+
+class TestInMemoryEKG(unittest.TestCase):
+
+    relations = [Relation.CONTENT_SIM, Relation.SCHEMA_SIM, Relation.PKFK, Relation.INCLUSION_DEPENDENCY,
+                 Relation.MEANS_SAME]
+
+    def setUp(self):
+        # the lite graph does not keep self loops
+        self.network, _ = random_network(3, 40, 200, self.relations, random_cardinality=True, self_loops=False)
+        self.ekg = InMemoryEKG.from_field_network(self.network)
+
+    def assert_same_answers(self, ekg):
+        for nid in self.network.iterate_ids():
+            self.assertEqual(self.network.get_cardinality_of(nid), ekg.get_cardinality_of(nid))
+            for relation in self.relations + [Relation.ENTITY_SIM]:
+                expected = {h.nid: h.score for h in self.network.neighbors_id(nid, relation)}
+                found = {h.nid: h.score for h in ekg.neighbors_id(nid, relation)}
+                self.assertEqual(set(expected.keys()), set(found.keys()))
+                for k, score in expected.items():
+                    self.assertAlmostEqual(score, found[k], places=6)
+        for relation in self.relations:
+            found = [frozenset((a.nid, b.nid)) for a, b in ekg.enumerate_edges_of_type(relation)]
+            self.assertEqual(len(found), len(set(found)))
+            self.assertEqual(set(edges_of(self.network, relation).keys()), set(found))
+            self.assertEqual(len(found), ekg.relation_count(relation))
+        self.assertEqual([d for _, d in self.network.fields_degree(10)],
+                         [d for _, d in ekg.topk_nodes_by_degree(10)])
+
+    def test_same_answers(self):
+        self.assert_same_answers(self.ekg)
+
+    def test_find_path_hit(self):
+        nids = list(self.network.iterate_ids())
+        found = 0
+        for source, target in zip(nids, reversed(nids)):
+            for max_hops in [1, 2, 3]:
+                expected = self.network.find_path_hit(source, target, Relation.PKFK, max_hops=max_hops, k=100)
+                result = self.ekg.find_path_hit(source, target, Relation.PKFK, max_hops=max_hops, k=100)
+                self.assertEqual(set(tuple(h.nid for h in p) for p in expected.paths()),
+                                 set(tuple(h.nid for h in p) for p in result.paths()))
+                found += len(list(result.paths()))
+        self.assertTrue(found > 0)
+
+    def test_serialize(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.ekg.serialize(path)
+            loaded = InMemoryEKG.deserialize(path)
+            self.assert_same_answers(loaded)
+            self.assertEqual(dict(self.network._get_underlying_repr_table_to_ids()), dict(loaded._source_ids))
+        finally:
+            shutil.rmtree(path)
+
+    def test_ekgapi(self):
+        api = EKGapi(BackEndType.IN_MEMORY)
+        api.init([('1', 'db', 'a', 'id', 10, 10, 'N'), ('2', 'db', 'b', 'a_id', 10, 5, 'N')])
+        api.add_edge('1', '2', Relation.PKFK, 0.5)
+        api.add_edge('1', '2', Relation.CONTENT_SIM, 0.25)
+        self.assertEqual([(h.nid, h.score) for h in api.neighbors_id('1', Relation.PKFK)], [('2', 0.5)])
+        self.assertEqual([(h.nid, h.score) for h in api.neighbors_id('2', Relation.CONTENT_SIM)], [('1', 0.25)])
+        self.assertEqual(api.topk_nodes_by_degree(1), [('1', 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
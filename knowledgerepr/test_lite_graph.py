@@ -1,5 +1,5 @@
 from knowledgerepr.lite_graph import LiteGraph
-from knowledgerepr.lite_graph import EdgeType
+from api.apiutils import Relation
 import time
 
 if __name__ == "__main__":
@@ -15,17 +15,17 @@ if __name__ == "__main__":
     for i in range(num_nodes):
         for j in range(num_nodes):
             if i != j:
-                g.add_undirected_edge(i, j, EdgeType.SCHEMA_SIM)
+                g.add_undirected_edge(i, j, Relation.SCHEMA_SIM)
 
     for i in range(num_nodes):
         for j in range(num_nodes):
             if i != j:
-                g.add_undirected_edge(i, j, EdgeType.CONTENT_SIM)
+                g.add_undirected_edge(i, j, Relation.CONTENT_SIM)
 
     for i in range(num_nodes):
         for j in range(num_nodes):
             if i != j:
-                g.add_undirected_edge(i, j, EdgeType.PKFK)
+                g.add_undirected_edge(i, j, Relation.PKFK)
 
     print("Nodes: " + str(g._node_count))
     print("Edges: " + str(g._edge_count))
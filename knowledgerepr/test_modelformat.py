@@ -0,0 +1,112 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from api.apiutils import Relation
+from knowledgerepr import buildmetrics
+from knowledgerepr import fieldnetwork
+from knowledgerepr import modelformat
+from knowledgerepr.csrnetwork import CSRFieldNetwork
+from knowledgerepr.csrnetwork import NidKeys
+from knowledgerepr.csrnetwork import NidList
+from knowledgerepr.testutils import make_network, edges_of
+
+
+class TestModelFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        rnd = random.Random(2)
+        fields = [(str(100 + i), 'db' + str(i % 2), 'tábla' + str(i % 5), 'f' + str(i), 10, rnd.randint(0, 10),
+                   rnd.choice(['N', 'T'])) for i in range(30)]
+        self.network = make_network(fields)
+        for _ in range(200):
+            src, tgt = rnd.choice(fields)[0], rnd.choice(fields)[0]
+            relation = rnd.choice([Relation.CONTENT_SIM, Relation.SCHEMA_SIM, Relation.PKFK])
+            self.network.add_relation(src, tgt, relation, rnd.random())
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def assert_same_network(self, loaded):
+        self.assertEqual(self.network._get_underlying_repr_id_to_field_info(),
+                         loaded._get_underlying_repr_id_to_field_info())
+        self.assertEqual(dict(self.network._get_underlying_repr_table_to_ids()),
+                         dict(loaded._get_underlying_repr_table_to_ids()))
+        for nid in self.network.iterate_ids():
+            self.assertEqual(self.network.get_cardinality_of(nid), loaded.get_cardinality_of(nid))
+        for relation in [Relation.CONTENT_SIM, Relation.SCHEMA_SIM, Relation.PKFK]:
+            expected = edges_of(self.network, relation)
+            found = edges_of(loaded, relation)
+            self.assertEqual(set(expected.keys()), set(found.keys()))
+            for pair, score in expected.items():
+                self.assertAlmostEqual(score, found[pair], places=6)
+            self.assertEqual(len(expected), loaded.relation_count(relation))
+        self.assertEqual(sorted(d for _, d in self.network.fields_degree(30)),
+                         sorted(d for _, d in loaded.fields_degree(30)))
+        for nid in ['100', '107', '129']:
+            self.assertEqual(sorted(self.network.neighbors_id(nid, Relation.CONTENT_SIM).data),
+                             sorted(loaded.neighbors_id(nid, Relation.CONTENT_SIM).data))
+
+    def test_round_trip(self):
+        fieldnetwork.serialize_network(self.network, self.path)
+        self.assertTrue(modelformat.has_model(self.path))
+        self.assertFalse(os.path.exists(self.path + "/graph.pickle"))
+        metrics = buildmetrics.BuildMetrics()
+        csr = fieldnetwork.deserialize_network(self.path + '/', backend='csr', metrics=metrics)
+        self.assertIsInstance(csr, CSRFieldNetwork)
+        self.assert_same_network(csr)
+        self.assertEqual(metrics.stages["load_nodes"].rows_pulled, 30)
+        metrics = buildmetrics.BuildMetrics()
+        nx_network = fieldnetwork.deserialize_network(self.path + '/', metrics=metrics)
+        self.assertNotIsInstance(nx_network, CSRFieldNetwork)
+        self.assert_same_network(nx_network)
+        self.assertEqual(sum(metrics.stages["load_edges"].edges.values()),
+                         sum(len(edges_of(self.network, r)) for r in [Relation.CONTENT_SIM, Relation.SCHEMA_SIM,
+                                                                      Relation.PKFK]))
+
+    def test_mmap(self):
+        fieldnetwork.serialize_network(self.network, self.path)
+        csr = fieldnetwork.deserialize_network(self.path + '/', backend='csr', mmap=True)
+        adjacency = csr._adjacency[Relation.PKFK]
+        self.assertIsInstance(adjacency.indices, np.memmap)
+        self.assertFalse(adjacency.scores.flags.writeable)
+        # nids and the meta schema are read from the mapped arrays, not from per-process lists and dicts
+        self.assertIsInstance(csr._nids, NidKeys)
+        self.assertIsInstance(csr._nids.sorted_keys, np.memmap)
+        id_names = csr._get_underlying_repr_id_to_field_info()
+        self.assertIsInstance(id_names, modelformat.MappedFieldInfo)
+        self.assertIsInstance(id_names.strings.buffer, np.memmap)
+        self.assertIsInstance(id_names.source_fields, np.memmap)
+        self.assert_same_network(csr)
+        self.assertNotIn('99', id_names)
+        self.assertEqual(csr.get_fields_of_source('missing'), [])
+        with self.assertRaises(ValueError):
+            fieldnetwork.deserialize_network(self.path + '/', mmap=True)
+
+    def test_nids_without_keys(self):
+        # models written before the nid keys, as models with non numerical nids, are read into lists and dicts
+        fieldnetwork.serialize_network(self.network, self.path)
+        for name in ['node_key', 'node_sorted_key', 'node_sorted_id', 'source_names', 'source_indptr',
+                     'source_fields']:
+            os.remove(os.path.join(self.path, modelformat.MODEL_DIR, name + ".npy"))
+        csr = fieldnetwork.deserialize_network(self.path + '/', backend='csr', mmap=True)
+        self.assertIsInstance(csr._nids, NidList)
+        self.assert_same_network(csr)
+
+    def test_convert_pickle_model(self):
+        fieldnetwork.serialize_network(self.network, self.path, model_format='pickle')
+        self.assertFalse(modelformat.has_model(self.path))
+        with self.assertRaises(ValueError):
+            fieldnetwork.deserialize_network(self.path + '/', backend='csr', mmap=True)
+        modelformat.convert_pickle_model(self.path)
+        self.assertTrue(modelformat.has_model(self.path))
+        self.assert_same_network(fieldnetwork.deserialize_network(self.path + '/', backend='csr'))
+
+
+if __name__ == "__main__":
+    unittest.main()
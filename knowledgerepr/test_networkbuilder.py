@@ -0,0 +1,277 @@
+import random
+import unittest
+
+import numpy as np
+from datasketch import MinHash
+
+from api.apiutils import Relation
+from dataanalysis import dataanalysis as da
+from knowledgerepr import networkbuilder
+from knowledgerepr.testutils import make_network, edges_of
+
+
+class TestSchemaSimSparse(unittest.TestCase):
+
+    fields = [('1', 'db', 'employees', 'employee_id', 10, 10, 'N'),
+              ('2', 'db', 'salaries', 'employee_id', 10, 5, 'N'),
+              ('3', 'db', 'employees', 'first_name', 10, 8, 'T'),
+              ('4', 'db', 'students', 'first_name', 10, 9, 'T'),
+              ('5', 'db', 'students', 'student_id', 10, 10, 'N')]
+
+    def test_same_name_fields_are_connected(self):
+        network = make_network(self.fields)
+        networkbuilder.build_schema_sim_relation_sparse(network, projection_count=8)
+        edges = edges_of(network, Relation.SCHEMA_SIM)
+        self.assertIn(frozenset(('1', '2')), edges)
+        self.assertIn(frozenset(('3', '4')), edges)
+        self.assertAlmostEqual(edges[frozenset(('1', '2'))], 0.0)
+        for pair in edges.keys():
+            self.assertEqual(len(pair), 2)  # no self loops
+
+    def test_index_query(self):
+        network = make_network(self.fields)
+        index = networkbuilder.build_schema_sim_relation_sparse(network, projection_count=8)
+        row = index.keys.index('3')
+        res = index.query(index.matrix[row].toarray()[0])
+        keys = [key for _, key, _ in res]
+        self.assertIn('3', keys)
+        self.assertIn('4', keys)
+        self.assertTrue(np.all(np.diff([distance for _, _, distance in res]) >= -1e-12))
+
+    def test_same_edges_as_build_schema_sim_relation(self):
+        # same seed, so both builders draw the same hyperplanes and put the same fields in each bucket
+        rnd = random.Random(5)
+        words = ['w' + str(i) for i in range(60)]
+        # near-duplicate names, a few words away from one of 10 templates, so buckets hold distinct names and some
+        # hold more than max_neighbours fields
+        templates = [rnd.sample(words, 12) for _ in range(10)]
+        names = [' '.join(w if rnd.random() > 0.05 else rnd.choice(words) for w in templates[i % 10])
+                 for i in range(150)]
+        fields = [(str(100 + i), 'db', 't' + str(i % 15), names[i], 10, 5, 'T') for i in range(150)]
+        network = make_network(fields)
+        networkbuilder.build_schema_sim_relation(network, rand_seed=19)
+        expected = edges_of(network, Relation.SCHEMA_SIM)
+        network = make_network(fields)
+        networkbuilder.build_schema_sim_relation_sparse(network, rand_seed=19)
+        edges = edges_of(network, Relation.SCHEMA_SIM)
+        self.assertTrue(any(score > 0.01 for score in expected.values()))
+        self.assertEqual(set(edges.keys()), set(expected.keys()))
+        for pair, score in expected.items():
+            self.assertAlmostEqual(edges[pair], score)
+
+    def test_index_keeps_its_vectorizer(self):
+        network = make_network(self.fields)
+        index = networkbuilder.build_schema_sim_relation_sparse(network, projection_count=8)
+        vocabulary = dict(index.vectorizer.vocabulary_)
+        # a later TF-IDF in the same process refits the shared vectorizer of dataanalysis
+        da.get_tfidf_docs(['unrelated_column', 'another_one'])
+        self.assertEqual(index.vectorizer.vocabulary_, vocabulary)
+
+
+class TestEntitySimSparse(unittest.TestCase):
+
+    def test_topk_equals_brute_force(self):
+        rnd = random.Random(11)
+        vocabulary = ['person', 'location', 'organization', 'date', 'money', 'percent', 'time', 'product']
+        fields = [(str(i), 'db', 't' + str(i % 7), 'f' + str(i), 10, 5, 'T') for i in range(60)]
+        entities = [' '.join(rnd.sample(vocabulary, rnd.randint(1, 3))) for _ in range(55)] + [''] * 5
+        network = make_network(fields)
+        networkbuilder.build_entity_sim_relation_sparse(network, [f[:3] for f in fields], entities,
+                                                        topk=4, max_nnz=200)
+
+        vect = networkbuilder.TfidfVectorizer(min_df=1, sublinear_tf=True, use_idf=True)
+        m = networkbuilder.normalize(vect.fit_transform(entities[:55])).toarray()
+        sims = m.dot(m.T)
+        expected = dict()
+        for row in range(55):
+            order = [col for col in np.lexsort((np.arange(55), -sims[row])) if col != row and sims[row, col] > 0]
+            for col in order[:4]:
+                expected[frozenset((str(row), str(col)))] = 1.0 - sims[row, col]
+        edges = edges_of(network, Relation.ENTITY_SIM)
+        self.assertEqual(set(expected.keys()), set(edges.keys()))
+        for pair, score in edges.items():
+            self.assertAlmostEqual(score, expected[pair])
+
+    def test_blocks_by_nnz(self):
+        row_nnz = np.asarray([3, 3, 3, 10, 1, 1])
+        self.assertEqual(list(networkbuilder.blocks_by_nnz(row_nnz, 6)), [(0, 2), (2, 3), (3, 4), (4, 6)])
+        rnd = np.random.RandomState(3)
+        row_nnz = rnd.randint(0, 20, size=500)
+        blocks = list(networkbuilder.blocks_by_nnz(row_nnz, 50))
+        self.assertEqual([start for start, _ in blocks[1:]], [end for _, end in blocks[:-1]])
+        self.assertEqual((blocks[0][0], blocks[-1][1]), (0, 500))
+        for start, end in blocks:
+            # as many rows as fit, and at least one
+            self.assertTrue(end - start == 1 or row_nnz[start:end].sum() <= 50)
+            self.assertTrue(end == 500 or row_nnz[start:end + 1].sum() > 50)
+
+    def test_top_k_by_value(self):
+        cols = np.asarray([5, 1, 4, 2, 3])
+        values = np.asarray([0.5, 0.9, 0.5, 0.1, 0.5])
+        self.assertEqual(cols[networkbuilder.top_k_by_value(cols, values, 3)].tolist(), [1, 3, 4])
+
+
+class TestNumOverlapIndexed(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(7)
+        self.fields = []
+        self.id_sig = []
+        for i in range(300):
+            nid = str(1000 + i)
+            self.fields.append((nid, 'db', 't' + str(i % 20), 'f' + str(i), 10, 5, 'N'))
+            if i % 3 == 0:
+                median, iqr = rnd.randint(0, 50), rnd.randint(0, 10)
+                sig = (median, iqr, rnd.randint(-5, median), rnd.randint(median, 100))
+            elif i % 3 == 1:
+                median, iqr = rnd.uniform(0, 50), rnd.uniform(0, 10)
+                sig = (median, iqr, rnd.uniform(-5, median), rnd.uniform(median, 100))
+            else:
+                median = rnd.randint(0, 5)
+                sig = (median, 0, 0, median)
+            self.id_sig.append((nid, sig))
+
+    def test_same_edges_as_nested_loop(self):
+        network = make_network(self.fields)
+        networkbuilder.build_content_sim_relation_num_overlap_distr(network, self.id_sig)
+        indexed_network = make_network(self.fields)
+        networkbuilder.build_content_sim_relation_num_overlap_distr_indexed(indexed_network, self.id_sig,
+                                                                            chunk_size=500)
+        for relation in [Relation.CONTENT_SIM, Relation.INCLUSION_DEPENDENCY]:
+            expected = edges_of(network, relation)
+            actual = edges_of(indexed_network, relation)
+            self.assertTrue(len(expected) > 0)
+            self.assertEqual(set(expected.keys()), set(actual.keys()))
+            for pair, score in expected.items():
+                self.assertAlmostEqual(score, actual[pair])
+
+
+class TestContentSimMinHashMatrix(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(3)
+        base = [set(rnd.sample(range(10000), 100)) for _ in range(15)]
+        self.fields = []
+        self.mh_signatures = []
+        for i in range(300):
+            values = set(v for v in base[i % 15] if rnd.random() < 0.9) | set(rnd.sample(range(10000), 20))
+            mh = MinHash(num_perm=512)
+            for v in values:
+                mh.update(str(v).encode('utf8'))
+            nid = str(1000 + i)
+            self.fields.append((nid, 'db', 't' + str(i % 20), 'f' + str(i), 10, 5, 'T'))
+            self.mh_signatures.append((nid, [int(v) for v in mh.hashvalues]))
+
+    def test_same_edges_as_minhash_lsh(self):
+        network = make_network(self.fields)
+        networkbuilder.build_content_sim_mh_text(network, self.mh_signatures)
+        matrix_network = make_network(self.fields)
+        index = networkbuilder.build_content_sim_mh_text_matrix(matrix_network, self.mh_signatures)
+        expected = edges_of(network, Relation.CONTENT_SIM)
+        self.assertTrue(len(expected) > 0)
+        self.assertEqual(expected, edges_of(matrix_network, Relation.CONTENT_SIM))
+
+        nid, mh_sig = self.mh_signatures[0]
+        mh = MinHash(num_perm=512)
+        mh.hashvalues = np.asarray(mh_sig, dtype=int)
+        neighbours = set([nid] + [other for pair in expected.keys() if nid in pair for other in pair])
+        self.assertEqual(set(index.query(mh)), neighbours)
+
+
+class MixedNetworkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(11)
+        base = [set(rnd.sample(range(10000), 100)) for _ in range(10)]
+        self.fields = []
+        self.mh_signatures = []
+        self.id_sig = []
+        for i in range(200):
+            nid = str(1000 + i)
+            if i % 2 == 0:
+                values = set(v for v in base[i % 10] if rnd.random() < 0.9) | set(rnd.sample(range(10000), 20))
+                mh = MinHash(num_perm=512)
+                for v in values:
+                    mh.update(str(v).encode('utf8'))
+                self.mh_signatures.append((nid, [int(v) for v in mh.hashvalues]))
+                self.fields.append((nid, 'db', 't' + str(i % 20), 'name' + str(i % 7), 10, rnd.randint(5, 10), 'T'))
+            else:
+                median, iqr = rnd.randint(0, 50), rnd.randint(0, 10)
+                self.id_sig.append((nid, (median, iqr, rnd.randint(0, median), rnd.randint(median, 100))))
+                self.fields.append((nid, 'db', 't' + str(i % 20), 'id' + str(i % 5), 10, rnd.randint(5, 10), 'N'))
+        words = ['person', 'city', 'country', 'company', 'drug', 'gene', 'protein', 'disease']
+        self.entities = [' '.join(rnd.sample(words, rnd.randint(0, 3))) for _ in self.fields]
+
+    def build(self, nids):
+        network = make_network([f for f in self.fields if f[0] in nids])
+        schema_index = networkbuilder.build_schema_sim_relation_sparse(network)
+        content_index = networkbuilder.build_content_sim_mh_text_matrix(
+            network, [s for s in self.mh_signatures if s[0] in nids])
+        networkbuilder.build_content_sim_relation_num_overlap_distr_indexed(
+            network, [s for s in self.id_sig if s[0] in nids])
+        networkbuilder.build_pkfk_relation(network)
+        entity_fields, entities = self.entities_of(nids)
+        networkbuilder.build_entity_sim_relation_sparse(network, entity_fields, entities)
+        return network, schema_index, content_index
+
+    def entities_of(self, nids):
+        pairs = [((f[0], f[2], f[3]), e) for f, e in zip(self.fields, self.entities) if f[0] in nids]
+        return [f for f, _ in pairs], [e for _, e in pairs]
+
+
+class TestIncrementalUpdate(MixedNetworkTestCase):
+
+    def test_update_matches_full_build(self):
+        all_nids = set(f[0] for f in self.fields)
+        old_nids = set(list(sorted(all_nids))[:170])
+        removed = set(list(sorted(old_nids))[:10])
+        added = all_nids - old_nids
+        network, schema_index, content_index = self.build(old_nids)
+
+        for nid in removed:
+            network.remove_field(nid)
+        network.init_meta_schema([f for f in self.fields if f[0] in added])
+        networkbuilder.update_schema_sim_relation_sparse(network, schema_index, added, removed)
+        networkbuilder.update_content_sim_mh_text_matrix(
+            network, content_index, [s for s in self.mh_signatures if s[0] in added], removed)
+        networkbuilder.build_content_sim_relation_num_overlap_distr_indexed(
+            network, [s for s in self.id_sig if s[0] not in removed], nids=added)
+        networkbuilder.update_pkfk_relation(network, added)
+        entity_fields, entities = self.entities_of(all_nids - removed)
+        networkbuilder.update_entity_sim_relation_sparse(network, entity_fields, entities)
+
+        full_network, _, _ = self.build(all_nids - removed)
+        self.assertEqual(network.graph_order(), full_network.graph_order())
+        for relation in [Relation.CONTENT_SIM, Relation.INCLUSION_DEPENDENCY, Relation.PKFK]:
+            expected = edges_of(full_network, relation)
+            self.assertTrue(len(expected) > 0)
+            self.assertEqual(set(expected.keys()), set(edges_of(network, relation).keys()))
+        expected = edges_of(full_network, Relation.ENTITY_SIM)
+        self.assertTrue(len(expected) > 0)
+        entity_sim = edges_of(network, Relation.ENTITY_SIM)
+        self.assertEqual(set(expected.keys()), set(entity_sim.keys()))
+        for pair, score in expected.items():
+            self.assertAlmostEqual(entity_sim[pair], score)
+        schema_sim = edges_of(network, Relation.SCHEMA_SIM)
+        for nid in added:
+            self.assertTrue(any(nid in pair for pair in schema_sim.keys()))
+        self.assertFalse(any(nid in pair for pair in schema_sim.keys() for nid in removed))
+
+
+class TestPKFKVectorized(MixedNetworkTestCase):
+
+    def test_same_edges_as_build_pkfk_relation(self):
+        network, _, _ = self.build(set(f[0] for f in self.fields))
+        expected = edges_of(network, Relation.PKFK)
+        self.assertTrue(len(expected) > 0)
+        G = network._get_underlying_repr_graph()
+        G.remove_edges_from([(u, v, key) for u, v, key in G.edges(keys=True) if key == Relation.PKFK])
+        networkbuilder.build_pkfk_relation_vectorized(network)
+        actual = edges_of(network, Relation.PKFK)
+        self.assertEqual(set(expected.keys()), set(actual.keys()))
+        for pair, score in expected.items():
+            self.assertAlmostEqual(score, actual[pair])
+
+
+if __name__ == "__main__":
+    unittest.main()
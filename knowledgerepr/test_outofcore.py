@@ -0,0 +1,147 @@
+import json
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from datasketch import MinHash
+
+from api.apiutils import Relation
+from knowledgerepr import fieldnetwork
+from knowledgerepr import modelformat
+from knowledgerepr import networkbuilder
+from knowledgerepr import outofcore
+from knowledgerepr.csrnetwork import CSRFieldNetwork
+from knowledgerepr.tablegraph import TableJoinGraph
+from knowledgerepr.testutils import make_network, edges_of
+
+
+class TestEdgeSpill(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def assertSameEdges(self, expected, network, relation):
+        edges = {frozenset((src, tgt)): score for src, tgt, score in network.iterate_edges(relation)}
+        self.assertEqual(set(edges.keys()), set(expected.keys()))
+        for pair, score in expected.items():
+            self.assertAlmostEqual(edges[pair], score, places=6)
+
+    def test_assemble_keeps_last_score(self):
+        # numerical nids are looked up in sorted keys, others in a dict
+        for field_format in ['{}', 'f{}']:
+            rnd = random.Random(5)
+            fields = [(field_format.format(i), 'db', 't', 'f' + str(i), 10, 5, 'N') for i in range(50)]
+            network = make_network(fields)
+            spilled_network = make_network(fields)
+            spill = outofcore.EdgeSpill(self.path + "/spill" + field_format, spilled_network.iterate_ids(),
+                                        max_edges=37)
+            collector = outofcore.SpillingEdgeCollector(spilled_network, spill)
+            for i in range(1000):
+                src, tgt = [field_format.format(rnd.randint(0, 49)) for _ in range(2)]
+                relation = rnd.choice([Relation.CONTENT_SIM, Relation.INCLUSION_DEPENDENCY])
+                score = rnd.random()
+                network.add_relation(src, tgt, relation, score)
+                collector.add_relation(src, tgt, relation, score)
+            self.assertTrue(len(spill.runs[Relation.CONTENT_SIM]) > 1)
+            assembled = spill.assemble(spilled_network, block_edges=100)
+            self.assertEqual(len(spill.runs), 0)
+            # the same CSR layout as a network built in memory
+            expected = CSRFieldNetwork.from_field_network(network)
+            for relation in [Relation.CONTENT_SIM, Relation.INCLUSION_DEPENDENCY]:
+                self.assertSameEdges(edges_of(network, relation), assembled, relation)
+                self.assertEqual(assembled.relation_count(relation), network.relation_count(relation))
+                np.testing.assert_array_equal(assembled._adjacency[relation].indptr,
+                                              expected._adjacency[relation].indptr)
+                np.testing.assert_array_equal(assembled._adjacency[relation].indices,
+                                              expected._adjacency[relation].indices)
+            np.testing.assert_array_equal(assembled._degree, expected._degree)
+
+    def test_pkfk_and_model(self):
+        rnd = random.Random(9)
+        fields = [(str(100 + i), 'db', 't' + str(i % 7), 'f' + str(i), 10, rnd.randint(0, 10), 'NT'[i % 2])
+                  for i in range(80)]
+        network = make_network(fields)
+        spilled_network = make_network(fields)
+        spill = outofcore.EdgeSpill(self.path + "/spill", spilled_network.iterate_ids(), max_edges=50)
+        for _ in range(600):
+            src, tgt = rnd.choice(fields)[0], rnd.choice(fields)[0]
+            relation, score = rnd.choice([Relation.CONTENT_SIM, Relation.INCLUSION_DEPENDENCY]), rnd.random()
+            network.add_relation(src, tgt, relation, score)
+            spill.add(src, tgt, relation, score)
+        networkbuilder.build_pkfk_relation_vectorized(network)
+        network.set_table_join_graph(TableJoinGraph.from_network(network))
+
+        assembled = spill.assemble(spilled_network)
+        self.assertTrue(networkbuilder.build_pkfk_relation_csr(assembled, spill.add_dense, max_nnz=40) > 0)
+        assembled = spill.assemble(assembled)
+        assembled.set_table_join_graph(TableJoinGraph.from_network(assembled))
+        self.assertSameEdges(edges_of(network, Relation.PKFK), assembled, Relation.PKFK)
+
+        # both write the same model
+        fieldnetwork.serialize_network(network, self.path + "/expected")
+        fieldnetwork.serialize_network(assembled, self.path + "/model")
+        for name in sorted(os.listdir(self.path + "/expected/" + modelformat.MODEL_DIR)):
+            expected_file = os.path.join(self.path, "expected", modelformat.MODEL_DIR, name)
+            model_file = os.path.join(self.path, "model", modelformat.MODEL_DIR, name)
+            if name.endswith(".npy"):
+                np.testing.assert_allclose(np.load(model_file), np.load(expected_file), err_msg=name)
+            elif name == "format.json":
+                with open(model_file) as f, open(expected_file) as g:
+                    meta, expected_meta = json.load(f), json.load(g)
+                # relations are listed in the order their first edge was seen
+                self.assertEqual(set(meta.pop("relations")), set(expected_meta.pop("relations")))
+                self.assertEqual(meta, expected_meta)
+            else:
+                with open(model_file, 'rb') as f, open(expected_file, 'rb') as g:
+                    self.assertEqual(f.read(), g.read(), name)
+        expected_graph, graph = network.get_table_join_graph(), assembled.get_table_join_graph()
+        self.assertEqual(graph.tables, expected_graph.tables)
+        np.testing.assert_array_equal(graph.pair_indptr, expected_graph.pair_indptr)
+        np.testing.assert_array_equal(graph.pair_src, expected_graph.pair_src)
+        np.testing.assert_array_equal(graph.pair_dst, expected_graph.pair_dst)
+        spill.clear()
+
+    def test_streamed_content_sim(self):
+        rnd = random.Random(3)
+        base = [set(rnd.sample(range(10000), 100)) for _ in range(15)]
+        fields = []
+        mh_signatures = []
+        for i in range(300):
+            values = set(v for v in base[i % 15] if rnd.random() < 0.9) | set(rnd.sample(range(10000), 20))
+            mh = MinHash(num_perm=512)
+            for v in values:
+                mh.update(str(v).encode('utf8'))
+            nid = str(1000 + i)
+            fields.append((nid, 'db', 't' + str(i % 20), 'f' + str(i), 10, 5, 'T'))
+            mh_signatures.append((nid, [int(v) for v in mh.hashvalues]))
+
+        network = make_network(fields)
+        index = networkbuilder.build_content_sim_mh_text_matrix(network, mh_signatures)
+
+        spilled_network = make_network(fields)
+        spill = outofcore.EdgeSpill(self.path + "/spill", spilled_network.iterate_ids(), max_edges=1000)
+        collector = outofcore.SpillingEdgeCollector(spilled_network, spill)
+        index_path = self.path + "/content_sim_index"
+        os.makedirs(index_path)
+        disk_index = networkbuilder.MatrixMinHashLSH(directory=index_path, chunk_rows=64)
+        chunks = [mh_signatures[i:i + 70] for i in range(0, len(mh_signatures), 70)]
+        nids, signatures = outofcore.write_mh_signatures(chunks, disk_index.signatures_path())
+        networkbuilder.build_content_sim_mh_text_streamed(collector, disk_index, signatures, nids, chunk_size=100)
+        self.assertSameEdges(edges_of(network, Relation.CONTENT_SIM), spill.assemble(spilled_network),
+                             Relation.CONTENT_SIM)
+
+        loaded_index = pickle.loads(pickle.dumps(disk_index))
+        self.assertIsInstance(loaded_index.band_orders[0], np.memmap)
+        for nid, mh_sig in mh_signatures[:10]:
+            self.assertEqual(set(index.query(mh_sig)), set(loaded_index.query(mh_sig)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from api.apiutils import Relation
+from knowledgerepr import rdf_conversor
+from knowledgerepr.testutils import edges_of
+from knowledgerepr.testutils import random_network
+
+
+class TestRDFExport(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.network, _ = random_network(8, 20, 60, [Relation.CONTENT_SIM, Relation.PKFK], num_sources=4,
+                                         field_format='f "{}"')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def triples_of(self, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, 'rt', encoding='utf8') as f:
+            lines = [l for l in f if not l.startswith("@prefix")]
+        triples = []
+        for line in lines:
+            self.assertTrue(line.endswith(" .\n"))
+            s, p, o = line[:-3].split(" ", 2)
+            triples.append((s, p, o))
+        return triples
+
+    def test_export_network(self):
+        for fmt, compress, processes in [('nt', False, 1), ('ttl', True, 2)]:
+            written = rdf_conversor.export_network(self.network, self.path, fmt=fmt, compress=compress,
+                                                   processes=processes, buffer_lines=7)
+            suffix = "." + fmt + (".gz" if compress else "")
+            self.assertEqual({os.path.join(self.path, name + suffix) for name in ["nodes", "CONTENT_SIM", "PKFK"]},
+                             set(written.keys()))
+            term = (lambda n: "ex:" + n) if fmt == 'ttl' else (lambda n: "<http://ex.org/" + n + ">")
+            for relation in [Relation.CONTENT_SIM, Relation.PKFK]:
+                path = os.path.join(self.path, relation.name + suffix)
+                triples = self.triples_of(path)
+                self.assertEqual(written[path], len(triples))
+                expected = {frozenset(term(nid) for nid in pair) for pair in edges_of(self.network, relation).keys()}
+                self.assertEqual(expected, {frozenset((s, o)) for s, p, o in triples})
+                self.assertEqual({term(relation.name)}, {p for s, p, o in triples})
+            nodes = self.triples_of(os.path.join(self.path, "nodes" + suffix))
+            self.assertIn((term("100"), term("field_name"), '"f \\"0\\""'), nodes)
+            self.assertEqual(3 * 20, len(nodes))
+
+    def test_export_edge_csv(self):
+        csv_path = os.path.join(self.path, "graph.csv")
+        with open(csv_path, 'w') as f:
+            f.write("source,target,type\n1,2,8\n2,3,8\n1,3,2\n")
+        written = rdf_conversor.export_edge_csv(csv_path, os.path.join(self.path, "out"), compress=True)
+        self.assertEqual({os.path.join(self.path, "out", "8.nt.gz"): 2, os.path.join(self.path, "out", "2.nt.gz"): 1},
+                         written)
+        self.assertEqual([("<http://ex.org/1>", "<http://ex.org/2>", "<http://ex.org/3>")],
+                         self.triples_of(os.path.join(self.path, "out", "2.nt.gz")))
+
+
+if __name__ == "__main__":
+    unittest.main()
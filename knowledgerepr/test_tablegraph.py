@@ -0,0 +1,142 @@
+import random
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from algebra import API
+from api.apiutils import Relation
+from knowledgerepr import fieldnetwork
+from knowledgerepr.tablegraph import ReachabilityIndex
+from knowledgerepr.tablegraph import TableJoinGraph
+from knowledgerepr.testutils import make_network
+from knowledgerepr.testutils import random_network
+
+
+class TestTableJoinGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.network, _ = random_network(9, 32, 14, [Relation.PKFK], num_sources=8)
+        self.graph = TableJoinGraph.from_network(self.network)
+
+    def paths_of(self, drs):
+        return set(tuple(h.nid for h in p) for p in drs.paths())
+
+    def test_same_paths_as_field_search(self):
+        api = API(self.network, MagicMock())
+        indexed = fieldnetwork.FieldNetwork(self.network._get_underlying_repr_graph(),
+                                            self.network._get_underlying_repr_id_to_field_info())
+        # every key pair of each join, as the field search follows them all
+        indexed.set_table_join_graph(self.graph, pairs_per_hop=32)
+        indexed_api = API(indexed, MagicMock())
+        found = 0
+        for i in range(8):
+            for j in range(i + 1, 8):
+                for max_hops in [1, 2, 3]:
+                    expected = self.network.find_path_table('t' + str(i), 't' + str(j), Relation.PKFK, api,
+                                                            max_hops=max_hops)
+                    result = indexed.find_path_table('t' + str(i), 't' + str(j), Relation.PKFK, indexed_api,
+                                                     max_hops=max_hops)
+                    # the field search stops at the first field of the target table it meets
+                    self.assertTrue(self.paths_of(expected) <= self.paths_of(result))
+                    for field_path in indexed._table_paths_from_join_graph('t' + str(i), 't' + str(j), max_hops):
+                        path = [h for c, sibling in field_path for h in [sibling, c] if h is not None]
+                        tables = [h.source_name for h in path]
+                        self.assertEqual(tables[0], 't' + str(i))
+                        self.assertEqual(tables[-1], 't' + str(j))
+                        joins = [(a, b) for a, b in zip(path, path[1:]) if a.source_name != b.source_name]
+                        self.assertTrue(len(joins) <= max_hops)
+                        self.assertEqual(len(joins) + 1, len(set(tables)))
+                        for a, b in joins:
+                            self.assertIn(b.nid, [h.nid for h in self.network.neighbors_id(a, Relation.PKFK)])
+                    found += len(self.paths_of(result))
+        self.assertTrue(found > 0)
+
+    def test_pairs_per_hop(self):
+        # a chain of 4 tables joined on 6 pairs of fields each: 6 ** 3 combinations of key pairs
+        fields = [(str(100 + 10 * t + i), 'db', 't' + str(t), 'f' + str(i), 10, 5, 'N')
+                  for t in range(4) for i in range(6)]
+        network = make_network(fields)
+        for t in range(3):
+            for i in range(6):
+                network.add_relation(str(100 + 10 * t + i), str(110 + 10 * t + i), Relation.PKFK, 0.5 + i / 100)
+        network.set_table_join_graph(TableJoinGraph.from_network(network))
+        paths = network._table_paths_from_join_graph('t0', 't3', 3)
+        self.assertEqual(len(paths), 1)
+        # the best pair of each join
+        self.assertEqual([c.nid for c, _ in paths[0]], ['105', '115', '125', '135'])
+        network.set_table_join_graph(network.get_table_join_graph(), pairs_per_hop=2)
+        self.assertEqual(len(network._table_paths_from_join_graph('t0', 't3', 3)), 2 ** 3)
+
+    def test_save_and_load(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.network.set_table_join_graph(self.graph)
+            fieldnetwork.serialize_network(self.network, path)
+            loaded = fieldnetwork.deserialize_network(path + '/', backend='csr').get_table_join_graph()
+            self.assertEqual(self.graph.tables, loaded.tables)
+            for table in self.graph.tables:
+                self.assertEqual(self.graph.neighbors_of(table), loaded.neighbors_of(table))
+                for other, _ in self.graph.neighbors_of(table):
+                    pairs = self.graph.key_pairs(table, other)
+                    self.assertEqual(pairs, loaded.key_pairs(table, other))
+                    self.assertEqual(sorted(pairs, key=lambda p: -p[2]), pairs)
+        finally:
+            shutil.rmtree(path)
+
+
+class TestReachabilityIndex(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(4)
+        fields = [(str(100 + i), 'db', 't' + str(i % 12), 'f' + str(i), 10, 5, 'N') for i in range(48)]
+        self.network = make_network(fields)
+        # two groups of tables that are never joined with each other
+        for _ in range(12):
+            src, tgt = rnd.choice(fields[:24]), rnd.choice(fields[:24])
+            if src[2] in ['t0', 't1', 't2', 't3', 't4', 't5'] and tgt[2] in ['t0', 't1', 't2', 't3', 't4', 't5']:
+                self.network.add_relation(src[0], tgt[0], Relation.PKFK, rnd.random())
+        for _ in range(10):
+            src, tgt = rnd.choice(fields[24:]), rnd.choice(fields[24:])
+            if src[2] not in ['t0', 't1', 't2', 't3', 't4', 't5'] and tgt[2] not in ['t0', 't1', 't2', 't3', 't4',
+                                                                                      't5']:
+                self.network.add_relation(src[0], tgt[0], Relation.PKFK, rnd.random())
+        self.graph = TableJoinGraph.from_network(self.network)
+
+    def hops(self, table1, table2):
+        if table1 == table2:
+            return 0
+        for max_hops in range(1, len(self.graph.tables)):
+            if len(self.graph.paths(table1, table2, max_hops=max_hops)) > 0:
+                return max_hops
+        return None
+
+    def check(self, index):
+        tables = ['t' + str(i) for i in range(12)]
+        for t1 in tables:
+            for t2 in tables:
+                hops = self.hops(t1, t2)
+                self.assertEqual(hops is not None, index.same_component([t1, t2]))
+                for max_hops in [1, 2, 3, 4]:
+                    self.assertEqual(hops is not None and hops <= max_hops, index.reachable(t1, t2, max_hops))
+
+    def test_reachable(self):
+        self.check(ReachabilityIndex.from_join_graph(self.graph))
+        # hop queries on components without bitsets and beyond the bitsets search the join graph
+        self.check(ReachabilityIndex.from_join_graph(self.graph, max_hops=1, max_component_tables=3))
+        index = ReachabilityIndex.from_join_graph(self.graph)
+        self.assertFalse(index.same_component(['t0', 't6']))
+        self.assertFalse(index.same_component(['t0', 'unknown']))
+
+    def test_save_and_load(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.network.set_table_join_graph(self.graph)
+            fieldnetwork.serialize_network(self.network, path)
+            self.check(fieldnetwork.deserialize_network(path + '/', backend='csr').get_reachability_index())
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import random
+from collections import defaultdict
+
+import networkx as nx
+
+from knowledgerepr.fieldnetwork import FieldNetwork
+
+
+def make_network(fields):
+    network = FieldNetwork(nx.MultiGraph(), dict(), defaultdict(list))
+    network.init_meta_schema(fields)
+    return network
+
+
+def edges_of(network, relation):
+    edges = dict()
+    G = network._get_underlying_repr_graph()
+    for src, tgt, key, data in G.edges(keys=True, data=True):
+        if key == relation:
+            edges[frozenset((src, tgt))] = data['score']
+    return edges
+
+
+def random_network(seed, num_fields, num_edges, relations, num_sources=6, source_format='t{}', field_format='f{}',
+                   data_type='N', random_cardinality=False, self_loops=True):
+    """
+    Builds a FieldNetwork with random edges, for tests
+    :param seed: seed of the random edges, scores and cardinalities
+    :param num_fields: fields with nids '100', '101', ..., of db 'db'
+    :param num_edges: number of random edges drawn
+    :param relations: the relations of the edges
+    :param num_sources: field i is in source source_format.format(i % num_sources)
+    :param field_format: field i is named field_format.format(i)
+    :param data_type: the data type of all fields
+    :param random_cardinality: if True, the unique values of each field are random, otherwise 5 of 10
+    :param self_loops: if False, the edges drawn from a field to itself are dropped
+    :return: (network, fields)
+    """
+    rnd = random.Random(seed)
+    fields = [(str(100 + i), 'db', source_format.format(i % num_sources), field_format.format(i), 10,
+               rnd.randint(0, 10) if random_cardinality else 5, data_type) for i in range(num_fields)]
+    network = make_network(fields)
+    for _ in range(num_edges):
+        src, tgt = rnd.choice(fields)[0], rnd.choice(fields)[0]
+        relation, score = rnd.choice(relations), rnd.random()
+        if self_loops or src != tgt:
+            network.add_relation(src, tgt, relation, score)
+    return network, fields
@@ -32,10 +32,10 @@ def __init_system(path_to_serialized_model, create_reporting=True):
     return api, reporting
 
 
-def init_system(path_to_serialized_model, create_reporting=False):
+def init_system(path_to_serialized_model, create_reporting=False, backend='networkx', mmap=False):
     print_md('Loading: *' + str(path_to_serialized_model) + "*")
     sl = time.time()
-    network = fieldnetwork.deserialize_network(path_to_serialized_model)
+    network = fieldnetwork.deserialize_network(path_to_serialized_model, backend=backend, mmap=mmap)
     store_client = StoreHandler()
     api = API(network=network, store_client=store_client)
     if create_reporting:
@@ -468,6 +468,78 @@ class StoreHandler:
         client.clear_scroll(scroll_id=scroll_id)
         return id_sig
 
+    def get_mh_text_signatures_in_chunks(self, chunk_size=1000):
+        """
+        Same as get_all_mh_text_signatures, but yields the signatures one scroll page at a time, so they do not
+        need to fit in memory
+        :param chunk_size: number of signatures per page
+        :return: generator of lists of (nid, minhash)
+        """
+        query_body = {
+            "query": {"bool": {"filter": [{"term": {"dataType": "T"}}]}}}
+        res = client.search(index='profile', body=query_body, scroll="10m", size=chunk_size,
+                            filter_path=['_scroll_id',
+                                         'hits.hits._id',
+                                         'hits.total',
+                                         'hits.hits._source.minhash']
+                            )
+        scroll_id = res['_scroll_id']
+        remaining = res['hits']['total']
+
+        while remaining > 0:
+            hits = res['hits']['hits']
+            if len(hits) == 0:
+                break
+            chunk = [(h['_id'], h['_source']['minhash']) for h in hits]
+            remaining -= len(chunk)
+            yield chunk
+            res = client.scroll(scroll="5m", scroll_id=scroll_id,
+                                filter_path=['_scroll_id',
+                                             'hits.hits._id',
+                                             'hits.hits._source.minhash']
+                                )
+            scroll_id = res['_scroll_id']  # update the scroll_id
+        client.clear_scroll(scroll_id=scroll_id)
+
+    def get_num_signatures_in_chunks(self, chunk_size=10000):
+        """
+        Same as get_all_fields_num_signatures, but yields the signatures one scroll page at a time
+        :param chunk_size: number of signatures per page
+        :return: generator of lists of (nid, (median, iqr, min, max))
+        """
+        query_body = {
+            "query": {"bool": {"filter": [{"term": {"dataType": "N"}}]}}}
+        res = client.search(index='profile', body=query_body, scroll="10m", size=chunk_size,
+                            filter_path=['_scroll_id',
+                                         'hits.hits._id',
+                                         'hits.total',
+                                         'hits.hits._source.median',
+                                         'hits.hits._source.iqr',
+                                         'hits.hits._source.minValue',
+                                         'hits.hits._source.maxValue']
+                            )
+        scroll_id = res['_scroll_id']
+        remaining = res['hits']['total']
+
+        while remaining > 0:
+            hits = res['hits']['hits']
+            if len(hits) == 0:
+                break
+            chunk = [(h['_id'], (h['_source']['median'], h['_source']['iqr'],
+                                 h['_source']['minValue'], h['_source']['maxValue'])) for h in hits]
+            remaining -= len(chunk)
+            yield chunk
+            res = client.scroll(scroll="5m", scroll_id=scroll_id,
+                                filter_path=['_scroll_id',
+                                             'hits.hits._id',
+                                             'hits.hits._source.median',
+                                             'hits.hits._source.iqr',
+                                             'hits.hits._source.minValue',
+                                             'hits.hits._source.maxValue']
+                                )
+            scroll_id = res['_scroll_id']  # update the scroll_id
+        client.clear_scroll(scroll_id=scroll_id)
+
     """
     Metadata
     """
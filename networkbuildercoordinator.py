@@ -2,101 +2,441 @@ from modelstore.elasticstore import StoreHandler
 from knowledgerepr import fieldnetwork
 from knowledgerepr import networkbuilder
 from knowledgerepr.fieldnetwork import FieldNetwork
+from knowledgerepr.fieldnetwork import Relation
+from knowledgerepr.tablegraph import TableJoinGraph
+from knowledgerepr.buildscheduler import StageScheduler
+from knowledgerepr.buildscheduler import Checkpoint
+from knowledgerepr.buildscheduler import num_signatures_to_arrays
+from knowledgerepr.buildscheduler import num_signatures_from_arrays
+from knowledgerepr import buildmetrics
+from knowledgerepr import outofcore
 from inputoutput import inputoutput as io
 
-import sys
+import argparse
+import os
+import shutil
 import time
 
+from functools import partial
 
-def main(output_path=None):
-    start_all = time.time()
-    network = FieldNetwork()
-    store = StoreHandler()
+import numpy as np
 
-    # Get all fields from store
-    fields_gen = store.get_all_fields()
 
-    # Network skeleton and hierarchical relations (table - field), etc
-    start_schema = time.time()
-    network.init_meta_schema(fields_gen)
-    end_schema = time.time()
-    print("Total skeleton: {0}".format(str(end_schema - start_schema)))
-    print("!!1 " + str(end_schema - start_schema))
-
-    # Schema_sim relation
-    start_schema_sim = time.time()
-    schema_sim_index = networkbuilder.build_schema_sim_relation(network)
-    end_schema_sim = time.time()
-    print("Total schema-sim: {0}".format(str(end_schema_sim - start_schema_sim)))
-    print("!!2 " + str(end_schema_sim - start_schema_sim))
-
-    # Entity_sim relation
-    start_entity_sim = time.time()
-    #fields, entities = store.get_all_fields_entities()
-    #networkbuilder.build_entity_sim_relation(network, fields, entities)
-    end_entity_sim = time.time()
-    print("Total entity-sim: {0}".format(str(end_entity_sim - start_entity_sim)))
+# numerical signatures of the fields, kept with the model so that an incremental update can find the changed ones
+NUM_SIGNATURES_FILE = "num_signatures.npz"
+
+
+def save_model_num_signatures(model_path, id_sig):
+    np.savez(os.path.join(model_path, NUM_SIGNATURES_FILE), **num_signatures_to_arrays(id_sig))
 
+
+def load_model_num_signatures(model_path):
     """
-    # Content_sim text relation (random-projection based)
-    start_text_sig_sim = time.time()
+    :return: list of (nid, (median, iqr, min, max)), or None for models built without them
+    """
+    path = os.path.join(model_path, NUM_SIGNATURES_FILE)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return num_signatures_from_arrays({k: data[k] for k in data.files})
+
+
+def build_schema_sim(network):
+    #schema_sim_index = networkbuilder.build_schema_sim_relation(network)
+    return networkbuilder.build_schema_sim_relation_sparse(network)
+
+
+def build_entity_sim(network):
+    with buildmetrics.step("pull_entities"):
+        store = StoreHandler()
+        fields, entities = store.get_all_fields_entities()
+    buildmetrics.add_rows_pulled(len(fields))
+    #networkbuilder.build_entity_sim_relation(network, fields, entities)
+    networkbuilder.build_entity_sim_relation_sparse(network, fields, entities)
+    return None
+
+
+def build_content_sim_text(network, checkpoint=None):
     st = time.time()
-    text_signatures = store.get_all_fields_text_signatures(network)
+    if checkpoint is not None and checkpoint.has("mh_signatures"):
+        mh_signatures = checkpoint.load_mh_signatures("mh_signatures")
+    else:
+        # Each stage may run in its own process, so it opens its own connection to the store
+        with buildmetrics.step("pull_mh_signatures"):
+            store = StoreHandler()
+            mh_signatures = store.get_all_mh_text_signatures()
+        buildmetrics.add_rows_pulled(len(mh_signatures))
+        if checkpoint is not None:
+            checkpoint.save_mh_signatures("mh_signatures", mh_signatures)
     et = time.time()
-    print("Time to extract signatures from store: {0}".format(str(et - st)))
-    print("!!3 " + str(et - st))
+    print("Time to extract minhash signatures from store: {0}".format(str(et - st)))
 
+    """
+    # Content_sim text relation (random-projection based)
+    text_signatures = store.get_all_fields_text_signatures(network)
     networkbuilder.build_content_sim_relation_text_lsa(network, text_signatures)
-    end_text_sig_sim = time.time()
-    print("Total text-sig-sim: {0}".format(str(end_text_sig_sim - start_text_sig_sim)))
-    print("!!4 " + str(end_text_sig_sim - start_text_sig_sim))
     """
 
-    # Content_sim text relation (minhash-based)
-    start_text_sig_sim = time.time()
-    st = time.time()
-    mh_signatures = store.get_all_mh_text_signatures()
-    et = time.time()
-    print("Time to extract minhash signatures from store: {0}".format(str(et - st)))
-    print("!!3 " + str(et - st))
+    #return networkbuilder.build_content_sim_mh_text(network, mh_signatures)
+    return networkbuilder.build_content_sim_mh_text_matrix(network, mh_signatures)
 
-    content_sim_index = networkbuilder.build_content_sim_mh_text(network, mh_signatures)
-    end_text_sig_sim = time.time()
-    print("Total text-sig-sim (minhash): {0}".format(str(end_text_sig_sim - start_text_sig_sim)))
-    print("!!4 " + str(end_text_sig_sim - start_text_sig_sim))
 
-    # Content_sim num relation
-    start_num_sig_sim = time.time()
-    id_sig = store.get_all_fields_num_signatures()
+def build_content_sim_num(network, checkpoint=None):
+    if checkpoint is not None and checkpoint.has("num_signatures"):
+        id_sig = checkpoint.load_num_signatures("num_signatures")
+    else:
+        with buildmetrics.step("pull_num_signatures"):
+            store = StoreHandler()
+            id_sig = store.get_all_fields_num_signatures()
+        buildmetrics.add_rows_pulled(len(id_sig))
+        if checkpoint is not None:
+            checkpoint.save_num_signatures("num_signatures", id_sig)
     #networkbuilder.build_content_sim_relation_num(network, id_sig)
-    networkbuilder.build_content_sim_relation_num_overlap_distr(network, id_sig)
-    #networkbuilder.build_content_sim_relation_num_overlap_distr_indexed(network, id_sig)
-    end_num_sig_sim = time.time()
-    print("Total num-sig-sim: {0}".format(str(end_num_sig_sim - start_num_sig_sim)))
-    print("!!5 " + str(end_num_sig_sim - start_num_sig_sim))
+    #networkbuilder.build_content_sim_relation_num_overlap_distr(network, id_sig)
+    networkbuilder.build_content_sim_relation_num_overlap_distr_indexed(network, id_sig)
+    return None
+
+
+def build_pkfk(network):
+    #networkbuilder.build_pkfk_relation(network)
+    networkbuilder.build_pkfk_relation_vectorized(network)
+    return None
 
-    # Primary Key / Foreign key relation
-    start_pkfk = time.time()
-    networkbuilder.build_pkfk_relation(network)
-    end_pkfk = time.time()
-    print("Total PKFK: {0}".format(str(end_pkfk - start_pkfk)))
-    print("!!6 " + str(end_pkfk - start_pkfk))
+
+def main(output_path=None, workers=1, resume=False, progress=None):
+    """
+    Builds the model from the profiles in the store and serializes it, with a report of the build metrics
+    :param output_path: directory where the model is written
+    :param workers: max number of stages running at the same time
+    :param resume: reload the output of the stages completed by a previous build that failed
+    :param progress: optional function called as progress(event, stage name, StageRecord or None)
+    """
+    start_all = time.time()
+    path = "test/datagov/"
+    if output_path is not None:
+        path = output_path
+
+    # The output of every stage is kept next to the output path until the model is serialized
+    checkpoint = Checkpoint(os.path.normpath(path) + ".checkpoint", resume=resume)
+
+    network = FieldNetwork()
+    metrics = buildmetrics.BuildMetrics(progress=progress)
+
+    # Network skeleton and hierarchical relations (table - field), etc
+    metrics.stage_started("skeleton")
+    with buildmetrics.record_stage("skeleton") as record:
+        if checkpoint.has("fields"):
+            fields = checkpoint.load_fields("fields")
+            record.from_checkpoint = True
+        else:
+            # Get all fields from store
+            with buildmetrics.step("pull_fields"):
+                store = StoreHandler()
+                fields = list(store.get_all_fields())
+            buildmetrics.add_rows_pulled(len(fields))
+            checkpoint.save_fields("fields", fields)
+        with buildmetrics.step("init_meta_schema"):
+            network.init_meta_schema(fields)
+    metrics.add(record)
+    print("Total skeleton: {0}".format(str(record.wall_time)))
+
+    # Relations are built by independent stages, PKFK needs content-sim (text) and inclusion-dependency (num)
+    scheduler = StageScheduler(workers=workers, checkpoint=checkpoint, metrics=metrics)
+    scheduler.add_stage("schema_sim", build_schema_sim)
+    scheduler.add_stage("entity_sim", build_entity_sim)
+    scheduler.add_stage("content_sim_text", partial(build_content_sim_text, checkpoint=checkpoint))
+    scheduler.add_stage("content_sim_num", partial(build_content_sim_num, checkpoint=checkpoint))
+    scheduler.add_stage("pkfk", build_pkfk, deps=["content_sim_text", "content_sim_num"])
+    results = scheduler.run(network)
+
+    metrics.stage_started("table_join_graph")
+    with buildmetrics.record_stage("table_join_graph") as record:
+        network.set_table_join_graph(TableJoinGraph.from_network(network))
+    metrics.add(record)
+
+    metrics.stage_started("serialize")
+    with buildmetrics.record_stage("serialize") as record:
+        fieldnetwork.serialize_network(network, path)
+
+        # Serialize indexes
+        path_schsim = path + "/schema_sim_index.pkl"
+        io.serialize_object(results["schema_sim"], path_schsim)
+        path_cntsim = path + "/content_sim_index.pkl"
+        io.serialize_object(results["content_sim_text"], path_cntsim)
+        # the content_sim_num stage left the signatures in the checkpoint
+        shutil.copyfile(checkpoint.file_of("num_signatures"), os.path.join(path, NUM_SIGNATURES_FILE))
+    metrics.add(record)
 
     end_all = time.time()
     print("Total time: {0}".format(str(end_all - start_all)))
-    print("!!7 " + str(end_all - start_all))
+    metrics.print_report()
+    metrics.write_report(path)
 
+    checkpoint.clear()
+    print("DONE!")
+
+
+def main_out_of_core(output_path=None, memory_budget=4096, progress=None):
+    """
+    Builds the same model as main, for lakes whose signatures and edges do not fit in memory. Signatures are
+    streamed from the store into memory-mapped files, relations are spilled to sorted runs on disk, and the runs
+    are merged into the memory-mapped CSR columns of the binary model. PKFK and the table join graph are computed
+    from those columns, so no graph of the edges is built. Besides the budget, memory holds the meta schema and a
+    few arrays per node, which grow with the number of fields, and the table join graph, which keeps the PKFK pairs
+    between tables
+    :param output_path: directory where the model is written
+    :param memory_budget: megabytes of memory for signature chunks and edge buffers
+    :param progress: optional function called as progress(event, stage name, StageRecord or None)
+    """
+    start_all = time.time()
     path = "test/datagov/"
     if output_path is not None:
         path = output_path
-    fieldnetwork.serialize_network(network, path)
+    os.makedirs(path, exist_ok=True)
+    budget = outofcore.MemoryBudget(memory_budget)
+    metrics = buildmetrics.BuildMetrics(progress=progress)
+    store = StoreHandler()
+    network = FieldNetwork()
+
+    metrics.stage_started("skeleton")
+    with buildmetrics.record_stage("skeleton") as record:
+        with buildmetrics.step("pull_fields"):
+            fields = list(store.get_all_fields())
+        buildmetrics.add_rows_pulled(len(fields))
+        with buildmetrics.step("init_meta_schema"):
+            network.init_meta_schema(fields)
+        del fields
+    metrics.add(record)
+
+    spill = outofcore.EdgeSpill(os.path.normpath(path) + ".spill", network.iterate_ids(),
+                                max_edges=budget.rows(outofcore.EdgeSpill.bytes_per_edge))
+    collector = outofcore.SpillingEdgeCollector(network, spill)
+
+    metrics.stage_started("schema_sim")
+    with buildmetrics.record_stage("schema_sim") as record:
+        schema_sim_index = networkbuilder.build_schema_sim_relation_sparse(collector)
+    metrics.add(record)
+
+    metrics.stage_started("entity_sim")
+    with buildmetrics.record_stage("entity_sim") as record:
+        build_entity_sim(collector)
+    metrics.add(record)
+
+    metrics.stage_started("content_sim_text")
+    with buildmetrics.record_stage("content_sim_text") as record:
+        index_path = os.path.abspath(path + "/content_sim_index")
+        os.makedirs(index_path, exist_ok=True)
+        content_sim_index = networkbuilder.MatrixMinHashLSH(directory=index_path)
+        # a band of a chunk of rows, its hashes and the comparison with the group heads
+        content_sim_index.chunk_rows = budget.rows(content_sim_index.r * 8 * 3 + 16)
+        with buildmetrics.step("pull_mh_signatures"):
+            chunks = store.get_mh_text_signatures_in_chunks(chunk_size=min(10000, budget.rows(512 * 8 * 4)))
+            nids, signatures = outofcore.write_mh_signatures(chunks, content_sim_index.signatures_path())
+        buildmetrics.add_rows_pulled(len(nids))
+        networkbuilder.build_content_sim_mh_text_streamed(collector, content_sim_index, signatures, nids,
+                                                          chunk_size=budget.rows(32))
+    metrics.add(record)
+
+    metrics.stage_started("content_sim_num")
+    with buildmetrics.record_stage("content_sim_num") as record:
+        # numerical signatures are four values per field, they are pulled in chunks but kept in memory
+        with buildmetrics.step("pull_num_signatures"):
+            id_sig = [sig for chunk in store.get_num_signatures_in_chunks() for sig in chunk]
+        buildmetrics.add_rows_pulled(len(id_sig))
+        networkbuilder.build_content_sim_relation_num_overlap_distr_indexed(collector, id_sig,
+                                                                            chunk_size=budget.rows(256))
+        save_model_num_signatures(path, id_sig)
+        del id_sig
+    metrics.add(record)
+
+    metrics.stage_started("assemble")
+    with buildmetrics.record_stage("assemble") as record:
+        network = spill.assemble(network)
+        record.edges.update((relation.name, total) for relation, total in spill.edge_counts.items())
+    metrics.add(record)
+
+    metrics.stage_started("pkfk")
+    with buildmetrics.record_stage("pkfk") as record:
+        networkbuilder.build_pkfk_relation_csr(network, spill.add_dense, max_nnz=budget.rows(32))
+        network = spill.assemble(network)
+        record.edges[Relation.PKFK.name] = network.relation_count(Relation.PKFK)
+    metrics.add(record)
+
+    metrics.stage_started("table_join_graph")
+    with buildmetrics.record_stage("table_join_graph") as record:
+        network.set_table_join_graph(TableJoinGraph.from_network(network))
+    metrics.add(record)
+
+    metrics.stage_started("serialize")
+    with buildmetrics.record_stage("serialize") as record:
+        fieldnetwork.serialize_network(network, path)
+        io.serialize_object(schema_sim_index, path + "/schema_sim_index.pkl")
+        # only a reference to the arrays in content_sim_index/
+        io.serialize_object(content_sim_index, path + "/content_sim_index.pkl")
+        # the CSR columns were memory-mapped from the spill directory
+        del network
+        spill.clear()
+    metrics.add(record)
+
+    end_all = time.time()
+    print("Total time: {0}".format(str(end_all - start_all)))
+    metrics.print_report()
+    metrics.write_report(path)
+    print("DONE!")
 
-    # Serialize indexes
-    path_schsim = path + "/schema_sim_index.pkl"
-    io.serialize_object(schema_sim_index, path_schsim)
-    path_cntsim = path + "/content_sim_index.pkl"
-    io.serialize_object(content_sim_index, path_cntsim)
 
+def diff_fields(network, fields, content_sim_index, mh_signatures, num_signatures=None, model_num_signatures=None):
+    """
+    Compares the fields in the store with the ones in the model
+    :param network: the FieldNetwork of the model
+    :param fields: all fields in the store, as returned by get_all_fields
+    :param content_sim_index: the MatrixMinHashLSH of the model
+    :param mh_signatures: all text signatures in the store
+    :param num_signatures: all numerical signatures in the store
+    :param model_num_signatures: the numerical signatures the model was built with
+    :return: (new nids, changed nids, removed nids)
+    """
+    id_info = network._get_underlying_repr_id_to_field_info()
+    new = set()
+    changed = set()
+    present = set()
+    for (nid, db_name, sn_name, fn_name, total_values, unique_values, data_type) in fields:
+        present.add(nid)
+        if nid not in id_info:
+            new.add(nid)
+            continue
+        cardinality_ratio = None
+        if float(total_values) > 0:
+            cardinality_ratio = float(unique_values) / float(total_values)
+        if id_info[nid] != (db_name, sn_name, fn_name, data_type) or \
+                network._get_underlying_repr_graph().node[nid]['cardinality'] != cardinality_ratio:
+            changed.add(nid)
+    removed = set(id_info.keys()) - present
+
+    # Text fields whose content changed have a different minhash
+    row_of = {key: row for row, key in enumerate(content_sim_index.keys)}
+    for nid, mh_sig in mh_signatures:
+        if nid in row_of and nid not in new and nid not in changed:
+            if np.any(content_sim_index.signatures[row_of[nid]] != np.asarray(mh_sig, dtype=np.uint64)):
+                changed.add(nid)
+
+    # Numerical fields whose distribution changed have a different signature, even with the same cardinality
+    if num_signatures is not None and model_num_signatures is not None:
+        model_sig = dict(model_num_signatures)
+        for nid, sig in num_signatures:
+            if nid in model_sig and nid not in new and tuple(model_sig[nid]) != tuple(sig):
+                changed.add(nid)
+    return new, changed, removed
+
+
+def update(model_path, progress=None):
+    """
+    Updates the model in model_path with the fields added, changed or removed from the store since it was built.
+    Changed fields are removed and added again, and relations are only computed for the added fields, except
+    ENTITY_SIM, whose top-k neighbours are global and is built again for all fields. The report of the build
+    metrics of the update replaces the one of the model
+    :param model_path: directory of the serialized model
+    :param progress: optional function called as progress(event, stage name, StageRecord or None)
+    """
+    start_all = time.time()
+    path = model_path + '/'
+    metrics = buildmetrics.BuildMetrics(progress=progress)
+
+    def count_new_edges(record, relation, before):
+        record.edges[relation.name] = network.relation_count(relation) - before.get(relation, 0)
+
+    metrics.stage_started("diff")
+    with buildmetrics.record_stage("diff") as record:
+        with buildmetrics.step("deserialize"):
+            network = fieldnetwork.deserialize_network(path)
+            schema_sim_index = io.deserialize_object(path + "schema_sim_index.pkl")
+            content_sim_index = io.deserialize_object(path + "content_sim_index.pkl")
+        store = StoreHandler()
+
+        with buildmetrics.step("pull_signatures"):
+            fields = list(store.get_all_fields())
+            mh_signatures = store.get_all_mh_text_signatures()
+            id_sig = store.get_all_fields_num_signatures()
+        buildmetrics.add_rows_pulled(len(fields))
+        model_num_signatures = load_model_num_signatures(path)
+        if model_num_signatures is None:
+            print("WARNING the model has no numerical signatures, changes of numerical fields are only found by "
+                  "their cardinality")
+        with buildmetrics.step("diff_fields"):
+            new, changed, removed = diff_fields(network, fields, content_sim_index, mh_signatures,
+                                                num_signatures=id_sig, model_num_signatures=model_num_signatures)
+    metrics.add(record)
+    print("New: {0} changed: {1} removed: {2}".format(len(new), len(changed), len(removed)))
+    if len(new) + len(changed) + len(removed) == 0:
+        if model_num_signatures is None:
+            save_model_num_signatures(path, id_sig)
+        print("Model is up to date")
+        return
+
+    # Network skeleton
+    metrics.stage_started("skeleton")
+    with buildmetrics.record_stage("skeleton") as record:
+        for nid in removed | changed:
+            network.remove_field(nid)
+        added = new | changed
+        network.init_meta_schema([f for f in fields if f[0] in added])
+    metrics.add(record)
+
+    before = {relation: network.relation_count(relation) for relation in Relation}
+
+    metrics.stage_started("schema_sim")
+    with buildmetrics.record_stage("schema_sim") as record:
+        networkbuilder.update_schema_sim_relation_sparse(network, schema_sim_index, added, removed | changed)
+        count_new_edges(record, Relation.SCHEMA_SIM, before)
+    metrics.add(record)
+
+    metrics.stage_started("entity_sim")
+    with buildmetrics.record_stage("entity_sim") as record:
+        with buildmetrics.step("pull_entities"):
+            entity_fields, entities = store.get_all_fields_entities()
+        buildmetrics.add_rows_pulled(len(entity_fields))
+        networkbuilder.update_entity_sim_relation_sparse(network, entity_fields, entities)
+        # the relation is built again, all its edges are new
+        count_new_edges(record, Relation.ENTITY_SIM, dict())
+    metrics.add(record)
+
+    metrics.stage_started("content_sim_text")
+    with buildmetrics.record_stage("content_sim_text") as record:
+        added_mh_signatures = [(nid, mh_sig) for nid, mh_sig in mh_signatures if nid in added]
+        networkbuilder.update_content_sim_mh_text_matrix(network, content_sim_index, added_mh_signatures,
+                                                         removed | changed)
+        count_new_edges(record, Relation.CONTENT_SIM, before)
+    metrics.add(record)
+
+    metrics.stage_started("content_sim_num")
+    with buildmetrics.record_stage("content_sim_num") as record:
+        networkbuilder.build_content_sim_relation_num_overlap_distr_indexed(network, id_sig, nids=added)
+        count_new_edges(record, Relation.INCLUSION_DEPENDENCY, before)
+    metrics.add(record)
+
+    metrics.stage_started("pkfk")
+    with buildmetrics.record_stage("pkfk") as record:
+        networkbuilder.update_pkfk_relation(network, added)
+        count_new_edges(record, Relation.PKFK, before)
+    metrics.add(record)
+
+    metrics.stage_started("table_join_graph")
+    with buildmetrics.record_stage("table_join_graph") as record:
+        network.set_table_join_graph(TableJoinGraph.from_network(network))
+    metrics.add(record)
+
+    metrics.stage_started("serialize")
+    with buildmetrics.record_stage("serialize") as record:
+        fieldnetwork.serialize_network(network, model_path)
+        io.serialize_object(schema_sim_index, path + "schema_sim_index.pkl")
+        io.serialize_object(content_sim_index, path + "content_sim_index.pkl")
+        save_model_num_signatures(path, id_sig)
+    metrics.add(record)
+
+    end_all = time.time()
+    print("Total time: {0}".format(str(end_all - start_all)))
+    metrics.print_report()
+    metrics.write_report(model_path)
     print("DONE!")
 
 
@@ -158,16 +498,33 @@ if __name__ == "__main__":
     #test_content_sim_num()
     #exit()
 
-    path = None
-    if len(sys.argv) == 3:
-        path = sys.argv[2]
-
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--opath', help='Path where to write the model, must be writable by the process',
+                        required=True)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used to build independent relations in parallel')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Update the model in opath with the fields added, changed or removed from the store')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip the stages completed by a previous build that failed, and reload their output')
+    parser.add_argument('--out-of-core', action='store_true',
+                        help='Keep signatures and candidate edges on disk, for lakes that do not fit in memory')
+    parser.add_argument('--memory-budget', type=int, default=4096,
+                        help='Megabytes of memory for signature chunks and edge buffers in an out-of-core build')
+    args = parser.parse_args()
+    if args.out_of_core and args.workers != 1:
+        parser.error("--out-of-core builds the relations one at a time, it does not support --workers")
+    if args.out_of_core and args.resume:
+        parser.error("--out-of-core does not keep stage checkpoints, it does not support --resume")
+    if args.incremental and (args.out_of_core or args.workers != 1 or args.resume):
+        parser.error("--incremental does not support --out-of-core, --workers or --resume")
+
+    if args.incremental:
+        update(args.opath)
+    elif args.out_of_core:
+        main_out_of_core(args.opath, memory_budget=args.memory_budget)
     else:
-        print("USAGE: ")
-        print("python networkbuildercoordinator.py --opath <path>")
-        print("where opath must be writable by the process")
-        exit()
-    main(path)
+        main(args.opath, workers=args.workers, resume=args.resume)
 
     #test_read_store()
 
@@ -28,7 +28,10 @@ from modelstore.elasticstore import KWType
 path_to_serialized_model = C.path_model
 sep = C.separator
 print("Configuring DoD with model: " + str(path_to_serialized_model) + " separator: " + str(sep))
-network = fieldnetwork.deserialize_network(path_to_serialized_model)
+if C.mmap_model:
+    network = fieldnetwork.deserialize_network(path_to_serialized_model, backend='csr', mmap=True)
+else:
+    network = fieldnetwork.deserialize_network(path_to_serialized_model)
 store_client = StoreHandler()
 
 global dod
@@ -214,6 +217,7 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--model', default='nofile', help='path to aurum model')
     parser.add_argument('--separator', default=',', help='path to aurum model')
+    parser.add_argument('--mmap', action='store_true', help='memory-map the model, shared by all workers')
 
     args = parser.parse_args()
 
@@ -224,7 +228,10 @@ if __name__ == '__main__':
     # basic test
     path_to_serialized_model = args.model
     sep = args.sep
-    network = fieldnetwork.deserialize_network(path_to_serialized_model)
+    if args.mmap:
+        network = fieldnetwork.deserialize_network(path_to_serialized_model, backend='csr', mmap=True)
+    else:
+        network = fieldnetwork.deserialize_network(path_to_serialized_model)
     store_client = StoreHandler()
 
     global dod
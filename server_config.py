@@ -6,3 +6,5 @@ path_model = "/Users/ra-mit/development/discovery_proto/models/massdata/"
 separator = ","
 #path_model = "/Users/ra-mit/development/discovery_proto/models/mitdwh/"
 #separator = ","
+# memory-map the model (binary format only), so all the server workers of a host share one copy of it
+mmap_model = False
@@ -1,8 +1,10 @@
 import unittest
 from collections import namedtuple
 from modelstore.elasticstore import KWType
-from api.apiutils import Relation
+from api.apiutils import Relation, Operation, OP, Hit, set_lazy_provenance
 from algebra import API, DRS
+from knowledgerepr.csrnetwork import CSRFieldNetwork
+from knowledgerepr.testutils import random_network
 from mock import MagicMock, patch
 
 
@@ -248,6 +250,56 @@ class TestAlgebraHelpers(unittest.TestCase):
         self.assertTrue(res)
 
 
+class TestNeighborSearchBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.network, _ = random_network(4, 40, 150, [Relation.CONTENT_SIM, Relation.PKFK], num_sources=5,
+                                         data_type='T')
+        self.input_drs = DRS([Hit(str(100 + i), 'db', 't' + str(i % 5), 'f' + str(i), 0) for i in range(0, 40, 3)],
+                             Operation(OP.ORIGIN))
+
+    def one_by_one(self, network):
+        o_drs = DRS([], Operation(OP.NONE))
+        o_drs = o_drs.absorb_provenance(self.input_drs)
+        for h in self.input_drs:
+            o_drs = o_drs.absorb(network.neighbors_id(h, Relation.CONTENT_SIM))
+        return o_drs
+
+    def assert_same_scores(self, expected, o_drs):
+        # hits compare by nid only, so compare the scores too: the last score absorbed for a nid wins
+        expected = sorted((h.nid, h.score) for h in expected.data)
+        found = sorted((h.nid, h.score) for h in o_drs.data)
+        self.assertEqual([nid for nid, _ in expected], [nid for nid, _ in found])
+        for (_, score1), (_, score2) in zip(expected, found):
+            self.assertAlmostEqual(score1, score2, places=6)
+
+    def test_same_data_and_provenance(self):
+        expected = self.one_by_one(self.network)
+        for network in [self.network, CSRFieldNetwork.from_field_network(self.network)]:
+            api = API(network, MagicMock())
+            o_drs = api.content_similar_to(self.input_drs)
+            self.assertEqual(set(expected.data), set(o_drs.data))
+            self.assert_same_scores(expected, o_drs)
+            self.assertEqual(set(expected.get_provenance().prov_graph().edges(keys=True)),
+                             set(o_drs.get_provenance().prov_graph().edges(keys=True)))
+            self.assertEqual(set(expected.get_provenance().prov_graph().nodes()),
+                             set(o_drs.get_provenance().prov_graph().nodes()))
+
+    def test_lazy_provenance(self):
+        expected = self.one_by_one(self.network)
+        set_lazy_provenance(True)
+        try:
+            o_drs = API(self.network, MagicMock()).content_similar_to(self.input_drs)
+        finally:
+            set_lazy_provenance(False)
+        self.assertTrue(o_drs.get_provenance().lazy)
+        self.assertEqual(set(expected.data), set(o_drs.data))
+        self.assert_same_scores(expected, o_drs)
+        self.assertEqual(set(expected.get_provenance().prov_graph().edges(keys=True)),
+                         set(o_drs.get_provenance().prov_graph().edges(keys=True)))
+        self.assertEqual(len(expected.paths()), len(o_drs.paths()))
+
+
 if __name__ == '__main__':
     #unittest.main()
 
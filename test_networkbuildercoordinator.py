@@ -0,0 +1,50 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import networkbuildercoordinator as coordinator
+from knowledgerepr.networkbuilder import MatrixMinHashLSH
+from knowledgerepr.testutils import make_network
+
+
+class TestDiffFields(unittest.TestCase):
+
+    def setUp(self):
+        self.fields = [('1', 'db', 'a', 'name', 10, 10, 'T'),
+                       ('2', 'db', 'a', 'age', 10, 5, 'N'),
+                       ('3', 'db', 'b', 'height', 10, 8, 'N')]
+        self.network = make_network(self.fields)
+        self.index = MatrixMinHashLSH()
+        self.mh_signatures = [('1', [1, 2, 3, 4])]
+        self.index.keys = ['1']
+        self.index.signatures = np.asarray([[1, 2, 3, 4]], dtype=np.uint64)
+        self.num_signatures = [('2', (30, 10, 18, 65)), ('3', (1.7, 0.2, 1.5, 2.1))]
+
+    def test_numerical_distribution_changed(self):
+        # same fields and cardinalities, but the distribution of height changed
+        store_num_signatures = [('2', (30, 10, 18, 65)), ('3', (1.8, 0.2, 1.5, 2.2))]
+        new, changed, removed = coordinator.diff_fields(self.network, self.fields, self.index, self.mh_signatures,
+                                                        num_signatures=store_num_signatures,
+                                                        model_num_signatures=self.num_signatures)
+        self.assertEqual((new, changed, removed), (set(), {'3'}, set()))
+
+    def test_up_to_date(self):
+        new, changed, removed = coordinator.diff_fields(self.network, self.fields, self.index, self.mh_signatures,
+                                                        num_signatures=self.num_signatures,
+                                                        model_num_signatures=self.num_signatures)
+        self.assertEqual((new, changed, removed), (set(), set(), set()))
+
+    def test_num_signatures_round_trip(self):
+        path = tempfile.mkdtemp()
+        try:
+            self.assertIsNone(coordinator.load_model_num_signatures(path))
+            coordinator.save_model_num_signatures(path, self.num_signatures)
+            self.assertEqual(coordinator.load_model_num_signatures(path), self.num_signatures)
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    unittest.main()